@@ -4,155 +4,58 @@ __author__ = "Daniel Ralston"
 __copyright__ = "2012, Daniel Ralston"
 __version__ = "0.1.0"
 
-import hashlib
 import os
-import pickle
 import shutil
-import string
-import subprocess
-import sys # for platform
-
-from helpers import (get_called_script_dir, get_config_path,
-                     read_config, save_config)
-
-# Compensate for Python 2.x and 3.x having different module names, and
-# no good way to make the same imports work on both.
-try:
-    # Widgets
-    from tkinter import (Button, Entry, Frame, Label, Listbox,
-                         Scrollbar, Tk, StringVar)
-    from tkinter import messagebox, filedialog
-    # Constants
-    from tkinter import BOTH, BOTTOM, END, LEFT, N, S, W, E, X, Y
-except ImportError:
-    # Widgets
-    from Tkinter import (Button, Entry, Frame, Label, Listbox,
-                         Scrollbar, Tk, StringVar)
-    import tkMessageBox as messagebox, tkFileDialog as filedialog
-    # Constants
-    from Tkinter import BOTH, BOTTOM, END, LEFT, N, S, W, E, X, Y
+import threading
+import time
 
-## GLOBAL VARS
-# A common-denominator between Python 2.x and 3.x
-CONFIG_FILENAME = "NoteBag.ini"
-TEMPLATE_CONFIG_FILENAME = "Template-NoteBag.ini"
-PICKLE_PROTOCOL = 2
-
-
-def notes_checksum(notes):
-    """
-    Return the hash digest of a list of notes as a string.
-    """
-
-    digest = hashlib.sha1()
-    for note_name in notes:
-        note_name_bytes = note_name.encode('utf-8')
-        filename_bytes = notes[note_name].encode('utf-8')
-        digest.update(note_name_bytes)
-        digest.update(filename_bytes)
-    return digest.hexdigest()
-
-def save_notes_list(notes, file_path):
-    """
-    Write a list of notes out to a file. Also write a checksum of the
-    notes list, so read_notes_list() can validate what it reads.
-    """
-
-    with open(file_path, "wb") as f:
-        pickle.dump(notes_checksum(notes), f, PICKLE_PROTOCOL)
-        pickle.dump(notes, f, PICKLE_PROTOCOL)
-
-def read_notes_list(file_path):
-    """
-    Read a list of notes back from a file.
-
-    If the checksum from the file doesn't match the checksum of all of
-    the notes that were read from it, raise a ValueError.
-    """
-
-    with open(file_path, "rb") as f:
-        saved_checksum = pickle.load(f)
-        notes = pickle.load(f)
+from catalog import CONFIG_FILENAME, TEMPLATE_CONFIG_FILENAME, NoteCatalog
+from helpers import get_config_path, read_config, save_config
+from search_scheduler import SearchScheduler
+from widgets import VirtualListbox
 
-    loaded_checksum = notes_checksum(notes)
-    if loaded_checksum != saved_checksum:
-        raise ValueError("The list of notes has been corrupted")
-    return notes
+# Widgets
+from tkinter import Button, Entry, Frame, Label, Text, Tk, Toplevel, StringVar
+from tkinter import messagebox, filedialog
+# Constants
+from tkinter import BOTH, BOTTOM, END, LEFT, N, S, W, E, X, Y
 
-def sanitize_note_name(note_name):
-    """
-    Very conservatively remove any characters from a note name that
-    might not play nice with a filesystem.
-    """
-
-    note_name = note_name.strip()
-    def okay_filename_char(c):
-        return c.lower() in "abcdefghijklmnopqrstuvwxyz.-_"
-    return "".join(list(filter(okay_filename_char, tuple(note_name))))
-
-def create_skeleton_note(note_name, note_path, template_file_path):
-    """
-    Create a skeleton note document, containing just the note's name.
-    """
-
-    with open(template_file_path) as tf:
-        template_lines = tf.readlines()
-    skeleton_lines = [line.replace("%(NOTE NAME)%", note_name)
-                      for line in template_lines]
-    skeleton_lines = [line.encode('utf-8') for line in skeleton_lines]
-
-    with open(note_path, 'wb') as f:
-        for line in skeleton_lines:
-            f.write(line)
-
-def open_note(note_path, document_editor=None):
-    """
-    Open a note for editing with with a program.
-
-    Use the document_editor arg if available; otherwise, use a command
-    appropriate to the operating system that will open the default
-    program for the file type.
-    """
-
-    if not os.path.isfile(note_path):
-        raise EnvironmentError("File {0} doesn't exist".format(note_path))
-
-    # Choose the document editor and Popen() settings based on the
-    # operating system.
-    creationflags = 0
-    if document_editor:
-        program = [os.path.expandvars(document_editor)]
-    elif os.name.lower() == "nt":
-        # I'm not using the win32process library, so I can't just
-        # import DETACHED_PROCESS from there.
-        DETACHED_PROCESS = 0x8
-        creationflags |= DETACHED_PROCESS
-        program = ["cmd", "/c", "start"]
-    elif sys.platform.lower() == "darwin":
-        # Mac OSX
-        program = ["open"]
-    elif os.name.lower() == "posix":
-        program = ["xdg-open"]
-    else:
-        messagebox.showerror("OS Not Supported",
-                             "Your operating system is not supported")
-        return
-
-    cmd = program + [note_path]
-    subprocess.Popen(cmd, creationflags=creationflags,
-                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                     stderr=subprocess.PIPE)
-
-
-class NoteBag:
-    config = None
-    notes = None
-
-    # Config Options
-    notes_filename = None
-    notes_dir = None
-    note_template_filename = None
-    document_editor = None
+## GLOBAL VARS
+# How often to check whether background work (like indexing) is done
+BACKGROUND_POLL_MS = 200
+# How often to check whether the list of notes has loaded, at startup
+LOADING_POLL_MS = 20
+# How many notes to add to the listbox at each check, once they've
+# been read but while they're still being indexed
+LOADING_CHUNK_SIZE = 5000
+# How often instrumentation checks how late Tk runs what it's asked to
+EVENT_LOOP_PROBE_MS = 100
+
+
+class NoteBag(NoteCatalog):
+    search_scheduler = None
+    content_index_refresh_id = None
+    # The list of notes is loaded on this thread at startup; until
+    # it's done, only the recent notes are listed, and what the user
+    # asks for waits in queued_actions.
+    notes_loading_thread = None
+    notes_loading_error = None
+    notes_loaded = False
+    queued_actions = None
+    started = None
+    # The names of the notes, once they've been read but not yet
+    # indexed, how many of them have been listed after the recent
+    # notes so far, and the recent notes listed before them
+    read_note_names = None
+    listed_note_names = 0
+    listed_recent_note_names = frozenset()
+    # The notes writer's last error that the user has been told about
+    reported_save_error = None
+    # The GUI's own hot paths and event handlers are timed too.
+    instrumented_methods = NoteCatalog.instrumented_methods + (
+        "update_note_names_list", "refresh_note_names_list",
+        "show_note_names", "note_name_entry_changed",
+        "note_name_action_callback", "open_note_from_listbox")
 
     # GUI Elements
     note_name_action_strvar = None
@@ -161,113 +64,195 @@ class NoteBag:
     note_names_label_strvar = None
     note_names_listbox = None
 
-    ## Config/Init Methods
-    def load_config(self):
+    ## Background Work
+    def start_loading_notes(self):
         """
-        Load NoteBag's config file, and use it to set config options.
+        Load the list of notes on a background thread, so the window
+        can be shown, and typed in, straight away.
         """
 
-        config = self.config = read_config(CONFIG_FILENAME)
-        self.notes_list_filename = config.get("NoteBag", "Notes List File")
-        self.notes_dir = config.get("NoteBag", "Notes Directory")
-        self.note_template_filename = config.get("NoteBag", "Note Template Filename")
-        self.document_editor = config.get("NoteBag", "Document Editor")
+        def notes_read():
+            self.read_note_names = list(self.notes)
 
-    def save_config(self):
+        def load_notes():
+            try:
+                self.load_notes_list(notes_read)
+            except Exception as e:
+                self.notes_loading_error = e
+
+        thread = self.notes_loading_thread = threading.Thread(
+            target=load_notes, name="NoteBag notes loading")
+        thread.daemon = True
+        thread.start()
+        self.master.after(LOADING_POLL_MS, self.poll_loading_notes)
+
+    def loading_notes(self):
         """
-        Save NoteBag's current configuration to its config file.
+        Return True if the list of notes hasn't finished loading yet.
         """
 
-        save_config(self.config, CONFIG_FILENAME)
+        return not self.notes_loaded
 
-    def load_notes_list(self):
+    def poll_loading_notes(self):
         """
-        Load the list of notes.
+        Check whether the list of notes has loaded. Until it has, list
+        the notes read so far, a chunk at a time. Once it has, do what
+        the user asked for while waiting, then list the notes properly
+        (answering whatever was typed in the meantime), and start the
+        background work.
         """
 
-        # TODO handle exceptions
-        notes_list_path = self.notes_list_path()
-        if not os.path.isfile(notes_list_path):
-            self.notes = {}
-        else:
-            self.notes = read_notes_list(notes_list_path)
+        if self.notes_loading_thread.is_alive():
+            self.list_read_note_names()
+            self.master.after(LOADING_POLL_MS, self.poll_loading_notes)
+            return
+        self.notes_loading_thread = None
+        self.read_note_names = None
+
+        if self.notes_loading_error is not None:
+            messagebox.showerror("Error Loading Notes",
+                                 "NoteBag couldn't load the list of notes:\n\n{0}".format(self.notes_loading_error))
+            self.master.destroy()
+            return
+        self.notes_loaded = True
+        if self.stats is not None:
+            self.stats.record("startup until notes loaded",
+                              time.perf_counter() - self.started)
+
+        queued_actions, self.queued_actions = self.queued_actions, []
+        for action, args in queued_actions:
+            action(*args)
+        # After the queued actions, so notes they added are listed
+        self.update_note_names_list()
+        self.update_note_name_action()
+        self.start_background_work()
 
-    def save_notes_list(self):
+    def start_background_work(self):
         """
-        Save the list of notes.
+        Start the background work the config file asks for.
         """
 
-        save_notes_list(self.notes, self.notes_list_path())
+        if self.content_index is not None:
+            self.start_content_indexing()
+        if self.reconcile_notes_dir:
+            self.start_reconcile()
+        if self.watch_notes_dir:
+            self.start_watching()
+        self.master.after(BACKGROUND_POLL_MS, self.poll_notes_writer)
 
-    ## Back-End Methods
-    def notes_list_path(self):
+    def poll_notes_writer(self):
         """
-        Return the path to the notes list file.
+        Tell the user if saving the list of notes in the background
+        has failed, once for each failure, and keep checking.
         """
 
-        return os.path.join(self.notes_dir, self.notes_list_filename)
+        error = self.notes_writer.error
+        if error is not None and error is not self.reported_save_error:
+            self.reported_save_error = error
+            messagebox.showerror("Error Saving Notes",
+                                 "NoteBag couldn't save the list of notes:\n\n{0}\n\n"
+                                 "It will try again with your next change, and when "
+                                 "NoteBag is closed.".format(error))
+        self.master.after(BACKGROUND_POLL_MS, self.poll_notes_writer)
 
-    def template_note_path(self):
+    def start_content_indexing(self):
         """
-        Return the path to the template note file.
+        Bring the note contents index up to date in the background.
+        The note names list is refreshed once it's done.
         """
 
-        return os.path.join(get_called_script_dir(), self.note_template_filename)
+        if NoteCatalog.start_content_indexing(self):
+            self.master.after(BACKGROUND_POLL_MS, self.poll_content_indexing)
 
-    def note_filename_exists(self, filename):
+    def poll_content_indexing(self):
         """
-        If a note filename already exists case-insensitively, return
-        the proper filename from self.notes.
+        Check whether the background update of the note contents index
+        has finished. If it has, refresh the note names list, and
+        schedule the next update.
         """
 
-        for existing in self.notes.values():
-            if filename.lower() == existing.lower():
-                return existing
-        return False
+        if self.content_indexing():
+            self.master.after(BACKGROUND_POLL_MS, self.poll_content_indexing)
+            return
 
-    def note_name_exists(self, note_name):
+        if self.content_index_changed:
+            self.content_index_changed = False
+            if self.get_entered_note_name():
+                self.update_note_names_list()
+        # Only one refresh is ever waiting, however the update was
+        # started.
+        if self.content_index_refresh_id is not None:
+            self.master.after_cancel(self.content_index_refresh_id)
+        self.content_index_refresh_id = self.master.after(
+            self.content_index_refresh_seconds * 1000, self.start_content_indexing)
+
+    def start_reconcile(self):
         """
-        If the given note name matches an existing note name
-        case-insensitively, return the "proper" note name from
-        self.notes; if the given note name does not exist, return
-        None.
+        Reconcile the list of notes with the notes folder in the
+        background; once it's done, offer to fix any differences.
         """
 
-        note_names = self.notes.keys()
-        for existing_note_name in note_names:
-            if note_name.lower() == existing_note_name.lower():
-                return existing_note_name
-        return None
+        NoteCatalog.start_reconcile(self)
+        self.master.after(BACKGROUND_POLL_MS, self.poll_reconcile)
 
-    def get_note_path(self, note_name):
+    def poll_reconcile(self):
         """
-        Return the path to an existing note document.
+        Check whether the background reconciliation has finished, and
+        if so, offer to fix any differences it found.
         """
 
-        note_filename = self.notes[note_name]
-        note_path = os.path.join(self.notes_dir, note_filename)
-        return note_path
+        if self.reconciling():
+            self.master.after(BACKGROUND_POLL_MS, self.poll_reconcile)
+            return
+        differences = self.reconcile_differences()
+        if differences is None:
+            return
+
+        missing, untracked = differences
+
+        if missing and messagebox.askyesno(
+                "Missing Notes",
+                "The documents for {0} note(s) are missing from your notes folder, "
+                "starting with '{1}'.\n\nRemove them from the list of notes?".format(
+                    len(missing), missing[0])):
+            self.forget_notes(missing)
+        if untracked and messagebox.askyesno(
+                "Untracked Notes",
+                "Your notes folder has {0} note document(s) NoteBag doesn't know about, "
+                "starting with '{1}'.\n\nAdd them to the list of notes?".format(
+                    len(untracked), untracked[0])):
+            self.import_note_files(untracked)
+        if missing or untracked:
+            self.update_note_names_list()
 
-    def new_note_filename(self, note_name):
+    def start_watching(self):
         """
-        Return an unused filename appropriate for the given note name.
+        Watch the notes folder for changes made by others, and keep
+        the note names list up to date with them.
+        """
+
+        NoteCatalog.start_watching(self)
+        self.master.after(BACKGROUND_POLL_MS, self.poll_watcher)
 
-        Note filenames are .rtf files. All "un-kosher" characters are
-        stripped out of the note name, so the filesystem doesn't choke
-        on them.
+    def poll_watcher(self):
+        """
+        Apply the changes the watcher has seen, and keep checking
+        until it's stopped or replaced.
         """
 
-        filename_base = sanitize_note_name(note_name)
-        filename = filename_base + ".rtf"
-        if not self.note_filename_exists(filename):
-            return filename
+        watcher = self.watcher
+        if watcher is None:
+            return
+        changed, content_changed = self.check_watcher()
+        if changed:
+            self.refresh_note_names_list()
+        if content_changed and self.content_index is not None:
+            self.start_content_indexing()
 
-        suffix_num = 2
-        while self.note_filename_exists(filename):
-            filename = "{0}-{1}.rtf".format(filename_base, str(suffix_num))
-            suffix_num += 1
-        return filename
+        if watcher is self.watcher:
+            self.master.after(BACKGROUND_POLL_MS, self.poll_watcher)
 
+    ## GUI Methods
     def get_listbox_selected_note_name(self):
         """
         Return the note name that is selected in the listbox; if there
@@ -289,48 +274,81 @@ class NoteBag:
 
         return self.note_name_entry.get().strip("\t ")
 
-    def add_note(self, note_name, note_filename=None):
+    def update_note_names_list(self):
         """
-        Add a note document, and save the list of notes.
+        Update the listbox of the existing notes, and the list's
+        label. If there is any text entered into the "Note Name" text
+        entry box, only list note names that contain the entered
+        text, followed by the notes whose documents contain it, best
+        matches first. (This is where incremental search happens.)
         """
 
-        if not note_filename:
-            note_filename = self.new_note_filename(note_name)
+        if self.search_scheduler is not None:
+            # Don't let an older background search overwrite this one.
+            self.search_scheduler.cancel()
+        search_str = self.get_entered_note_name()
+        self.show_note_names(search_str, self.search_note_names(search_str))
 
-        note_path = os.path.join(self.notes_dir, note_filename)
-        create_skeleton_note(note_name, note_path, self.template_note_path())
+    def refresh_note_names_list(self):
+        """
+        Search the listbox of notes again after the notes changed
+        behind the user's back, keeping its scroll position and
+        selection. A search the user asked for that's still on its way
+        will show the changes anyway.
+        """
 
-        self.notes[note_name] = note_filename
-        self.save_notes_list()
+        if self.search_scheduler is not None and self.search_scheduler.busy():
+            return
+        search_str = self.get_entered_note_name()
+        self.note_names_listbox.update_items(self.search_note_names(search_str))
 
-    def update_note_names_list(self):
+    def show_recent_note_names(self):
         """
-        Update the listbox of the existing notes, and the list's
-        label. If there is any text entered into the "Note Name" text
-        entry box, only list note names that contain the entered
-        text. (This is where incremental search happens.)
+        Show the most recently opened notes in the listbox of notes,
+        while the rest are still loading.
         """
 
-        search_str = self.get_entered_note_name()
-        note_names = self.notes.keys()
+        recent_note_names = self.load_recent_notes()
+        self.listed_recent_note_names = frozenset(recent_note_names)
+        self.note_names_listbox.set_items(recent_note_names)
+        if recent_note_names:
+            self.note_names_label_strvar.set("Recent Notes (Loading the Rest...):")
+        else:
+            self.note_names_label_strvar.set("Loading Notes...")
 
-        # Remove strings that don't match
-        if search_str:
-            def string_matches_search(s):
-                return search_str.lower() in s.lower()
-            note_names = filter(string_matches_search, note_names)
+    def list_read_note_names(self):
+        """
+        While the list of notes is being indexed, add the next
+        LOADING_CHUNK_SIZE of the notes read to the listbox of notes,
+        after the recent notes.
+        """
 
-        # Sort Alphabetically
-        note_names = sorted(note_names, key=lambda s: s.lower())
+        note_names = self.read_note_names
+        if note_names is None or self.listed_note_names >= len(note_names):
+            return
+        start = self.listed_note_names
+        chunk = note_names[start:start + LOADING_CHUNK_SIZE]
+        self.listed_note_names = start + len(chunk)
+        recent_note_names = self.listed_recent_note_names
+        self.note_names_listbox.extend_items(
+            [note_name for note_name in chunk if note_name not in recent_note_names])
+        self.note_names_label_strvar.set("All Existing Notes (Still Loading...):")
+
+    def show_note_names(self, search_str, note_names):
+        """
+        Show the results of searching for <search_str> in the listbox
+        of notes, and update the list's label to match.
+        """
 
         # Update the note name listbox
-        note_names_listbox = self.note_names_listbox
-        note_names_listbox.delete(0, END)
-        for note_name in note_names:
-            note_names_listbox.insert(END, note_name)
+        self.note_names_listbox.set_items(note_names)
 
         # Update the note name list label
-        if search_str:
+        if search_str and self.search_mode == "fuzzy":
+            s = "Best Matches for '{0}':".format(search_str)
+        elif search_str and self.content_index is not None:
+            s = "All Notes Containing '{0}':".format(search_str)
+        elif search_str:
             s = "All Note Names Containing '{0}':".format(search_str)
         else:
             s = "All Existing Notes:"
@@ -338,12 +356,75 @@ class NoteBag:
 
     def open_note(self, note_name):
         """
-        Open a note for editing.
+        Open a note for editing, or show an error dialog box if it
+        can't be opened.
         """
 
-        note_filename = self.notes[note_name]
-        note_path = os.path.join(self.notes_dir, note_filename)
-        open_note(note_path, self.document_editor)
+        try:
+            NoteCatalog.open_note(self, note_name)
+        except EnvironmentError as e:
+            if self.stats is not None:
+                self.stats.count("open note failures")
+            messagebox.showerror("Can't Open Note", str(e))
+
+    def open_recent_note(self, note_name):
+        """
+        Open a note picked from the recent notes before the list of
+        notes had loaded, unless it's been deleted or renamed since.
+        """
+
+        key = self.note_name_exists(note_name)
+        if key is None:
+            messagebox.showwarning("Error", "Can't Open: '{0}' no longer exists".format(note_name))
+            return
+        self.open_note(key)
+
+    ## Instrumentation
+    def probe_event_loop(self, scheduled=None):
+        """
+        Record how much later than asked Tk got around to calling this
+        (which is how long the GUI was too busy to respond), and ask
+        it to again.
+        """
+
+        now = time.perf_counter()
+        if scheduled is not None:
+            lag = now - scheduled - EVENT_LOOP_PROBE_MS / 1000.0
+            self.stats.record("Tk event loop lag", max(lag, 0))
+        self.master.after(EVENT_LOOP_PROBE_MS, self.probe_event_loop, now)
+
+    def stop_profiling(self):
+        """
+        Stop profiling, and say where the profile was saved.
+        """
+
+        profile_path = NoteCatalog.stop_profiling(self)
+        if profile_path is not None:
+            print("Saved a profile of NoteBag to {0}".format(profile_path))
+        return profile_path
+
+    def show_stats_dialog(self, *_args, **_kwargs):
+        """
+        Show instrumentation's counters and timings in a window, with a
+        button to refresh them.
+        """
+
+        if self.stats is None:
+            return
+        dialog = Toplevel(self.master)
+        dialog.title("NoteBag Stats")
+        text = Text(dialog, width=100, height=30, font="TkFixedFont", wrap="none")
+        def refresh():
+            text.configure(state="normal")
+            text.delete("1.0", END)
+            text.insert(END, self.stats.report())
+            text.configure(state="disabled")
+        buttons = Frame(dialog)
+        buttons.pack(side=BOTTOM, fill=X)
+        Button(buttons, text="Refresh", command=refresh).pack(side=LEFT)
+        Button(buttons, text="Close", command=dialog.destroy).pack(side=LEFT)
+        text.pack(fill=BOTH, expand=True)
+        refresh()
 
     ## GUI Callbacks
     def note_name_action_callback(self, *_args, **_kwargs):
@@ -361,6 +442,18 @@ class NoteBag:
         if not note_name:
             messagebox.showwarning("Error", "Can't add note: no note name entered")
             return
+        if self.loading_notes():
+            # Whatever is typed next is for something else.
+            self.queued_actions.append((self.open_or_add_note, (note_name,)))
+        else:
+            self.open_or_add_note(note_name)
+        self.clear_note_name_entry()
+
+    def open_or_add_note(self, note_name):
+        """
+        Open the note with a name, or if there isn't one, create it
+        and open it.
+        """
 
         key = self.note_name_exists(note_name)
         if key:
@@ -370,21 +463,31 @@ class NoteBag:
             # The note doesn't exist; create it.
             # TODO popup a small confirmation/note setup dialog.
             self.add_note(note_name)
-            self.clear_note_name_entry()
             self.open_note(note_name)
-        self.clear_note_name_entry()
 
     def note_name_entry_changed(self, *_args, **_kwargs):
         """
         A callback to update the text entry action ("Open"/"Add")
         button's label, and update the incremental note list search,
         based on the text in the "Note Name" text entry box.
+
+        The button's label changes right away; the search runs in the
+        background once typing pauses. While the list of notes is
+        still loading, both wait until it's loaded.
         """
 
-        self.update_note_names_list()
+        if self.loading_notes():
+            return
+        self.search_scheduler.request(self.get_entered_note_name())
+        self.update_note_name_action()
 
-        entered_note_name = self.get_entered_note_name()
-        if self.note_name_exists(entered_note_name):
+    def update_note_name_action(self):
+        """
+        Label the text entry action button "Open" if the entered note
+        name exists, or else "Add".
+        """
+
+        if self.note_name_exists(self.get_entered_note_name()):
             self.note_name_action_strvar.set("Open")
         else:
             self.note_name_action_strvar.set("Add")
@@ -407,8 +510,24 @@ class NoteBag:
             # TODO show a warning dialog box or something
             messagebox.showwarning("Error", "Can't Open: No note selected")
             return
+        if self.loading_notes():
+            # One of the recent notes
+            self.queued_actions.append((self.open_recent_note, (note_name,)))
+            return
         self.open_note(note_name)
 
+    def quit_callback(self, *_args, **_kwargs):
+        """
+        A callback to close NoteBag, once the list of notes has
+        finished saving.
+        """
+
+        self.close()
+        if self.notes_writer is not None and self.notes_writer.error is not None:
+            messagebox.showerror("Error Saving Notes",
+                                 "NoteBag couldn't save the list of notes:\n\n{0}".format(self.notes_writer.error))
+        self.master.destroy()
+
     def delete_note_from_listbox(self, *_args, **_kwargs):
         """
         If a note name has been selected in the note name list, delete
@@ -420,19 +539,25 @@ class NoteBag:
         if not note_name:
             messagebox.showwarning("Error", "Can't Delete: No note selected")
             return
+        if self.loading_notes():
+            messagebox.showwarning("Error", "Can't Delete: NoteBag is still loading your notes")
+            return
         if not messagebox.askyesno("Really Delete Note?",
                                    "WARNING: This will remove the note document file from your hard drive! You cannot undo this!\n\nReally remove '{0}'?".format(note_name),
                                    icon=messagebox.ERROR):
             return
 
-        note_path = self.get_note_path(note_name)
-        del(self.notes[note_name])
-        self.save_notes_list()
-        os.remove(note_path)
+        self.delete_note(note_name)
         self.update_note_names_list()
 
     ## Main Code
     def __init__(self, master):
+        self.started = time.perf_counter()
+        NoteCatalog.__init__(self)
+        self.master = master
+        self.queued_actions = []
+        master.protocol("WM_DELETE_WINDOW", self.quit_callback)
+
         ## High-level Layout
         input_frame = Frame(master)
         notes_frame = Frame(master)
@@ -474,18 +599,14 @@ class NoteBag:
                                  textvar=note_names_label_strvar)
         note_names_label.pack(anchor=W)
 
-        note_names_listbox = self.note_names_listbox = Listbox(notes_frame)
+        # Only the visible rows are put in the listbox, which comes
+        # with its own scrollbar.
+        note_names_listbox = self.note_names_listbox = VirtualListbox(notes_frame)
         note_names_listbox.pack(side=LEFT, fill=BOTH, expand=True)
         note_names_listbox.bind("<Return>", self.open_note_from_listbox)
         note_names_listbox.bind("<KP_Enter>", self.open_note_from_listbox)
         note_names_listbox.bind("<Double-Button-1>", self.open_note_from_listbox)
 
-        # Add scrollbar to list of notes
-        notes_scrollbar = Scrollbar(notes_frame)
-        notes_scrollbar.pack(side=LEFT, fill=Y)
-        note_names_listbox.config(yscrollcommand=notes_scrollbar.set)
-        notes_scrollbar.config(command=note_names_listbox.yview)
-
         ## Controls
         note_controls = Frame(notes_frame)
         note_controls.pack(side=LEFT, fill=Y)
@@ -498,10 +619,22 @@ class NoteBag:
                                     command=self.delete_note_from_listbox)
         delete_note_button.pack(fill=X)
 
+        if self.stats is not None:
+            stats_button = Button(note_controls, text="Stats",
+                                  command=self.show_stats_dialog)
+            stats_button.pack(fill=X)
+            master.bind("<F12>", self.show_stats_dialog)
+            self.probe_event_loop()
+            if self.profiler is not None:
+                master.after(self.profile_seconds * 1000, self.stop_profiling)
+
         ## Final Initialization
-        self.load_config()
-        self.load_notes_list()
-        self.update_note_names_list()
+        self.search_scheduler = SearchScheduler(master, self.search_note_names,
+                                                self.show_note_names,
+                                                self.search_delay)
+        # The window is drawn before the list of notes starts loading.
+        self.show_recent_note_names()
+        master.after_idle(self.start_loading_notes)
 
 def maybe_first_time_setup():
     """
@@ -537,11 +670,12 @@ def maybe_first_time_setup():
     return True
 
 
-if __name__ == "__main__":
+def main():
     print("NoteBag {0}".format(__version__))
     print("Copyright (C) {0}".format(__copyright__))
 
-    # Hide the main root window, and only show the dialogs.
+    # Hide the main window until it's set up, and only show the
+    # dialogs.
     root = Tk()
     root.withdraw()
     while not maybe_first_time_setup():
@@ -551,10 +685,12 @@ if __name__ == "__main__":
         if not success:
             root.destroy()
             exit(1)
-    root.destroy()
 
-    # Create the main window
-    root = Tk()
     root.title("NoteBag")
     notebag = NoteBag(root)
+    root.deiconify()
     root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+## Note Bag Archives
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+
+from layout import NOTE_PATH_SEPARATOR, make_shard_dir
+from notes_writer import replace_file, temp_file_path
+
+ARCHIVE_FORMAT = "NoteBag archive"
+ARCHIVE_VERSION = 1
+# The list of notes, and the size, modification time and checksum of
+# every note document, written after all of the documents: a JSON
+# header line, then a JSON line for every note, so it can be written
+# and read without holding it all in memory
+MANIFEST_NAME = "manifest.jsonl"
+# Where the note documents are in an archive
+NOTES_PREFIX = "notes/"
+# How many note documents are read (or restored) at once
+ARCHIVE_THREADS = 8
+# Note documents up to this size are read ahead whole by the reading
+# threads; bigger ones are copied into the archive a chunk at a time.
+READ_AHEAD_MAX_BYTES = 1048576
+CHUNK_SIZE = 65536
+# How often export_archive() and restore_archive() call progress()
+PROGRESS_INTERVAL = 1000
+
+
+def read_ahead(executor, function, items, window):
+    """
+    Yield function(item) for every item, in order, running it on the
+    executor for at most <window> items at once, so only that many
+    results are ever held in memory.
+    """
+
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def file_sha256(file_path):
+    """
+    Return the SHA-256 digest of a file, read a chunk at a time.
+    """
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_safe_note_filename(note_filename):
+    """
+    Return True if a note filename from an archive stays inside the
+    notes folder: a plain filename, or one in a shard.
+    """
+
+    parts = note_filename.split(NOTE_PATH_SEPARATOR)
+    return (0 < len(parts) <= 2
+            and "\\" not in note_filename and ":" not in note_filename
+            and all(part not in ("", ".", "..") for part in parts))
+
+def read_manifest(archive_path):
+    """
+    Return the header of an archive's manifest: its "format" and
+    "version", when it was "created", the "base" archive it refers to
+    (if any), and its "note_count". Raise a ValueError if it isn't a
+    NoteBag archive, or it's from a newer NoteBag.
+    """
+
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            with archive.open(MANIFEST_NAME) as manifest:
+                header = json.loads(manifest.readline().decode("utf-8"))
+    except (zipfile.BadZipFile, KeyError, ValueError):
+        raise ValueError("{0} isn't a NoteBag archive".format(archive_path))
+    if not isinstance(header, dict) or header.get("format") != ARCHIVE_FORMAT:
+        raise ValueError("{0} isn't a NoteBag archive".format(archive_path))
+    if header.get("version", 0) > ARCHIVE_VERSION:
+        raise ValueError("{0} was made by a newer NoteBag".format(archive_path))
+    return header
+
+def iter_manifest_entries(archive):
+    """
+    Yield the manifest entries of the notes in an open archive, one at
+    a time: their "name" and "filename", and the "size", "mtime_ns"
+    and "sha256" of their documents, with the "archive" holding the
+    document if it's an earlier one.
+    """
+
+    with archive.open(MANIFEST_NAME) as manifest:
+        manifest.readline()
+        for line in manifest:
+            yield json.loads(line.decode("utf-8"))
+
+def archive_member_info(note_filename, size, mtime_ns):
+    """
+    Return the ZipInfo for a note document's entry in an archive.
+    """
+
+    # Zip files can't hold times before 1980.
+    date_time = time.localtime(max(mtime_ns // 1000000000, 315532800))[:6]
+    info = zipfile.ZipInfo(NOTES_PREFIX + note_filename, date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    # Lets zipfile tell whether the entry needs ZIP64.
+    info.file_size = size
+    return info
+
+def read_base_entries(base_archive_path):
+    """
+    Return what an incremental export needs to know about the note
+    documents in the archive it's based on: a dict mapping each one's
+    filename to its (size, mtime_ns, sha256, archive name).
+    """
+
+    base_name = os.path.basename(base_archive_path)
+    read_manifest(base_archive_path)
+    base_entries = {}
+    with zipfile.ZipFile(base_archive_path) as archive:
+        for entry in iter_manifest_entries(archive):
+            if entry.get("sha256") is not None:
+                base_entries[entry["filename"]] = (
+                    entry["size"], entry["mtime_ns"], entry["sha256"],
+                    entry.get("archive", base_name))
+    return base_entries
+
+def read_note_file(notes_dir, note, base_entries):
+    """
+    Look at one note document for export_archive(). Return its
+    manifest entry, and its contents if they were read ahead.
+
+    The entry has no "size" if the document is missing. It names the
+    "archive" already holding the document if the document is
+    unchanged since <base_entries> were exported (by modification time
+    and size, or failing that, by checksum). It has no "sha256" if the
+    document is too big to read ahead.
+    """
+
+    note_name, note_filename = note
+    entry = {"name": note_name, "filename": note_filename}
+    note_path = os.path.join(notes_dir, note_filename)
+    try:
+        stat = os.stat(note_path)
+        previous = base_entries.get(note_filename)
+        if (previous is not None and previous[0] == stat.st_size
+                and previous[1] == stat.st_mtime_ns):
+            entry.update(size=previous[0], mtime_ns=previous[1],
+                         sha256=previous[2], archive=previous[3])
+            return entry, None
+
+        data = None
+        if stat.st_size <= READ_AHEAD_MAX_BYTES:
+            with open(note_path, "rb") as f:
+                data = f.read()
+            size = len(data)
+            sha256 = hashlib.sha256(data).hexdigest()
+        elif previous is not None:
+            size = stat.st_size
+            sha256 = file_sha256(note_path)
+        else:
+            size = stat.st_size
+            sha256 = None
+    except FileNotFoundError:
+        return entry, None
+
+    entry.update(size=size, mtime_ns=stat.st_mtime_ns)
+    if previous is not None and previous[0] == size and previous[2] == sha256:
+        # Only touched since the last export
+        entry.update(sha256=sha256, archive=previous[3])
+        return entry, None
+    if data is not None:
+        entry["sha256"] = sha256
+    return entry, data
+
+def export_archive(notes, notes_dir, archive_path, base_archive_path=None,
+                   threads=ARCHIVE_THREADS, progress=None):
+    """
+    Write a dict of notes, and their documents in <notes_dir>, to a
+    compressed (zip) archive at <archive_path>, with a SHA-256
+    checksum for every document. Return counts of the "notes" in the
+    archive, the documents "written" to it, those left "unchanged" in
+    an earlier archive, and those "missing" from the notes folder.
+
+    If <base_archive_path> is given, the export is incremental: the
+    documents that haven't changed since that archive was made aren't
+    copied again, and the new archive refers to the one holding them
+    instead. Every archive an incremental archive refers to must be
+    kept in the same folder as it.
+
+    Documents are read by <threads> threads, a few ahead of the one
+    being compressed, and the manifest is spooled to a temporary file,
+    so memory use doesn't grow with the size of the notes.
+    progress(done, total) is called now and then if given. The
+    archive is only moved into place once it's complete.
+    """
+
+    archive_name = os.path.basename(archive_path)
+    base_entries = {}
+    base_name = None
+    if base_archive_path is not None:
+        if (os.path.dirname(os.path.abspath(base_archive_path))
+                != os.path.dirname(os.path.abspath(archive_path))):
+            raise ValueError("An incremental archive must be in the same "
+                             "folder as the archive it's based on")
+        base_name = os.path.basename(base_archive_path)
+        base_entries = read_base_entries(base_archive_path)
+        if archive_name == base_name or any(
+                previous[3] == archive_name for previous in base_entries.values()):
+            raise ValueError("{0} holds documents that {1} refers to; export "
+                             "to a new archive".format(archive_name, base_name))
+
+    counts = {"notes": len(notes), "written": 0, "unchanged": 0, "missing": 0}
+    def read_note(note):
+        return read_note_file(notes_dir, note, base_entries)
+
+    def write(temp_path):
+        from concurrent.futures import ThreadPoolExecutor
+        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as archive, \
+                tempfile.TemporaryFile() as entries, \
+                ThreadPoolExecutor(max_workers=threads) as executor:
+            # Sorted by filename, so shards are read together
+            sorted_notes = sorted(notes.items(), key=lambda note: note[1])
+            done = 0
+            for entry, data in read_ahead(executor, read_note, sorted_notes,
+                                          threads * 2):
+                if "archive" in entry:
+                    counts["unchanged"] += 1
+                else:
+                    if "size" in entry:
+                        write_note_file(archive, notes_dir, entry, data)
+                    counts["written" if "size" in entry else "missing"] += 1
+                entries.write(json.dumps(entry).encode("utf-8") + b"\n")
+                done += 1
+                if progress is not None and done % PROGRESS_INTERVAL == 0:
+                    progress(done, len(notes))
+
+            header = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION,
+                      "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                      "base": base_name, "note_count": done}
+            entries.seek(0)
+            with archive.open(MANIFEST_NAME, "w") as manifest:
+                manifest.write(json.dumps(header).encode("utf-8") + b"\n")
+                shutil.copyfileobj(entries, manifest, CHUNK_SIZE)
+        with open(temp_path, "rb+") as f:
+            os.fsync(f.fileno())
+
+    replace_file(archive_path, write)
+    if progress is not None:
+        progress(len(notes), len(notes))
+    return counts
+
+def write_note_file(archive, notes_dir, entry, data):
+    """
+    Add a note document to an archive being written, from <data> if
+    it was read ahead, or else straight from the notes folder, filling
+    in its entry's checksum. If it's gone by then, its entry loses its
+    size, like a missing document's.
+    """
+
+    info = archive_member_info(entry["filename"], entry["size"], entry["mtime_ns"])
+    if data is not None:
+        with archive.open(info, "w") as member:
+            member.write(data)
+        return
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(os.path.join(notes_dir, entry["filename"]), "rb") as f, \
+                archive.open(info, "w") as member:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                member.write(chunk)
+                size += len(chunk)
+    except FileNotFoundError:
+        del(entry["size"], entry["mtime_ns"])
+        return
+    entry.update(size=size, sha256=digest.hexdigest())
+
+def restore_archive(archive_path, notes_dir, threads=ARCHIVE_THREADS,
+                    verify_only=False, progress=None):
+    """
+    Restore the note documents in an archive made by export_archive()
+    (and in the archives it refers to) to <notes_dir>, checking every
+    one against its checksum. Return the archive's dict of notes, and
+    a list of (note filename, problem) pairs for the documents that
+    couldn't be restored.
+
+    Every document is first copied to a temporary file next to its
+    note and checked; only once they all match are they moved into
+    place, so if any is damaged or missing, no document is changed.
+    If <verify_only> is True, the checksums are checked, but nothing
+    is written.
+    """
+
+    note_count = read_manifest(archive_path)["note_count"]
+    archive_dir = os.path.dirname(os.path.abspath(archive_path))
+    archives = {None: zipfile.ZipFile(archive_path)}
+    archives_lock = threading.Lock()
+
+    def open_archive(archive_name):
+        with archives_lock:
+            if archive_name not in archives:
+                if os.path.basename(archive_name) != archive_name:
+                    raise ValueError("bad archive name {0}".format(archive_name))
+                archives[archive_name] = zipfile.ZipFile(
+                    os.path.join(archive_dir, archive_name))
+            return archives[archive_name]
+
+    def stage_entry(entry):
+        note_filename = entry["filename"]
+        if not is_safe_note_filename(note_filename):
+            return None, "not a note filename"
+        if entry.get("sha256") is None:
+            # The document was missing when the archive was made.
+            return None, None
+        try:
+            archive = open_archive(entry.get("archive"))
+            return stage_note_file(archive, notes_dir, entry, verify_only), None
+        except (EnvironmentError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            return None, str(e)
+
+    def stage_next_entry(entry):
+        return (entry,) + stage_entry(entry)
+
+    notes = {}
+    problems = []
+    # (temporary path, note path) pairs, moved into place at the end.
+    staged = []
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = read_ahead(executor, stage_next_entry,
+                                 iter_manifest_entries(archives[None]), threads * 2)
+            for done, (entry, temp_path, problem) in enumerate(results, 1):
+                notes[entry["name"]] = entry["filename"]
+                if temp_path is not None:
+                    staged.append(
+                        (temp_path, os.path.join(notes_dir, entry["filename"])))
+                if problem is not None:
+                    problems.append((entry["filename"], problem))
+                if progress is not None and done % PROGRESS_INTERVAL == 0:
+                    progress(done, note_count)
+        if not problems:
+            while staged:
+                temp_path, note_path = staged[-1]
+                os.replace(temp_path, note_path)
+                staged.pop()
+    finally:
+        for archive in archives.values():
+            archive.close()
+        for temp_path, _ in staged:
+            try:
+                os.remove(temp_path)
+            except EnvironmentError:
+                pass
+    if progress is not None:
+        progress(note_count, note_count)
+    return notes, problems
+
+def stage_note_file(archive, notes_dir, entry, verify_only=False):
+    """
+    Copy one note document out of an archive to a temporary file next
+    to its note, with its modification time, and return the temporary
+    file's path (or None if <verify_only> is True). Raise a ValueError
+    if its checksum or size doesn't match its entry.
+    """
+
+    note_path = os.path.join(notes_dir, entry["filename"])
+    temp_path = None
+    digest = hashlib.sha256()
+    size = 0
+    with archive.open(NOTES_PREFIX + entry["filename"]) as member:
+        out = None
+        if not verify_only:
+            if not os.path.isdir(os.path.dirname(note_path)):
+                make_shard_dir(note_path)
+            temp_path = temp_file_path(note_path)
+            out = open(temp_path, "wb")
+        try:
+            for chunk in iter(lambda: member.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                size += len(chunk)
+                if out is not None:
+                    out.write(chunk)
+            if out is not None:
+                out.flush()
+                os.fsync(out.fileno())
+        except BaseException:
+            if out is not None:
+                out.close()
+                os.remove(temp_path)
+            raise
+        if out is not None:
+            out.close()
+
+    if digest.hexdigest() != entry["sha256"] or size != entry["size"]:
+        if temp_path is not None:
+            os.remove(temp_path)
+        raise ValueError("checksum mismatch")
+    if temp_path is not None:
+        os.utime(temp_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    return temp_path
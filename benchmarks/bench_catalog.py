@@ -0,0 +1,351 @@
+#!/usr/bin/python -B
+"""
+Benchmark the notes catalog's hot paths over synthetic note bags,
+without the GUI: saving, loading and checksumming the notes list,
+loading the whole catalog, looking up note names, choosing new note
+filenames, adding notes, and searching after each keystroke (with
+both search modes). Each is reported as latency percentiles, along
+with the most memory it allocated at once.
+
+The note bags are generated deterministically from a seed, so two
+runs with the same seed benchmark the same notes. Their names are
+note-like, and many of them are the same once sanitized into
+filenames (digits are dropped), so the filenames have long runs of
+numeric suffixes, as a big real collection would.
+
+Usage: python benchmarks/bench_catalog.py [--json FILE] [--seed N]
+                                          [--storage STORAGE] [NUM_NOTES ...]
+       python benchmarks/bench_catalog.py --compare OLD.json NEW.json
+                                          [--threshold RATIO]
+
+--json saves the results, to be compared with another run's later;
+--compare prints how each result changed, and exits with status 1
+if any got slower (or bigger) by more than the threshold ratio. Only
+compare runs made on the same, otherwise idle, machine.
+"""
+
+import argparse
+import configparser
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+from bench_fuzzy import make_queries
+from bench_search import make_note_names
+from catalog import (CONFIG_FILENAME, TEMPLATE_CONFIG_FILENAME, NoteCatalog,
+                     sanitize_note_name)
+from helpers import fold_case, set_called_script_dir
+from notes_list import notes_checksum, read_notes_list, replace_notes_list
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+REPEATS = 5
+NUM_LOOKUPS = 2000
+NUM_NEW_FILENAMES = 2000
+NUM_ADDS = 200
+NUM_QUERIES = 40
+# How many fuzzy matches to keep, as with the "Fuzzy Search Results"
+# option
+FUZZY_LIMIT = 500
+# Percentiles reported, and the statistics compared between runs
+PERCENTILES = (50, 90, 99)
+COMPARED = ("p50_ms", "p99_ms", "peak_kib")
+DEFAULT_THRESHOLD = 1.25
+# Differences smaller than these are noise, whatever their ratio.
+MIN_DIFFERENCES = {"p50_ms": 0.01, "p99_ms": 0.05, "peak_kib": 64}
+
+
+## Note Bags
+def make_note_bag(count, seed=0):
+    """
+    Return a dict of <count> note names to note filenames, with the
+    filenames NoteBag would have given them: sanitized, with a
+    numeric suffix for every name after the first to sanitize to the
+    same filename.
+    """
+
+    notes = {}
+    suffixes = {}
+    for note_name in make_note_names(count, seed):
+        base = sanitize_note_name(note_name)
+        suffix_num = suffixes.get(fold_case(base), 0) + 1
+        suffixes[fold_case(base)] = suffix_num
+        if suffix_num == 1:
+            notes[note_name] = base + ".rtf"
+        else:
+            notes[note_name] = "{0}-{1}.rtf".format(base, suffix_num)
+    return notes
+
+def make_new_note_names(notes, count, seed):
+    """
+    Return <count> names that aren't in a note bag yet, but sanitize
+    to the same filenames as names that are.
+    """
+
+    rng = random.Random(seed)
+    note_names = rng.sample(sorted(notes), min(count, len(notes)))
+    return ["{0} new {1}".format(note_name, i)
+            for i, note_name in enumerate(note_names)]
+
+def make_lookups(notes, count, seed):
+    """
+    Return <count> note names to look up: half of them existing ones
+    in another case, and half of them missing.
+    """
+
+    rng = random.Random(seed)
+    note_names = sorted(notes)
+    lookups = []
+    for i in range(count):
+        note_name = rng.choice(note_names)
+        if i % 2:
+            lookups.append(note_name + " (missing)")
+        else:
+            lookups.append(note_name.swapcase())
+    return lookups
+
+def make_catalog_home(temp_dir, notes, storage):
+    """
+    Set up a NoteBag folder (config and note template) in <temp_dir>,
+    with a notes folder holding a notes list of <notes>, and make
+    NoteCatalog use it. The note documents themselves aren't written.
+    """
+
+    home_dir = os.path.join(temp_dir, "home")
+    notes_dir = os.path.join(temp_dir, "notes")
+    os.mkdir(home_dir)
+    os.mkdir(notes_dir)
+
+    config = configparser.ConfigParser()
+    config.read(os.path.join(PACKAGE_DIR, TEMPLATE_CONFIG_FILENAME))
+    config.set("NoteBag", "Notes Directory", notes_dir)
+    config.set("NoteBag", "Notes List Storage", storage)
+    for option in ("Search Note Contents", "Reconcile Notes Folder",
+                   "Watch Notes Folder"):
+        config.set("NoteBag", option, "no")
+    with open(os.path.join(home_dir, CONFIG_FILENAME), "w") as f:
+        config.write(f)
+    template_filename = config.get("NoteBag", "Note Template Filename")
+    shutil.copy(os.path.join(PACKAGE_DIR, template_filename), home_dir)
+
+    replace_notes_list(notes, os.path.join(
+            notes_dir, config.get("NoteBag", "Notes List File")))
+    set_called_script_dir(home_dir)
+
+
+## Measuring
+def measure(calls, memory_calls=None):
+    """
+    Time each of a sequence of calls, then make <memory_calls> (or
+    the same calls again) with tracemalloc on. Return the latencies,
+    in seconds, and the most memory allocated at once, in bytes.
+    """
+
+    # Don't make these calls pay for the last benchmark's garbage.
+    gc.collect()
+    latencies = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        for call in calls if memory_calls is None else memory_calls:
+            call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return latencies, peak
+
+def summarize(latencies, peak):
+    """
+    Return the statistics reported for a benchmark.
+    """
+
+    latencies = sorted(latencies)
+    stats = {"count": len(latencies),
+             "mean_ms": sum(latencies) / len(latencies) * 1000}
+    for percentile in PERCENTILES:
+        i = min(len(latencies) - 1, len(latencies) * percentile // 100)
+        stats["p{0}_ms".format(percentile)] = latencies[i] * 1000
+    stats["max_ms"] = latencies[-1] * 1000
+    stats["peak_kib"] = peak // 1024
+    return stats
+
+def report(name, stats):
+    print("  {0:<17} p50 {1:9.3f} ms   p90 {2:9.3f} ms   p99 {3:9.3f} ms"
+          "   max {4:9.3f} ms   peak {5:8d} KiB".format(
+              name, stats["p50_ms"], stats["p90_ms"], stats["p99_ms"],
+              stats["max_ms"], stats["peak_kib"]))
+
+def keystroke_calls(catalog, search_mode, queries):
+    """
+    Return a call for every keystroke of typing each query, with
+    <search_mode>. Each query starts with nothing cached.
+    """
+
+    def search(query, first):
+        if first:
+            catalog.note_search.clear_cache()
+        catalog.search_mode = search_mode
+        catalog.search_note_names(query)
+
+    calls = []
+    for query in queries:
+        for length in range(1, len(query) + 1):
+            calls.append(lambda query=query[:length], first=length == 1:
+                         search(query, first))
+    return calls
+
+
+## Benchmarks
+def benchmark_size(size, seed, storage):
+    """
+    Run every benchmark on a note bag of <size> notes, and return a
+    dict of their statistics by name.
+    """
+
+    notes = make_note_bag(size, seed)
+    results = {}
+    def run(name, calls, memory_calls=None):
+        stats = results[name] = summarize(*measure(calls, memory_calls))
+        report(name, stats)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        file_path = os.path.join(temp_dir, "NotesList.pkl")
+        run("save", [lambda: replace_notes_list(notes, file_path)] * REPEATS,
+            [lambda: replace_notes_list(notes, file_path)])
+        run("load", [lambda: read_notes_list(file_path)] * REPEATS,
+            [lambda: read_notes_list(file_path)])
+        os.remove(file_path)
+        run("checksum", [lambda: notes_checksum(notes)] * REPEATS,
+            [lambda: notes_checksum(notes)])
+
+        make_catalog_home(temp_dir, notes, storage)
+        catalogs = []
+        def load_catalog():
+            # Only one catalog is kept around at a time.
+            if catalogs:
+                catalogs.pop().close()
+            catalog = NoteCatalog()
+            catalog.load_notes_list()
+            catalogs.append(catalog)
+        run("catalog_load", [load_catalog] * REPEATS, [load_catalog])
+        catalog = catalogs.pop()
+
+        run("lookup", [lambda note_name=note_name: catalog.note_name_exists(note_name)
+                       for note_name in make_lookups(notes, NUM_LOOKUPS, seed + 1)])
+        run("new_filename", [lambda note_name=note_name: catalog.new_note_filename(note_name)
+                             for note_name in make_new_note_names(
+                                 notes, NUM_NEW_FILENAMES, seed + 2)])
+        new_note_names = make_new_note_names(notes, NUM_ADDS * 2, seed + 3)
+        run("add", [lambda note_name=note_name: catalog.add_note(note_name)
+                    for note_name in new_note_names[:NUM_ADDS]],
+            [lambda note_name=note_name: catalog.add_note(note_name)
+             for note_name in new_note_names[NUM_ADDS:]])
+
+        # Don't let saving the added notes slow the searches down.
+        catalog.notes_writer.flush()
+        queries = make_queries(sorted(notes), NUM_QUERIES, seed + 4)
+        catalog.fuzzy_search_results = FUZZY_LIMIT
+        for search_mode in ("substring", "fuzzy"):
+            run("search_" + search_mode, keystroke_calls(catalog, search_mode, queries))
+        catalog.close()
+    finally:
+        set_called_script_dir(None)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return results
+
+def run_benchmarks(sizes, seed, storage):
+    """
+    Benchmark every size of note bag, and return the results, with
+    enough about the machine to tell runs apart.
+    """
+
+    results = {"python": platform.python_version(),
+               "platform": platform.platform(),
+               "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "seed": seed,
+               "storage": storage,
+               "sizes": {}}
+    for size in sizes:
+        print("{0} notes:".format(size))
+        results["sizes"][str(size)] = benchmark_size(size, seed, storage)
+    return results
+
+
+## Comparing Runs
+def compare(old_results, new_results, threshold):
+    """
+    Print how every statistic in COMPARED changed between two runs,
+    and return the number that got worse by more than <threshold>
+    times (and by more than MIN_DIFFERENCES).
+    """
+
+    regressions = 0
+    for size, new_benchmarks in sorted(new_results["sizes"].items(),
+                                       key=lambda item: int(item[0])):
+        old_benchmarks = old_results["sizes"].get(size)
+        if old_benchmarks is None:
+            continue
+        print("{0} notes:".format(size))
+        for name, new_stats in sorted(new_benchmarks.items()):
+            old_stats = old_benchmarks.get(name)
+            if old_stats is None:
+                continue
+            changes = []
+            for stat in COMPARED:
+                old, new = old_stats[stat], new_stats[stat]
+                ratio = new / old if old else float("inf") if new else 1.0
+                worse = ratio > threshold and new - old > MIN_DIFFERENCES[stat]
+                regressions += worse
+                changes.append("{0} {1:10.3f} -> {2:10.3f} ({3:5.2f}x){4}".format(
+                        stat, old, new, ratio, " !" if worse else "  "))
+            print("  {0:<17} {1}".format(name, "   ".join(changes)))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the notes catalog's hot paths.")
+    parser.add_argument("sizes", nargs="*", type=int, metavar="NUM_NOTES",
+                        help="note bag sizes (default: {0})".format(
+                            " ".join(str(size) for size in DEFAULT_SIZES)))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage", default="pickle",
+                        choices=("pickle", "journal", "sqlite"))
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two saved runs instead")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="the slowdown ratio counted as a regression "
+                             "(default: {0})".format(DEFAULT_THRESHOLD))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        runs = []
+        for file_path in args.compare:
+            with open(file_path) as f:
+                runs.append(json.load(f))
+        regressions = compare(runs[0], runs[1], args.threshold)
+        print("{0} regressions".format(regressions))
+        return 1 if regressions else 0
+
+    results = run_benchmarks(args.sizes or DEFAULT_SIZES, args.seed, args.storage)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
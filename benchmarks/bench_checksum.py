@@ -0,0 +1,64 @@
+#!/usr/bin/python -B
+"""
+Benchmark the notes list checksums: the per-entry notes_checksum()
+against single-pass checksums of the serialized notes list, and
+whole save/load round trips with each.
+
+Usage: python benchmarks/bench_checksum.py [NUM_NOTES ...]
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from integrity import CHECKSUMS, tagged_checksum
+from notes_list import (LEGACY_CHECKSUM, PICKLE_PROTOCOL, notes_checksum,
+                        read_notes_list, save_notes_list)
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+REPEATS = 5
+
+
+def make_notes(count):
+    return dict(("Note number {0}".format(i), "Notenumber{0}.rtf".format(i))
+                for i in range(count))
+
+def best_time(function, *args):
+    """
+    Return the fastest of several runs of a function, in seconds.
+    """
+
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(sizes):
+    temp_dir = tempfile.mkdtemp()
+    file_path = os.path.join(temp_dir, "NotesList.pkl")
+    for size in sizes:
+        notes = make_notes(size)
+        notes_data = pickle.dumps(notes, PICKLE_PROTOCOL)
+        print("{0} notes:".format(size))
+        print("  {0:<10} checksum {1:9.2f} ms".format(
+                LEGACY_CHECKSUM, best_time(notes_checksum, notes) * 1000))
+        for algorithm in sorted(CHECKSUMS):
+            print("  {0:<10} checksum {1:9.2f} ms".format(
+                    algorithm,
+                    best_time(tagged_checksum, algorithm, notes_data) * 1000))
+        for algorithm in [LEGACY_CHECKSUM] + sorted(CHECKSUMS):
+            save_time = best_time(save_notes_list, notes, file_path, algorithm)
+            load_time = best_time(read_notes_list, file_path)
+            print("  {0:<10} save {1:9.2f} ms   load {2:9.2f} ms".format(
+                    algorithm, save_time * 1000, load_time * 1000))
+    os.remove(file_path)
+    os.rmdir(temp_dir)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
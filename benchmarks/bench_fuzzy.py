@@ -0,0 +1,93 @@
+#!/usr/bin/python -B
+"""
+Benchmark the latency of each keystroke of search-as-you-type, with
+fuzzy and substring search, over synthetic collections of note names.
+
+Each query is typed one character at a time, searching after every
+keystroke, the way the note name entry box does (without the typing
+delay). The cache of earlier searches is emptied before each query is
+typed, so every query starts cold.
+
+Usage: python benchmarks/bench_fuzzy.py [NUM_NAMES ...]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_search import make_note_names
+from search import NoteNameSearch
+
+DEFAULT_SIZES = (1000, 100000, 250000)
+NUM_QUERIES = 100
+# How many fuzzy matches to keep, as with the "Fuzzy Search Results"
+# option
+LIMIT = 500
+
+
+def make_queries(note_names, count, seed=1):
+    """
+    Return <count> queries of a few kinds: the starts of names, the
+    initials of their words, every other character of a stretch of a
+    name, and some that match nothing.
+    """
+
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        name = rng.choice(note_names)
+        kind = i % 4
+        if kind == 0:
+            queries.append(name[:rng.randint(3, min(10, len(name)))])
+        elif kind == 1:
+            queries.append("".join(word[0] for word in name.split()))
+        elif kind == 2:
+            start = rng.randint(0, max(0, len(name) - 12))
+            queries.append(name[start:start + 12:2])
+        else:
+            queries.append("zq{0}x".format(i))
+    return queries
+
+def time_keystrokes(search, queries):
+    """
+    Type every query, and return the sorted latencies, in seconds, of
+    the search after each keystroke.
+    """
+
+    latencies = []
+    for query in queries:
+        search.clear_cache()
+        for length in range(1, len(query) + 1):
+            start = time.perf_counter()
+            search(query[:length])
+            latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+def report(label, latencies):
+    median = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print("  {0:<10} median {1:9.3f} ms   p95 {2:9.3f} ms   max {3:9.3f} ms".format(
+            label, median * 1000, p95 * 1000, latencies[-1] * 1000))
+
+def main(sizes):
+    for size in sizes:
+        note_names = make_note_names(size)
+        queries = make_queries(note_names, NUM_QUERIES)
+        name_search = NoteNameSearch(note_names, build_fuzzy_index=True)
+
+        def substring_search(query):
+            return name_search.search(query)
+        def fuzzy_search(query):
+            return name_search.fuzzy_search(query, LIMIT)
+        substring_search.clear_cache = fuzzy_search.clear_cache = name_search.clear_cache
+
+        print("{0} names, {1} keystrokes:".format(
+                size, sum(len(query) for query in queries)))
+        report("substring", time_keystrokes(substring_search, queries))
+        report("fuzzy", time_keystrokes(fuzzy_search, queries))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
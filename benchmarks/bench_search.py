@@ -0,0 +1,90 @@
+#!/usr/bin/python -B
+"""
+Benchmark note name search latency, with and without the trigram
+index, over synthetic collections of note names.
+
+Usage: python benchmarks/bench_search.py [NUM_NAMES ...]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from search import NoteNameSearch
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+NUM_QUERIES = 200
+WORDS = ("meeting", "notes", "budget", "garden", "recipe", "Tax", "doctor",
+         "car", "Insurance", "school", "trip", "birthday", "letter", "bank",
+         "plans", "ideas", "Church", "house", "repairs", "journal")
+
+
+def make_note_names(count, seed=0):
+    """
+    Return <count> distinct, deterministic, note-like names.
+    """
+
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        words = rng.sample(WORDS, rng.randint(1, 3))
+        names.add("{0} {1}".format(" ".join(words), rng.randint(1, 10 ** 6)))
+    return sorted(names)
+
+def make_queries(note_names, count, seed=1):
+    """
+    Return <count> queries: mostly substrings of existing names,
+    with some that match nothing.
+    """
+
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        if i % 10 == 0:
+            queries.append("zq{0}x".format(i))
+            continue
+        name = rng.choice(note_names)
+        length = rng.randint(3, min(8, len(name)))
+        start = rng.randint(0, len(name) - length)
+        queries.append(name[start:start + length])
+    return queries
+
+def time_queries(search, queries):
+    """
+    Return the per-query latencies, in seconds, of cold (uncached)
+    searches.
+    """
+
+    latencies = []
+    for query in queries:
+        search.clear_cache()
+        start = time.perf_counter()
+        search.search(query)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+def report(label, latencies):
+    median = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print("  {0:<8} median {1:10.3f} ms   p95 {2:10.3f} ms".format(
+            label, median * 1000, p95 * 1000))
+
+def main(sizes):
+    for size in sizes:
+        note_names = make_note_names(size)
+        queries = make_queries(note_names, NUM_QUERIES)
+
+        start = time.perf_counter()
+        trigram_search = NoteNameSearch(note_names)
+        build_time = time.perf_counter() - start
+        scan_search = NoteNameSearch(note_names, use_trigrams=False)
+
+        print("{0} names (index built in {1:.2f} s):".format(size, build_time))
+        report("scan", time_queries(scan_search, queries))
+        report("trigram", time_queries(trigram_search, queries))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
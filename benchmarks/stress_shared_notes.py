@@ -0,0 +1,123 @@
+#!/usr/bin/python -B
+"""
+Stress test saving one notes list from many processes at once: each
+process adds its own notes, a few at a time, to a shared notes list
+(pickle storage, through SharedNotesList) and to a shared notes
+journal, and the result is checked for lost notes.
+
+Usage: python benchmarks/stress_shared_notes.py [PROCESSES [NOTES_EACH [DIR]]]
+
+Point DIR at a network share to test locking there.
+"""
+
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from journal import NotesJournal
+from notes_list import SharedNotesList, read_stamped_notes_list
+
+DEFAULT_PROCESSES = 8
+DEFAULT_NOTES_EACH = 200
+# Most notes added in one save
+MAX_BATCH = 5
+
+
+def note_batches(worker, count):
+    """
+    Return one worker's notes as a list of small batches of "add"
+    changes.
+    """
+
+    rng = random.Random(worker)
+    changes = [("add", ("Worker {0} note {1}".format(worker, i),
+                        "worker{0}note{1}.rtf".format(worker, i)))
+               for i in range(count)]
+    batches = []
+    while changes:
+        size = rng.randint(1, MAX_BATCH)
+        batches.append(changes[:size])
+        changes = changes[size:]
+    return batches
+
+def add_to_notes_list(args):
+    notes_list_path, worker, count = args
+    shared_notes_list = SharedNotesList(notes_list_path)
+    shared_notes_list.load()
+    for batch in note_batches(worker, count):
+        shared_notes_list.save(batch)
+    return worker
+
+def add_to_journal(args):
+    notes_list_path, worker, count = args
+    shared_notes_list = SharedNotesList(notes_list_path)
+    journal = NotesJournal(notes_list_path + ".journal", shared_notes_list.lock)
+    for i, batch in enumerate(note_batches(worker, count)):
+        journal.append_many(batch)
+        if i % 10 == 9:
+            # Compact now and then, racing the other appenders.
+            journal.compact(shared_notes_list.read_copy, shared_notes_list.try_replace)
+            journal.compaction_thread.join()
+    return worker
+
+def check(notes, processes, notes_each):
+    """
+    Return the number of notes missing from <notes>.
+    """
+
+    missing = 0
+    for worker in range(processes):
+        for i in range(notes_each):
+            if "Worker {0} note {1}".format(worker, i) not in notes:
+                missing += 1
+    return missing
+
+def run(name, target, dir_path, processes, notes_each):
+    notes_list_path = os.path.join(dir_path, name + ".pkl")
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(processes)
+    try:
+        pool.map(target, [(notes_list_path, worker, notes_each)
+                          for worker in range(processes)])
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.perf_counter() - start
+
+    shared_notes_list = SharedNotesList(notes_list_path)
+    with shared_notes_list.lock:
+        notes = shared_notes_list.load()
+        NotesJournal(notes_list_path + ".journal").replay(notes)
+    stamp = read_stamped_notes_list(notes_list_path)[1] if os.path.isfile(notes_list_path) else 0
+    missing = check(notes, processes, notes_each)
+    print("{0:8} {1:6} notes  {2:5} missing  stamp {3:5}  {4:7.2f} s".format(
+        name, len(notes), missing, stamp, elapsed))
+    return missing
+
+def main(args):
+    processes = int(args[0]) if len(args) > 0 else DEFAULT_PROCESSES
+    notes_each = int(args[1]) if len(args) > 1 else DEFAULT_NOTES_EACH
+    if len(args) > 2:
+        dir_path = tempfile.mkdtemp(dir=args[2])
+    else:
+        dir_path = tempfile.mkdtemp()
+    print("{0} processes adding {1} notes each".format(processes, notes_each))
+    try:
+        missing = run("pickle", add_to_notes_list, dir_path, processes, notes_each)
+        missing += run("journal", add_to_journal, dir_path, processes, notes_each)
+    finally:
+        shutil.rmtree(dir_path)
+    if missing:
+        print("FAILED: notes were lost")
+        return 1
+    print("OK: no notes were lost")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
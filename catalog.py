@@ -0,0 +1,1516 @@
+## NoteBag's Notes Catalog, Without the GUI
+
+import atexit
+import os
+import re
+import threading
+import time
+
+from content_index import ContentIndex
+from helpers import (config_get, config_getboolean, config_getint, fold_case,
+                     get_called_script_dir, read_config, save_config)
+from instrument import Stats, env_instrumentation, instrument_methods
+from integrity import DEFAULT_CHECKSUM
+from journal import NotesJournal
+from launcher import EditorLauncher, editor_command
+from layout import (FLAT, LAYOUTS, layout_note_filename, make_shard_dir,
+                    note_basename, note_filename_variants)
+from notes_list import SharedNotesList, read_notes_list, replace_notes_list
+from notes_writer import NotesListWriter, file_signature, replace_file
+from reconcile import (NotesDirScanner, iter_note_files, reconcile,
+                       remove_empty_shards, rtf_note_title)
+from search import NoteNameSearch
+from sqlite_catalog import (SQLITE_CATALOG_EXTENSION, SqliteNotesCatalog,
+                            import_notes_list, is_sqlite_catalog_path)
+from watcher import MODIFIED, OVERFLOWED, make_watcher
+
+CONFIG_FILENAME = "NoteBag.ini"
+TEMPLATE_CONFIG_FILENAME = "Template-NoteBag.ini"
+# The placeholder in the note template that's replaced by the note name
+NOTE_NAME_PLACEHOLDER = "%(NOTE NAME)%"
+# How many note documents add_notes() writes at once
+NOTE_WRITER_THREADS = 8
+# How long a note document has to stay created or deleted before the
+# list of notes follows suit, so another NoteBag saving its list of
+# notes gets there first.
+WATCH_SETTLE_SECONDS = 2
+# Where instrumentation saves its stats, and cProfile its profiles, in
+# NoteBag's own folder
+STATS_FILENAME = "NoteBag-stats.json"
+PROFILE_FILENAME = "NoteBag-profile-{0}.pstats"
+# The notes opened most recently, in NoteBag's own folder, so they can
+# be listed before the whole list of notes has loaded
+RECENT_NOTES_FILENAME = "NoteBag-recent.json"
+# Added to a notes list file once it's been imported into an SQLite
+# notes catalog
+IMPORTED_EXTENSION = ".imported"
+# How many moved note documents migrate_notes_dir() records at once
+MIGRATION_BATCH_SIZE = 5000
+# Matches note filenames made unique with a numeric suffix.
+SUFFIXED_FILENAME_RE = re.compile(r"^(.*)-([0-9]+)\.rtf$")
+
+# Used by open_note() when it isn't given a launcher
+_editor_launcher = None
+
+
+def convert_notes_list(source_path, dest_path, checksum=DEFAULT_CHECKSUM):
+    """
+    Copy a notes list file to a new one, converting between the
+    pickle format and SQLite catalogs according to each file's
+    extension.
+    """
+
+    if is_sqlite_catalog_path(source_path):
+        catalog = SqliteNotesCatalog(source_path)
+        notes = catalog.load()
+        catalog.close()
+    else:
+        notes = read_notes_list(source_path)
+
+    if is_sqlite_catalog_path(dest_path):
+        import_notes_list(notes, dest_path)
+    else:
+        replace_notes_list(notes, dest_path, checksum=checksum)
+
+def sanitize_note_name(note_name):
+    """
+    Very conservatively remove any characters from a note name that
+    might not play nice with a filesystem.
+    """
+
+    note_name = note_name.strip()
+    def okay_filename_char(c):
+        return c.lower() in "abcdefghijklmnopqrstuvwxyz.-_"
+    return "".join(list(filter(okay_filename_char, tuple(note_name))))
+
+def split_note_filename(filename):
+    """
+    Split a note filename into its base and its numeric suffix, so
+    "foo-3.rtf" gives ("foo", 3). A filename without a suffix counts
+    as suffix 1, so "foo.rtf" gives ("foo", 1).
+    """
+
+    match = SUFFIXED_FILENAME_RE.match(filename)
+    if match:
+        return match.group(1), int(match.group(2))
+    if filename.endswith(".rtf"):
+        filename = filename[:-len(".rtf")]
+    return filename, 1
+
+# Template file path -> (modification time, the template split
+# around NOTE_NAME_PLACEHOLDER and encoded as UTF-8)
+note_templates = {}
+
+def read_note_template(template_file_path):
+    """
+    Return a note template as a list of UTF-8 encoded pieces, to be
+    joined with the encoded note name. The template file is only read
+    again if it has changed.
+    """
+
+    mtime = os.path.getmtime(template_file_path)
+    cached = note_templates.get(template_file_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(template_file_path) as tf:
+        template = tf.read()
+    pieces = [piece.encode('utf-8')
+              for piece in template.split(NOTE_NAME_PLACEHOLDER)]
+    note_templates[template_file_path] = (mtime, pieces)
+    return pieces
+
+def create_skeleton_note(note_name, note_path, template_file_path,
+                         exclusive=False):
+    """
+    Create a skeleton note document, containing just the note's name.
+
+    If <exclusive> is True, raise FileExistsError rather than
+    overwriting an existing document (say, one another copy of
+    NoteBag just created).
+    """
+
+    pieces = read_note_template(template_file_path)
+    mode = 'xb' if exclusive else 'wb'
+    try:
+        f = open(note_path, mode)
+    except FileNotFoundError:
+        # The first note in a new shard (see layout.py)
+        make_shard_dir(note_path)
+        f = open(note_path, mode)
+    with f:
+        f.write(note_name.encode('utf-8').join(pieces))
+
+def read_note_names(file_path):
+    """
+    Read a list of note names from a file: the first column of a .csv
+    file, or each line of any other file. Blank names are skipped.
+    """
+
+    with open(file_path) as f:
+        if file_path.lower().endswith(".csv"):
+            import csv
+            note_names = [row[0] for row in csv.reader(f) if row]
+        else:
+            note_names = f.read().splitlines()
+    return [note_name.strip() for note_name in note_names if note_name.strip()]
+
+def open_note(note_path, document_editor=None, launcher=None):
+    """
+    Open a note for editing with with a program, started by an
+    EditorLauncher (by default, one shared by the whole process).
+
+    Use the document_editor arg if available; otherwise, use a command
+    appropriate to the operating system that will open the default
+    program for the file type. Raise an EnvironmentError if the note
+    can't be opened.
+    """
+
+    global _editor_launcher
+    if not os.path.isfile(note_path):
+        raise EnvironmentError("File {0} doesn't exist".format(note_path))
+
+    cmd, creationflags = editor_command(note_path, document_editor)
+    if launcher is None:
+        if _editor_launcher is None:
+            _editor_launcher = EditorLauncher()
+        launcher = _editor_launcher
+    launcher.launch(cmd, creationflags)
+
+
+class NoteCatalog:
+    """
+    The list of notes and everything done with it, without any GUI:
+    loading and saving it, looking notes up, searching them, and
+    adding, renaming and deleting them. The NoteBag GUI (NoteBag.py)
+    and the command line (notebag_cli.py) are both built on it.
+
+    Background work (indexing note contents, reconciling and watching
+    the notes folder) runs on threads, but only starts when asked;
+    whoever asks polls for the results.
+    """
+
+    config = None
+    notes = None
+    notes_journal = None
+    notes_catalog = None
+    notes_writer = None
+    shared_notes_list = None
+
+    # Case-insensitive indexes of self.notes, kept up to date by
+    # index_note() and unindex_note().
+    note_name_keys = None       # casefolded note name -> note name
+    note_filename_keys = None   # casefolded filename -> note name
+    filename_suffixes = None    # casefolded filename base -> highest suffix
+    note_search = None
+    content_index = None
+    content_indexing_thread = None
+    content_index_changed = False
+    reconcile_thread = None
+    reconcile_results = None
+    watcher = None
+    # Path -> (mtime, size) of the files NoteBag itself last wrote,
+    # so the watcher can tell them from changes made by others.
+    own_file_signatures = None
+    # Note filename -> (kind of change, time it was seen)
+    note_file_changes = None
+    notes_list_stale = False
+    notes_reload_thread = None
+    notes_reload_results = None
+    catalog_data_version = None
+    editor_launcher = None
+    # The names of the notes opened most recently, most recent first,
+    # once load_recent_notes() has read them
+    recent_notes = None
+    recent_notes_changed = False
+    # Instrumentation, if it's turned on
+    stats = None
+    profiler = None
+    # The methods whose every call is timed when instrumentation is on
+    instrumented_methods = ("load_notes_list", "save_notes_list",
+                            "save_notes_changes", "search_note_names",
+                            "add_note", "add_notes", "write_note_document",
+                            "open_note", "delete_note", "check_watcher")
+
+    # Config Options
+    notes_filename = None
+    notes_dir = None
+    notes_dir_layout = None
+    note_template_filename = None
+    document_editor = None
+    max_open_editors = None
+    editor_log_file = None
+    max_recent_notes = None
+    notes_list_storage = None
+    journal_compaction_size = None
+    notes_list_backups = None
+    notes_list_checksum = None
+    search_note_contents = None
+    indexing_threads = None
+    content_index_refresh_seconds = None
+    search_delay = None
+    search_mode = None
+    fuzzy_search_results = None
+    reconcile_notes_dir = None
+    watch_notes_dir = None
+    watch_interval_seconds = None
+    instrumentation = None
+    instrumentation_dump_seconds = None
+    profile_seconds = None
+
+
+    ## Config/Init Methods
+    def __init__(self):
+        start = time.perf_counter()
+        self.load_config()
+        if self.instrumentation:
+            self.start_instrumentation()
+            self.stats.record("load_config", time.perf_counter() - start)
+
+    def load_config(self):
+        """
+        Load NoteBag's config file, and use it to set config options.
+        """
+
+        config = self.config = read_config(CONFIG_FILENAME)
+        self.notes_list_filename = config.get("NoteBag", "Notes List File")
+        self.notes_dir = config.get("NoteBag", "Notes Directory")
+        self.notes_dir_layout = config_get(config, "NoteBag", "Notes Folder Layout", FLAT).strip().lower() or FLAT
+        self.note_template_filename = config.get("NoteBag", "Note Template Filename")
+        # Read raw, so the "%s" placeholder isn't taken for interpolation
+        self.document_editor = config.get("NoteBag", "Document Editor", raw=True)
+        self.max_open_editors = config_getint(config, "NoteBag", "Max Open Editors", 0)
+        self.editor_log_file = config_get(config, "NoteBag", "Editor Log File", "").strip()
+        self.max_recent_notes = config_getint(config, "NoteBag", "Recent Notes", 10)
+        self.notes_list_storage = config_get(config, "NoteBag", "Notes List Storage", "pickle").strip().lower() or "pickle"
+        self.journal_compaction_size = config_getint(config, "NoteBag", "Journal Compaction Size", 1048576)
+        self.notes_list_backups = config_getint(config, "NoteBag", "Notes List Backups", 0)
+        self.notes_list_checksum = config_get(config, "NoteBag", "Notes List Checksum", DEFAULT_CHECKSUM).strip().lower() or DEFAULT_CHECKSUM
+        self.search_note_contents = config_getboolean(config, "NoteBag", "Search Note Contents", False)
+        self.indexing_threads = config_getint(config, "NoteBag", "Indexing Threads", 4)
+        self.content_index_refresh_seconds = config_getint(config, "NoteBag", "Content Index Refresh Seconds", 60)
+        self.search_delay = config_getint(config, "NoteBag", "Search Delay", 100)
+        self.search_mode = config_get(config, "NoteBag", "Search Mode", "substring").strip().lower() or "substring"
+        self.fuzzy_search_results = config_getint(config, "NoteBag", "Fuzzy Search Results", 500)
+        self.reconcile_notes_dir = config_getboolean(config, "NoteBag", "Reconcile Notes Folder", False)
+        self.watch_notes_dir = config_getboolean(config, "NoteBag", "Watch Notes Folder", False)
+        self.watch_interval_seconds = config_getint(config, "NoteBag", "Watch Interval Seconds", 2)
+        env_enabled, env_profile_seconds = env_instrumentation()
+        self.profile_seconds = env_profile_seconds or config_getint(config, "NoteBag", "Profile Seconds", 0)
+        self.instrumentation = (env_enabled or self.profile_seconds > 0
+                                or config_getboolean(config, "NoteBag", "Instrumentation", False))
+        self.instrumentation_dump_seconds = config_getint(config, "NoteBag", "Instrumentation Dump Seconds", 60)
+
+    def save_config(self):
+        """
+        Save NoteBag's current configuration to its config file.
+        """
+
+        save_config(self.config, CONFIG_FILENAME)
+
+    def start_instrumentation(self):
+        """
+        Start timing the instrumented methods, saving the stats to
+        STATS_FILENAME every
+        "Instrumentation Dump Seconds", and, if "Profile Seconds" is
+        set, profiling with cProfile until stop_profiling().
+
+        When instrumentation is off, none of this is set up, so it
+        costs nothing.
+        """
+
+        stats = self.stats = Stats()
+        instrument_methods(self, self.instrumented_methods, stats)
+        if self.instrumentation_dump_seconds > 0:
+            stats.start_dumping(self.stats_path(),
+                                self.instrumentation_dump_seconds)
+        if self.profile_seconds > 0:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profiling(self):
+        """
+        Stop profiling, and save the profile to a .pstats file in
+        NoteBag's folder, for the pstats module (or a viewer like
+        SnakeViz) to read. Return its path, or None if NoteBag wasn't
+        being profiled.
+
+        Only the thread that started profiling is profiled, and it has
+        to be the one to stop it.
+        """
+
+        profiler = self.profiler
+        if profiler is None:
+            return None
+        self.profiler = None
+        profiler.disable()
+        profile_path = os.path.join(get_called_script_dir(), PROFILE_FILENAME.format(
+                time.strftime("%Y%m%d-%H%M%S")))
+        profiler.dump_stats(profile_path)
+        return profile_path
+
+    def load_notes_list(self, notes_read=None):
+        """
+        Load the list of notes, and build its indexes. No background
+        work is started; see start_content_indexing(),
+        start_reconcile() and start_watching().
+
+        If given, notes_read() is called once the list of notes has
+        been read, before its indexes are built.
+        """
+
+        # TODO handle exceptions
+        if self.notes_writer is None:
+            self.notes_writer = NotesListWriter(self.save_notes_changes)
+            atexit.register(self.notes_writer.flush)
+        else:
+            self.notes_writer.flush()
+        self.shared_notes_list = SharedNotesList(self.notes_list_path(),
+                                                 self.notes_list_checksum,
+                                                 self.notes_list_backups)
+
+        self.notes_journal = None
+        self.notes_catalog = None
+        if self.notes_list_storage == "sqlite":
+            self.load_notes_catalog()
+        else:
+            self.load_notes_list_file()
+        if notes_read is not None:
+            notes_read()
+
+        self.rebuild_note_indexes()
+        self.note_search = self.new_note_search()
+
+        if self.search_note_contents:
+            self.content_index = ContentIndex(self.content_index_path(),
+                                              self.indexing_threads)
+
+    def read_notes_list_file(self, repair=True):
+        """
+        Read the notes list file, and replay any changes journaled
+        since it was last saved in full. Return the notes, the
+        journal, and the number of journaled changes replayed.
+
+        If <repair> is False, a torn record at the end of the journal
+        is left alone rather than truncated away.
+        """
+
+        shared_notes_list = self.shared_notes_list
+        with shared_notes_list.lock:
+            notes = shared_notes_list.load()
+            journal = NotesJournal(self.notes_journal_path(),
+                                   shared_notes_list.lock)
+            replayed = journal.replay(notes, repair)
+        return notes, journal, replayed
+
+    def load_notes_list_file(self):
+        """
+        Load the list of notes from the notes list file, for "pickle"
+        or "journal" storage.
+
+        Raise a ValueError if the notes list file was imported into an
+        SQLite notes catalog, since it's out of date from then on.
+        """
+
+        imported_path = self.notes_list_path() + IMPORTED_EXTENSION
+        if os.path.exists(imported_path):
+            raise ValueError(
+                "The list of notes was moved into the SQLite notes catalog "
+                "{0}, and the old list renamed to {1}. Set \"Notes List "
+                "Storage = sqlite\" in {2} to keep using it, or convert it "
+                "back with convert_notes_list.py and then remove {1}.".format(
+                    self.notes_catalog_path(), imported_path, CONFIG_FILENAME))
+
+        with self.shared_notes_list.lock:
+            self.notes, journal, replayed = self.read_notes_list_file()
+            if self.notes_list_storage != "journal":
+                # Journaling was switched off; fold the journal back
+                # into the notes list.
+                if replayed:
+                    self.save_notes_snapshot(self.notes)
+                journal.remove()
+        if self.notes_list_storage == "journal":
+            self.notes_journal = journal
+            self.maybe_compact_notes_journal()
+        else:
+            self.notes_journal = None
+
+    def load_notes_catalog(self):
+        """
+        Load the list of notes from the SQLite notes catalog, for
+        "sqlite" storage. The first time, the notes list file is
+        imported into it, and then renamed out of the way, so notes
+        deleted from the catalog later don't come back.
+        """
+
+        catalog = self.notes_catalog = SqliteNotesCatalog(self.notes_catalog_path())
+        if catalog.imported_from() is None:
+            self.import_notes_list_file(catalog)
+        self.notes = catalog.load()
+
+    def import_notes_list_file(self, catalog):
+        """
+        Import the notes list file, and its journal, into an SQLite
+        notes catalog, and mark the catalog as imported. The notes
+        list file is renamed with IMPORTED_EXTENSION on the end, and
+        the journal is removed.
+        """
+
+        list_path = self.notes_list_path()
+        with self.shared_notes_list.lock:
+            if catalog.count() or os.path.abspath(list_path) == os.path.abspath(catalog.path):
+                # Nothing to import: the catalog was filled by a
+                # version of NoteBag that didn't mark it, or the notes
+                # list file is the catalog itself.
+                catalog.import_notes({}, list_path)
+                return
+            notes, journal, _ = self.read_notes_list_file()
+            catalog.import_notes(notes, list_path)
+            journal.remove()
+            if os.path.exists(list_path):
+                os.replace(list_path, list_path + IMPORTED_EXTENSION)
+
+    def save_notes_list(self, changes):
+        """
+        Save a sequence of (op, args) changes to the list of notes, in
+        the background.
+        """
+
+        self.notes_writer.schedule(changes)
+
+    def save_notes_changes(self, changes):
+        """
+        Save changes to the notes list file, merging them with any
+        changes other copies of NoteBag have saved (see
+        SharedNotesList), or, with "journal" storage, append them to
+        the notes journal. This runs on the notes writer's thread.
+        """
+
+        journal = self.notes_journal
+        if journal is not None:
+            journal.append_many(changes)
+            self.remember_own_write(journal.path)
+            self.maybe_compact_notes_journal()
+            return
+        self.shared_notes_list.save(changes)
+        self.remember_own_write(self.notes_list_path(),
+                                self.shared_notes_list.signature)
+
+    def save_notes_snapshot(self, notes):
+        """
+        Atomically save a copy of the list of notes, keeping the
+        configured number of backups.
+        """
+
+        self.shared_notes_list.save_snapshot(notes)
+        self.remember_own_write(self.notes_list_path(),
+                                self.shared_notes_list.signature)
+
+    def replace_notes_snapshot(self, notes, stamp, signature, replaced=None):
+        """
+        Save a copy of the list of notes based on an earlier save,
+        unless someone has saved since (see
+        SharedNotesList.try_replace()). Return True if it was saved.
+        """
+
+        if not self.shared_notes_list.try_replace(notes, stamp, signature, replaced):
+            return False
+        self.remember_own_write(self.notes_list_path(),
+                                self.shared_notes_list.signature)
+        return True
+
+    def start_content_indexing(self):
+        """
+        Bring the note contents index up to date in a background
+        thread, loading the saved index first if need be. Return False
+        if an update is already running.
+
+        content_index_changed is set once the update has changed the
+        index.
+        """
+
+        if self.content_indexing():
+            return False
+
+        content_index = self.content_index
+        note_filenames = list(self.notes.values())
+        notes_dir = self.notes_dir
+        def update_content_index():
+            if not content_index.documents:
+                content_index.load()
+            if content_index.update(note_filenames, notes_dir):
+                content_index.save()
+                self.content_index_changed = True
+
+        thread = self.content_indexing_thread = threading.Thread(
+            target=update_content_index, name="NoteBag content indexing")
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def content_indexing(self):
+        """
+        Return True if the note contents index is being updated.
+        """
+
+        thread = self.content_indexing_thread
+        return thread is not None and thread.is_alive()
+
+    def start_reconcile(self):
+        """
+        Compare the list of notes with the note documents actually in
+        the notes folder, in a background thread. Once it's done,
+        reconcile_differences() returns what it found.
+        """
+
+        notes = dict(self.notes)
+        notes_dir = self.notes_dir
+        scanner = NotesDirScanner(self.reconcile_state_path())
+        def reconcile_notes_dir():
+            scanner.load()
+            note_files, changed = scanner.note_files(notes_dir)
+            self.reconcile_results = reconcile(notes, note_files)
+            if changed:
+                scanner.save()
+
+        self.reconcile_results = None
+        thread = self.reconcile_thread = threading.Thread(
+            target=reconcile_notes_dir, name="NoteBag reconcile")
+        thread.daemon = True
+        thread.start()
+
+    def reconciling(self):
+        """
+        Return True if the background reconciliation is still running.
+        """
+
+        return self.reconcile_thread is not None and self.reconcile_thread.is_alive()
+
+    def reconcile_differences(self):
+        """
+        Return the differences the finished background reconciliation
+        found that still hold: a list of the note names whose documents
+        are missing, and a list of the documents that aren't in the
+        list of notes. Return None if it failed.
+        """
+
+        if self.reconcile_results is None:
+            # It failed, and already printed why.
+            return None
+
+        missing, untracked = self.reconcile_results
+        # Notes may have been added or deleted in the meantime.
+        missing = [note_name for note_name in missing
+                   if note_name in self.notes
+                   and not os.path.isfile(self.get_note_path(note_name))]
+        untracked = [note_filename for note_filename in untracked
+                     if not self.note_filename_exists(note_filename)]
+        return missing, untracked
+
+    def start_watching(self):
+        """
+        Start watching the notes folder for changes made by other
+        programs (or other copies of NoteBag), to keep the list of
+        notes up to date while NoteBag is running. check_watcher()
+        must then be called regularly.
+        """
+
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.own_file_signatures is None:
+            self.own_file_signatures = {}
+        self.note_file_changes = {}
+        self.notes_list_stale = False
+
+        watched_filenames = []
+        if self.notes_catalog is not None:
+            # SQLite says when another connection has changed it.
+            self.catalog_data_version = self.notes_catalog.data_version()
+        else:
+            for file_path in (self.notes_list_path(), self.notes_journal_path()):
+                if os.path.dirname(os.path.abspath(file_path)) == os.path.abspath(self.notes_dir):
+                    watched_filenames.append(os.path.basename(file_path))
+        self.watcher = make_watcher(self.notes_dir, watched_filenames,
+                                    self.watch_interval_seconds)
+        self.watcher.start()
+
+    def remember_own_write(self, file_path, signature=None):
+        """
+        Remember what a file NoteBag just wrote looks like (its
+        file_signature(), if not given), so the watcher doesn't
+        mistake the write for someone else's.
+        """
+
+        if self.own_file_signatures is None:
+            return
+        if signature is None:
+            signature = file_signature(file_path)
+        self.own_file_signatures[file_path] = signature
+
+    def is_own_write(self, file_path):
+        """
+        Return True if a file is just as NoteBag itself last wrote it.
+        """
+
+        signature = file_signature(file_path)
+        return (signature is not None
+                and self.own_file_signatures.get(file_path) == signature)
+
+    def check_watcher(self):
+        """
+        Act on the changes the watcher has seen: reload the list of
+        notes if someone else changed it, and add or remove notes
+        whose documents were created or deleted. Return whether the
+        list of notes changed, and whether any note documents were
+        changed.
+        """
+
+        watcher = self.watcher
+        now = time.time()
+        content_changed = False
+        changes = watcher.changes()
+        if self.stats is not None and changes:
+            self.stats.count("watcher changes", len(changes))
+        for kind, filename in changes:
+            if kind == OVERFLOWED:
+                # Too much happened to say what; check everything.
+                self.notes_list_stale = True
+                if self.reconcile_notes_dir:
+                    self.start_reconcile()
+            elif filename in watcher.filenames:
+                if not self.is_own_write(os.path.join(self.notes_dir, filename)):
+                    self.notes_list_stale = True
+            elif kind == MODIFIED:
+                content_changed = True
+            else:
+                self.note_file_changes[filename] = (kind, now)
+        if self.shared_notes_list.others_saved:
+            # Our last save merged in someone else's changes.
+            self.shared_notes_list.others_saved = False
+            self.notes_list_stale = True
+        if (self.notes_catalog is not None
+                and self.notes_catalog.data_version() != self.catalog_data_version):
+            self.catalog_data_version = self.notes_catalog.data_version()
+            self.notes_list_stale = True
+
+        changed = False
+        reload_thread = self.notes_reload_thread
+        if reload_thread is not None and not reload_thread.is_alive():
+            self.notes_reload_thread = None
+            if self.notes_reload_results is not None:
+                changed = self.apply_notes_delta(*self.notes_reload_results)
+        elif reload_thread is None and self.notes_list_stale:
+            self.start_notes_reload()
+        if self.notes_reload_thread is None and not self.notes_list_stale:
+            changed = self.apply_note_file_changes(now) or changed
+        return changed, content_changed
+
+    def start_notes_reload(self):
+        """
+        Read the list of notes back from storage in a background
+        thread, and work out how it differs from the one in memory.
+        Our own unsaved changes would look like someone else's, so
+        this waits until they're saved.
+        """
+
+        if self.notes_writer.busy() or (self.notes_journal is not None
+                                        and self.notes_journal.compacting()):
+            return
+        self.notes_list_stale = False
+        old_notes = dict(self.notes)
+        catalog_path = None
+        if self.notes_catalog is not None:
+            catalog_path = self.notes_catalog.path
+
+        def reload_notes():
+            if catalog_path is not None:
+                # SQLite connections belong to the thread that made them.
+                catalog = SqliteNotesCatalog(catalog_path)
+                try:
+                    notes = catalog.load()
+                finally:
+                    catalog.close()
+            else:
+                notes, _, _ = self.read_notes_list_file(repair=False)
+            removed = [note_name for note_name in old_notes
+                       if note_name not in notes]
+            updated = [(note_name, note_filename)
+                       for note_name, note_filename in notes.items()
+                       if old_notes.get(note_name) != note_filename]
+            self.notes_reload_results = (old_notes, removed, updated)
+
+        self.notes_reload_results = None
+        thread = self.notes_reload_thread = threading.Thread(
+            target=reload_notes, name="NoteBag notes reload")
+        thread.daemon = True
+        thread.start()
+
+    def apply_notes_delta(self, old_notes, removed, updated):
+        """
+        Apply the differences found by start_notes_reload() to the
+        list of notes and its indexes, skipping notes that were
+        changed here in the meantime. Return True if anything
+        changed.
+        """
+
+        changed = False
+        for note_name in removed:
+            if note_name in self.notes and self.notes[note_name] == old_notes[note_name]:
+                self.unindex_note(note_name)
+                del(self.notes[note_name])
+                self.note_search.remove(note_name)
+                changed = True
+        for note_name, note_filename in updated:
+            if self.notes.get(note_name) != old_notes.get(note_name):
+                continue
+            if note_name in self.notes:
+                self.unindex_note(note_name)
+                self.note_search.remove(note_name)
+            self.notes[note_name] = note_filename
+            self.index_note(note_name)
+            self.note_search.add(note_name)
+            changed = True
+        return changed
+
+    def apply_note_file_changes(self, now):
+        """
+        Add notes for note documents that were created, and forget
+        notes whose documents were deleted, once they've settled.
+        Return True if anything changed.
+        """
+
+        settled = [note_filename
+                   for note_filename, (_, seen) in self.note_file_changes.items()
+                   if now - seen >= WATCH_SETTLE_SECONDS]
+        created = []
+        deleted = []
+        # Documents moved by a migration between layouts
+        moved = []
+        for note_filename in settled:
+            del(self.note_file_changes[note_filename])
+            exists = os.path.isfile(os.path.join(self.notes_dir, note_filename))
+            tracked = self.note_filename_exists(note_filename)
+            if exists and not tracked:
+                note_name = self.moved_note_name(note_filename)
+                if note_name is not None:
+                    moved.append((note_name, note_filename))
+                else:
+                    created.append(note_filename)
+            elif tracked and not exists:
+                note_name = self.note_filename_keys[fold_case(note_filename)]
+                moved_filename = self.locate_note_file(note_filename)
+                if moved_filename is not None:
+                    moved.append((note_name, moved_filename))
+                else:
+                    deleted.append(note_name)
+
+        if moved:
+            self.move_notes(moved)
+        if created:
+            self.import_note_files(sorted(created))
+        if deleted:
+            self.forget_notes(deleted)
+        return bool(created or deleted)
+
+    def record_notes_change(self, op, *args):
+        """
+        Persist one change to the list of notes.
+
+        With "sqlite" storage, the change is made to the notes catalog
+        in its own transaction. Otherwise, it's saved in the
+        background: with "journal" storage, it's appended to the notes
+        journal, and otherwise the whole list of notes is saved.
+        """
+
+        self.record_notes_changes([(op, args)])
+
+    def record_notes_changes(self, changes):
+        """
+        Persist a sequence of (op, args) changes to the list of notes
+        all at once, in the same way as record_notes_change().
+        """
+
+        if not changes:
+            return
+        if self.notes_catalog is not None:
+            self.notes_catalog.record_many(changes)
+        else:
+            self.save_notes_list(changes)
+
+    def maybe_compact_notes_journal(self):
+        """
+        If the notes journal has grown past its size limit, start
+        folding it into the notes list in the background.
+        """
+
+        journal = self.notes_journal
+        if journal.size() > self.journal_compaction_size:
+            journal.compact(self.shared_notes_list.read_copy,
+                            self.replace_notes_snapshot)
+
+    ## Back-End Methods
+    def notes_list_path(self):
+        """
+        Return the path to the notes list file.
+        """
+
+        return os.path.join(self.notes_dir, self.notes_list_filename)
+
+    def content_index_path(self):
+        """
+        Return the path to the note contents index file.
+        """
+
+        return self.notes_list_path() + ".index"
+
+    def notes_catalog_path(self):
+        """
+        Return the path to the SQLite notes catalog, which sits next
+        to the notes list file.
+        """
+
+        notes_list_path = self.notes_list_path()
+        if is_sqlite_catalog_path(notes_list_path):
+            return notes_list_path
+        return os.path.splitext(notes_list_path)[0] + SQLITE_CATALOG_EXTENSION
+
+    def reconcile_state_path(self):
+        """
+        Return the path to the file remembering the notes folder's
+        listing between reconciliations.
+        """
+
+        return self.notes_list_path() + ".reconcile"
+
+    def notes_journal_path(self):
+        """
+        Return the path to the notes journal file.
+        """
+
+        return self.notes_list_path() + ".journal"
+
+    def template_note_path(self):
+        """
+        Return the path to the template note file.
+        """
+
+        return os.path.join(get_called_script_dir(), self.note_template_filename)
+
+    def stats_path(self):
+        """
+        Return the path to the file instrumentation saves its stats to.
+        """
+
+        return os.path.join(get_called_script_dir(), STATS_FILENAME)
+
+    def recent_notes_path(self):
+        """
+        Return the path to the file the most recently opened notes are
+        saved in.
+        """
+
+        return os.path.join(get_called_script_dir(), RECENT_NOTES_FILENAME)
+
+    def editor_log_path(self):
+        """
+        Return the path to the file logging document editors' output,
+        or None if it's thrown away. A relative path is relative to
+        NoteBag's own folder.
+        """
+
+        if not self.editor_log_file:
+            return None
+        return os.path.join(get_called_script_dir(),
+                            os.path.expanduser(self.editor_log_file))
+
+    def rebuild_note_indexes(self):
+        """
+        Rebuild the case-insensitive indexes of self.notes from
+        scratch.
+        """
+
+        self.note_name_keys = {}
+        self.note_filename_keys = {}
+        self.filename_suffixes = {}
+        for note_name in self.notes:
+            self.index_note(note_name)
+
+    def new_note_search(self):
+        """
+        Return a NoteNameSearch over the note names, building only the
+        index the search mode uses, up front.
+        """
+
+        fuzzy = self.search_mode == "fuzzy"
+        return NoteNameSearch(self.notes, use_trigrams=not fuzzy,
+                              build_fuzzy_index=fuzzy)
+
+    def index_note(self, note_name):
+        """
+        Add a note in self.notes to the case-insensitive indexes.
+        """
+
+        note_filename = self.notes[note_name]
+        self.note_name_keys[fold_case(note_name)] = note_name
+        folded_filename = fold_case(note_filename)
+        self.note_filename_keys[folded_filename] = note_name
+
+        base, suffix_num = split_note_filename(note_basename(folded_filename))
+        if suffix_num > self.filename_suffixes.get(base, 0):
+            self.filename_suffixes[base] = suffix_num
+
+    def unindex_note(self, note_name):
+        """
+        Remove a note in self.notes from the case-insensitive
+        indexes.
+
+        The highest filename suffix used for the note's filename base
+        is remembered, so new filenames don't have to probe past it.
+        """
+
+        self.note_name_keys.pop(fold_case(note_name), None)
+        self.note_filename_keys.pop(fold_case(self.notes[note_name]), None)
+
+    def note_filename_exists(self, filename):
+        """
+        If a note filename already exists case-insensitively, return
+        the proper filename from self.notes.
+        """
+
+        note_name = self.note_filename_keys.get(fold_case(filename))
+        if note_name is None:
+            return False
+        return self.notes[note_name]
+
+    def note_filename_used(self, filename):
+        """
+        Return True if a note filename is in the list of notes (in any
+        layout), or its document already exists.
+        """
+
+        if (self.note_filename_exists(filename)
+                or os.path.exists(os.path.join(self.notes_dir, filename))):
+            return True
+        return any(self.note_filename_exists(variant)
+                   for variant in note_filename_variants(filename))
+
+    def locate_note_file(self, note_filename):
+        """
+        Return the note filename a note document can be found at: the
+        one given, or, if a migration between layouts has moved it
+        since, its new one. Return None if it can't be found.
+        """
+
+        for variant in [note_filename] + note_filename_variants(note_filename):
+            if os.path.isfile(os.path.join(self.notes_dir, variant)):
+                return variant
+        return None
+
+    def moved_note_name(self, note_filename):
+        """
+        Return the name of the note whose document has been moved to
+        <note_filename> from where another layout would put it, or
+        None if there isn't one.
+        """
+
+        for variant in note_filename_variants(note_filename):
+            note_name = self.note_filename_keys.get(fold_case(variant))
+            if (note_name is not None and not os.path.isfile(
+                    os.path.join(self.notes_dir, self.notes[note_name]))):
+                return note_name
+        return None
+
+    def note_name_exists(self, note_name):
+        """
+        If the given note name matches an existing note name
+        case-insensitively, return the "proper" note name from
+        self.notes; if the given note name does not exist, return
+        None.
+        """
+
+        return self.note_name_keys.get(fold_case(note_name))
+
+    def content_matches(self, search_str, exclude=()):
+        """
+        Return the names of the notes whose documents contain the
+        words in <search_str>, best matches first, leaving out any note
+        names in <exclude>.
+        """
+
+        note_names = []
+        for _, note_filename in self.content_index.search(search_str):
+            note_name = self.note_filename_keys.get(fold_case(note_filename))
+            if note_name is not None and note_name not in exclude:
+                note_names.append(note_name)
+        return note_names
+
+    def get_note_path(self, note_name):
+        """
+        Return the path to an existing note document, wherever it's
+        been moved to by a migration between layouts.
+        """
+
+        note_filename = self.notes[note_name]
+        note_path = os.path.join(self.notes_dir, note_filename)
+        if not os.path.isfile(note_path):
+            moved_filename = self.locate_note_file(note_filename)
+            if moved_filename is not None:
+                note_path = os.path.join(self.notes_dir, moved_filename)
+        return note_path
+
+    def new_note_filename(self, note_name):
+        """
+        Return an unused filename appropriate for the given note name.
+
+        Note filenames are .rtf files, in the shard the notes folder
+        layout puts them in. All "un-kosher" characters are stripped
+        out of the note name, so the filesystem doesn't choke on them.
+        A filename that isn't in the list of notes yet, but
+        whose document exists (say, because another copy of NoteBag is
+        adding it), counts as used.
+        """
+
+        filename_base = sanitize_note_name(note_name)
+        layout = self.notes_dir_layout
+        filename = layout_note_filename(filename_base + ".rtf", layout)
+        if not self.note_filename_used(filename):
+            return filename
+
+        # Start just past the highest suffix already used for this
+        # base, rather than probing every suffix from 2 up.
+        suffix_num = max(self.filename_suffixes.get(fold_case(filename_base), 1) + 1, 2)
+        while self.note_filename_used(filename):
+            filename = layout_note_filename(
+                "{0}-{1}.rtf".format(filename_base, str(suffix_num)), layout)
+            suffix_num += 1
+        return filename
+
+    def write_note_document(self, note_name, note_path, exclusive=False):
+        """
+        Write a new note's skeleton document from the note template
+        (see create_skeleton_note()).
+
+        This may run on several threads at once.
+        """
+
+        create_skeleton_note(note_name, note_path, self.template_note_path(),
+                             exclusive)
+
+    def add_note(self, note_name, note_filename=None):
+        """
+        Add a note document, and save the list of notes.
+        """
+
+        if note_filename:
+            note_path = os.path.join(self.notes_dir, note_filename)
+            self.write_note_document(note_name, note_path)
+        else:
+            while True:
+                note_filename = self.new_note_filename(note_name)
+                note_path = os.path.join(self.notes_dir, note_filename)
+                try:
+                    self.write_note_document(note_name, note_path, exclusive=True)
+                    break
+                except FileExistsError:
+                    # Someone else took the filename just now.
+                    pass
+
+        self.notes[note_name] = note_filename
+        self.index_note(note_name)
+        self.note_search.add(note_name)
+        self.record_notes_change("add", note_name, note_filename)
+
+    def add_notes(self, note_names):
+        """
+        Add many notes at once: write their documents in parallel,
+        then save the list of notes once. Names that already exist, or
+        that appear more than once, are skipped, as are notes whose
+        documents can't be written. Return the names of the notes that
+        were added, and a list of (note name, reason) pairs for the
+        ones that were skipped.
+        """
+
+        # Give every note its filename up front, indexing each one so
+        # the next can't take the same filename.
+        new_notes = []
+        skipped = []
+        for note_name in note_names:
+            note_name = note_name.strip("\t ")
+            if not note_name:
+                continue
+            if self.note_name_exists(note_name):
+                skipped.append((note_name, "already exists"))
+                continue
+            note_filename = self.new_note_filename(note_name)
+            self.notes[note_name] = note_filename
+            self.index_note(note_name)
+            new_notes.append((note_name, note_filename))
+
+        def write_note(new_note):
+            note_name, note_filename = new_note
+            note_path = os.path.join(self.notes_dir, note_filename)
+            try:
+                self.write_note_document(note_name, note_path, exclusive=True)
+            except EnvironmentError as e:
+                return e
+            return None
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=NOTE_WRITER_THREADS) as executor:
+            errors = list(executor.map(write_note, new_notes))
+
+        added = []
+        for (note_name, note_filename), error in zip(new_notes, errors):
+            while isinstance(error, FileExistsError):
+                # Someone else took the filename just now; pick another,
+                # as add_note() does.
+                self.unindex_note(note_name)
+                del(self.notes[note_name])
+                note_filename = self.new_note_filename(note_name)
+                self.notes[note_name] = note_filename
+                self.index_note(note_name)
+                error = write_note((note_name, note_filename))
+            if error is None:
+                added.append((note_name, note_filename))
+            else:
+                self.unindex_note(note_name)
+                del(self.notes[note_name])
+                skipped.append((note_name, error.strerror or str(error)))
+        for note_name, _ in added:
+            self.note_search.add(note_name)
+        self.record_notes_changes([("add", new_note) for new_note in added])
+        return [note_name for note_name, _ in added], skipped
+
+    def add_notes_from_file(self, file_path):
+        """
+        Add a note for every name listed in a file (see
+        read_note_names()), and return the names of the notes that
+        were added and those that were skipped, as add_notes() does.
+        """
+
+        return self.add_notes(read_note_names(file_path))
+
+    def import_note_files(self, note_filenames):
+        """
+        Add existing note documents in the notes folder to the list of
+        notes, named by their RTF title or, failing that, their
+        filename. Return the names of the notes that were added.
+        """
+
+        added = []
+        for note_filename in note_filenames:
+            note_path = os.path.join(self.notes_dir, note_filename)
+            try:
+                note_name = rtf_note_title(note_path)
+            except EnvironmentError:
+                continue
+            if not note_name:
+                note_name = os.path.splitext(os.path.basename(note_filename))[0]
+            unique_name = note_name
+            suffix_num = 2
+            while self.note_name_exists(unique_name):
+                unique_name = "{0} ({1})".format(note_name, suffix_num)
+                suffix_num += 1
+
+            self.notes[unique_name] = note_filename
+            self.index_note(unique_name)
+            self.note_search.add(unique_name)
+            added.append((unique_name, note_filename))
+        self.record_notes_changes([("add", new_note) for new_note in added])
+        return [note_name for note_name, _ in added]
+
+    def forget_notes(self, note_names):
+        """
+        Remove notes from the list of notes, without touching their
+        documents (say, because they're already gone).
+        """
+
+        for note_name in note_names:
+            self.unindex_note(note_name)
+            del(self.notes[note_name])
+            self.note_search.remove(note_name)
+        self.record_notes_changes([("delete", (note_name,))
+                                   for note_name in note_names])
+
+    def rename_note(self, note_name, new_note_name):
+        """
+        Give an existing note a new name, keeping its note document,
+        and save the list of notes.
+        """
+
+        self.unindex_note(note_name)
+        self.notes[new_note_name] = self.notes.pop(note_name)
+        self.index_note(new_note_name)
+        self.note_search.remove(note_name)
+        self.note_search.add(new_note_name)
+        self.record_notes_change("rename", note_name, new_note_name)
+
+    def move_notes(self, moves):
+        """
+        Give notes the new filenames of their moved documents, and
+        save the list of notes. <moves> is a sequence of (note name,
+        note filename) pairs.
+        """
+
+        changes = []
+        for note_name, note_filename in moves:
+            if self.notes.get(note_name, note_filename) == note_filename:
+                continue
+            self.unindex_note(note_name)
+            self.notes[note_name] = note_filename
+            self.index_note(note_name)
+            changes.append(("move", (note_name, note_filename)))
+        self.record_notes_changes(changes)
+
+    def migrate_notes_dir(self, layout, progress=None):
+        """
+        Move every note document in the notes folder to where <layout>
+        (see layout.py) puts it, update the list of notes to match,
+        and switch the config to the new layout. Return the number of
+        documents moved, and the filenames of the ones that couldn't
+        be, because another document was already in the way.
+
+        The notes folder is read as it goes, rather than listed all at
+        once, and the list of notes is saved every
+        MIGRATION_BATCH_SIZE documents, calling progress(checked,
+        moved) if it's given. Documents that have been moved but not
+        saved yet can still be found (see get_note_path()), so a
+        migration that was interrupted can simply be run again.
+        """
+
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown notes folder layout '{0}'".format(layout))
+
+        checked = 0
+        moved = 0
+        conflicts = []
+        moves = []
+        for note_filename in iter_note_files(self.notes_dir):
+            checked += 1
+            new_filename = layout_note_filename(note_filename, layout)
+            note_name = self.note_filename_keys.get(fold_case(note_filename))
+            if note_name is None:
+                # A document moved by an interrupted migration
+                note_name = self.moved_note_name(note_filename)
+            if new_filename != note_filename:
+                new_path = os.path.join(self.notes_dir, new_filename)
+                if os.path.exists(new_path):
+                    conflicts.append(note_filename)
+                    continue
+                if not os.path.isdir(os.path.dirname(new_path)):
+                    make_shard_dir(new_path)
+                try:
+                    os.rename(os.path.join(self.notes_dir, note_filename), new_path)
+                except FileNotFoundError:
+                    # Deleted in the meantime
+                    continue
+                moved += 1
+            if note_name is not None and self.notes[note_name] != new_filename:
+                moves.append((note_name, new_filename))
+            if checked % MIGRATION_BATCH_SIZE == 0:
+                self.move_notes(moves)
+                moves = []
+                if progress is not None:
+                    progress(checked, moved)
+        self.move_notes(moves)
+        if progress is not None:
+            progress(checked, moved)
+        remove_empty_shards(self.notes_dir)
+
+        self.notes_dir_layout = layout
+        self.config.set("NoteBag", "Notes Folder Layout", layout)
+        self.save_config()
+        return moved, conflicts
+
+    def export_archive(self, archive_path, base_archive_path=None, progress=None):
+        """
+        Back up the list of notes and every note document to a single
+        archive (see archive.py), only copying the documents that have
+        changed since <base_archive_path> if it's given. Return the
+        counts export_archive() does.
+
+        The list of notes is read afresh as it was last saved, so
+        changes other copies of NoteBag have made are included.
+        """
+
+        import archive
+        if self.notes_writer is not None:
+            self.notes_writer.flush()
+        if self.notes_catalog is not None:
+            notes = self.notes_catalog.load()
+        else:
+            notes, _, _ = self.read_notes_list_file(repair=False)
+        return archive.export_archive(notes, self.notes_dir, archive_path,
+                                      base_archive_path, progress=progress)
+
+    def restore_archive(self, archive_path, verify_only=False, progress=None):
+        """
+        Restore the note documents in an archive, checking every one
+        against its checksum, then replace the list of notes with the
+        archive's in one write. Return the list of (note filename,
+        problem) pairs for the documents that couldn't be restored; if
+        there are any, no document is changed and the list of notes is
+        left alone.
+
+        If <verify_only> is True, only check the archive; nothing is
+        changed.
+        """
+
+        import archive
+        notes, problems = archive.restore_archive(archive_path, self.notes_dir,
+                                                  verify_only=verify_only,
+                                                  progress=progress)
+        if not problems and not verify_only:
+            self.replace_all_notes(notes)
+        return problems
+
+    def replace_all_notes(self, notes):
+        """
+        Replace the whole list of notes with a dict of notes, saving
+        it in a single write (or transaction), and rebuild its
+        indexes.
+        """
+
+        if self.notes_writer is not None:
+            self.notes_writer.flush()
+        if self.notes_catalog is not None:
+            self.notes_catalog.replace_all(notes)
+        else:
+            with self.shared_notes_list.lock:
+                self.save_notes_snapshot(notes)
+                if self.notes_journal is not None:
+                    # Its changes were to the old list of notes.
+                    self.notes_journal.remove()
+        self.notes = dict(notes)
+        self.rebuild_note_indexes()
+        self.note_search = self.new_note_search()
+
+    def delete_note(self, note_name):
+        """
+        Delete a note's document file, and remove it from the list of
+        notes.
+        """
+
+        note_path = self.get_note_path(note_name)
+        self.unindex_note(note_name)
+        del(self.notes[note_name])
+        self.note_search.remove(note_name)
+        self.record_notes_change("delete", note_name)
+        os.remove(note_path)
+
+    def search_note_names(self, search_str, all_matches=False):
+        """
+        Return the names of the notes matching <search_str>: note
+        names containing it, in alphabetical order (or, for the
+        "fuzzy" search mode, the best "Fuzzy Search Results" fuzzy
+        matches for it, best first, or every one if <all_matches> is
+        True), followed by the notes whose documents contain it, best
+        matches first.
+
+        This may run on a background thread.
+        """
+
+        if self.search_mode == "fuzzy":
+            limit = None if all_matches else self.fuzzy_search_results
+            note_names = self.note_search.fuzzy_search(search_str, limit)
+        else:
+            # Matching note names, already sorted alphabetically
+            note_names = self.note_search.search(search_str)
+        if search_str and self.content_index is not None:
+            note_names += self.content_matches(search_str, set(note_names))
+        return note_names
+
+    def open_note(self, note_name):
+        """
+        Open a note for editing, and remember it as the most recently
+        opened. Raise an EnvironmentError if it can't be opened.
+        """
+
+        if self.editor_launcher is None:
+            self.editor_launcher = EditorLauncher(self.max_open_editors,
+                                                  self.editor_log_path())
+        open_note(self.get_note_path(note_name), self.document_editor,
+                  self.editor_launcher)
+        self.remember_recent_note(note_name)
+
+    def load_recent_notes(self):
+        """
+        Read the list of the most recently opened notes, which is
+        small enough to read before anything else. Return their names.
+        """
+
+        import json
+        recent_notes = []
+        if self.max_recent_notes > 0:
+            try:
+                with open(self.recent_notes_path()) as f:
+                    recent_notes = [note_name for note_name in json.load(f)
+                                    if isinstance(note_name, str)]
+            except (EnvironmentError, ValueError, TypeError):
+                pass
+        self.recent_notes = recent_notes[:self.max_recent_notes]
+        return list(self.recent_notes)
+
+    def remember_recent_note(self, note_name):
+        """
+        Move a note to the front of the most recently opened notes.
+        They're saved by close().
+        """
+
+        if self.max_recent_notes <= 0:
+            return
+        if self.recent_notes is None:
+            self.load_recent_notes()
+        recent_notes = [note_name]
+        recent_notes.extend(recent for recent in self.recent_notes
+                            if recent != note_name)
+        self.recent_notes = recent_notes[:self.max_recent_notes]
+        self.recent_notes_changed = True
+
+    def save_recent_notes(self):
+        """
+        Save the most recently opened notes, if they've changed,
+        leaving out any that have since been deleted or renamed.
+        """
+
+        if not self.recent_notes_changed:
+            return
+        import json
+        recent_notes = [recent for recent in self.recent_notes
+                        if recent in self.notes]
+        def write(temp_path):
+            with open(temp_path, "w") as f:
+                json.dump(recent_notes, f)
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            replace_file(self.recent_notes_path(), write)
+        except EnvironmentError:
+            return
+        self.recent_notes_changed = False
+
+    def close(self):
+        """
+        Stop any background work, and wait for the list of notes to
+        finish saving. The notes writer's error attribute says whether
+        saving failed.
+        """
+
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        if self.notes_writer is not None:
+            self.notes_writer.retry()
+            self.notes_writer.flush()
+        if self.notes_catalog is not None:
+            self.notes_catalog.close()
+            self.notes_catalog = None
+        self.save_recent_notes()
+        if self.stats is not None:
+            self.stop_profiling()
+            self.stats.stop_dumping()
+            try:
+                self.stats.dump(self.stats_path())
+            except EnvironmentError:
+                pass
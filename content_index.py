@@ -0,0 +1,265 @@
+## Full-Text Search of Note Documents
+
+import bisect
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+
+from helpers import fold_case
+from notes_writer import temp_file_path
+
+PICKLE_PROTOCOL = 2
+# Bump this whenever the saved index's layout or tokenizing changes.
+CONTENT_INDEX_VERSION = 1
+
+RTF_TOKEN_RE = re.compile(r"\\([a-zA-Z]+)(-?[0-9]+)? ?"   # control word
+                          r"|\\'([0-9a-fA-F]{2})"         # hex character
+                          r"|\\(.)"                       # control symbol
+                          r"|([{}])"                      # group
+                          r"|([^\\{}]+)",                 # text
+                          re.DOTALL)
+# RTF groups starting with these control words hold no note text.
+SKIPPED_DESTINATIONS = frozenset([
+    "colortbl", "comment", "fonttbl", "footer", "footerf", "footerl",
+    "footerr", "ftnsep", "header", "headerf", "headerl", "headerr", "info",
+    "listtable", "listoverridetable", "object", "pict", "revtbl",
+    "rsidtbl", "stylesheet", "themedata", "xmlnstbl",
+    ])
+# RTF control words that separate words of text, and those of them
+# that end a line.
+BREAKING_CONTROL_WORDS = frozenset(["cell", "line", "page", "par", "row",
+                                    "sect", "tab"])
+LINE_BREAKING_CONTROL_WORDS = frozenset(["line", "page", "par", "row", "sect"])
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def strip_rtf(rtf, line_breaks=False):
+    """
+    Return the plain text of an RTF document, without any control
+    words, formatting, font tables and the like. Paragraph and line
+    breaks become spaces, or newlines if <line_breaks> is True.
+    """
+
+    text = []
+    skipping = False
+    # Whether each enclosing group was being skipped.
+    group_stack = []
+    group_start = False
+    # Whether to drop the fallback character following a \u character
+    unicode_fallback = False
+    for match in RTF_TOKEN_RE.finditer(rtf):
+        word, arg, hex_char, symbol, brace, chars = match.groups()
+        starts_group = group_start
+        group_start = False
+        skip_fallback = unicode_fallback
+        unicode_fallback = False
+        if brace == "{":
+            group_stack.append(skipping)
+            group_start = True
+        elif brace == "}":
+            skipping = group_stack.pop() if group_stack else False
+        elif skipping:
+            continue
+        elif word:
+            if starts_group and word in SKIPPED_DESTINATIONS:
+                skipping = True
+            elif line_breaks and word in LINE_BREAKING_CONTROL_WORDS:
+                text.append("\n")
+            elif word in BREAKING_CONTROL_WORDS:
+                text.append(" ")
+            elif word == "u" and arg:
+                text.append(chr(int(arg) % 0x10000))
+                unicode_fallback = True
+        elif hex_char:
+            if skip_fallback:
+                continue
+            text.append(bytes([int(hex_char, 16)]).decode("cp1252", "replace"))
+        elif symbol:
+            if symbol == "*" and starts_group:
+                # An "ignorable destination" we don't know how to read
+                skipping = True
+            elif symbol in "\\{}":
+                text.append(symbol)
+            elif symbol == "~":
+                text.append(" ")
+        elif chars:
+            if skip_fallback:
+                chars = chars[1:]
+            # Raw line breaks in RTF source aren't part of the text.
+            text.append(chars.replace("\r", "").replace("\n", ""))
+    return "".join(text)
+
+def tokenize(text):
+    """
+    Return a Counter of the casefolded words in some text.
+    """
+
+    return Counter(WORD_RE.findall(fold_case(text)))
+
+def read_note_words(note_path):
+    """
+    Return a Counter of the words in an RTF note document.
+    """
+
+    with open(note_path, "rb") as f:
+        rtf = f.read().decode("utf-8", "replace")
+    return tokenize(strip_rtf(rtf))
+
+
+class ContentIndex:
+    """
+    An inverted index of the words in every note document, saved to
+    disk between runs.
+
+    Updating the index only re-reads documents whose modification
+    time or size changed since they were last indexed, and reads them
+    in a pool of worker threads. Searches can run while the index is
+    being updated; they see the index as it was before the update.
+    """
+
+    def __init__(self, path, max_workers=4):
+        self.path = path
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        # Note filename -> (mtime, size, Counter of words)
+        self.documents = {}
+        # Word -> {note filename: occurrences}
+        self.postings = {}
+        self.sorted_words = []
+
+    def load(self):
+        """
+        Load the index saved by save(). A missing, outdated or
+        unreadable index just leaves this one empty, to be rebuilt by
+        update().
+        """
+
+        try:
+            with open(self.path, "rb") as f:
+                version, documents = pickle.load(f)
+        except Exception:
+            return
+        if version == CONTENT_INDEX_VERSION:
+            self.set_documents(documents)
+
+    def save(self):
+        """
+        Atomically save the index next to the notes.
+        """
+
+        with self.lock:
+            documents = self.documents
+        temp_path = temp_file_path(self.path)
+        with open(temp_path, "wb") as f:
+            pickle.dump((CONTENT_INDEX_VERSION, documents), f, PICKLE_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def set_documents(self, documents):
+        """
+        Replace the indexed documents, and rebuild the postings for
+        them.
+        """
+
+        postings = {}
+        for note_filename, (_, _, words) in documents.items():
+            for word, count in words.items():
+                posting = postings.get(word)
+                if posting is None:
+                    posting = postings[word] = {}
+                posting[note_filename] = count
+        sorted_words = sorted(postings)
+        with self.lock:
+            self.documents = documents
+            self.postings = postings
+            self.sorted_words = sorted_words
+
+    def update(self, note_filenames, notes_dir):
+        """
+        Bring the index up to date with the given note documents in
+        <notes_dir>, dropping any other documents from it. Return True
+        if anything changed.
+        """
+
+        with self.lock:
+            old_documents = self.documents
+        documents = {}
+        stale = []
+        for note_filename in note_filenames:
+            try:
+                stat = os.stat(os.path.join(notes_dir, note_filename))
+            except OSError:
+                continue
+            old = old_documents.get(note_filename)
+            if old and old[0] == stat.st_mtime and old[1] == stat.st_size:
+                documents[note_filename] = old
+            else:
+                stale.append((note_filename, stat.st_mtime, stat.st_size))
+
+        def index_document(item):
+            note_filename, mtime, size = item
+            try:
+                words = read_note_words(os.path.join(notes_dir, note_filename))
+            except EnvironmentError:
+                return None
+            return note_filename, (mtime, size, words)
+
+        if stale:
+            # Imported here, as it's slow to import and searching
+            # an already built index doesn't need it.
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for result in executor.map(index_document, stale):
+                    if result is not None:
+                        documents[result[0]] = result[1]
+
+        if not stale and len(documents) == len(old_documents):
+            return False
+        self.set_documents(documents)
+        return True
+
+    def search(self, query):
+        """
+        Return a list of (score, note filename) pairs for the note
+        documents containing every word of <query>, best first. The
+        last word of the query also matches longer words it's the
+        start of, since it may not be completely typed yet.
+        """
+
+        query_words = WORD_RE.findall(fold_case(query))
+        if not query_words:
+            return []
+
+        with self.lock:
+            postings = self.postings
+            sorted_words = self.sorted_words
+
+        scores = None
+        for i, query_word in enumerate(query_words):
+            if i == len(query_words) - 1:
+                # Every word starting with the query word
+                start = bisect.bisect_left(sorted_words, query_word)
+                words = []
+                for word in sorted_words[start:]:
+                    if not word.startswith(query_word):
+                        break
+                    words.append(word)
+            else:
+                words = [query_word]
+
+            word_scores = Counter()
+            for word in words:
+                word_scores.update(postings.get(word, {}))
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = Counter(dict((note_filename, score + word_scores[note_filename])
+                                      for note_filename, score in scores.items()
+                                      if note_filename in word_scores))
+            if not scores:
+                return []
+
+        return sorted(((score, note_filename)
+                       for note_filename, score in scores.items()),
+                      key=lambda pair: (-pair[0], pair[1]))
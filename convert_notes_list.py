@@ -0,0 +1,25 @@
+#!/usr/bin/python -B
+"""
+Convert a NoteBag notes list file between the pickle format and an
+SQLite notes catalog.
+
+Usage: python convert_notes_list.py SOURCE DESTINATION
+
+Each file's format is chosen by its extension: ".sqlite" for an
+SQLite catalog, anything else for the pickle format. Point the
+"Notes List File" option in NoteBag.ini at the new file to start using
+it (with "Notes List Storage = sqlite" for an SQLite catalog).
+Converting into an existing SQLite catalog adds the notes it doesn't
+have yet.
+"""
+
+import sys
+
+from catalog import convert_notes_list
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.stderr.write(__doc__.lstrip())
+        sys.exit(2)
+    convert_notes_list(sys.argv[1], sys.argv[2])
@@ -0,0 +1,447 @@
+## Fuzzy Note Name Matching
+
+import bisect
+import heapq
+import itertools
+import re
+
+# Scores, in the style of fzf: every matched character scores
+# SCORE_MATCH, plus a bonus for where it is; every unmatched character
+# between the first and last matched ones costs a penalty.
+SCORE_MATCH = 16
+SCORE_GAP_START = -3
+SCORE_GAP_EXTENSION = -1
+# A match at the very start of a note name
+BONUS_PREFIX = 10
+# A match at the start of a word
+BONUS_BOUNDARY = 8
+# A match of a space or punctuation character
+BONUS_NON_WORD = 8
+# A match at a lowercase-to-uppercase or letter-to-digit change
+BONUS_CAMEL = 7
+# A match right after another match; a run of matches also keeps the
+# bonus of its first character.
+BONUS_CONSECUTIVE = -(SCORE_GAP_START + SCORE_GAP_EXTENSION)
+# The first character of the query counts this many times over.
+BONUS_FIRST_CHAR_MULTIPLIER = 2
+# The most a character can get anywhere but at the start of a name
+MAX_INNER_BONUS = max(BONUS_BOUNDARY, BONUS_NON_WORD, BONUS_CAMEL,
+                      BONUS_CONSECUTIVE)
+MAX_BONUS = max(BONUS_PREFIX, MAX_INNER_BONUS)
+
+# The most matches top_matches() looks at, so a short query that
+# matches most names can't take long; the best of those it has looked
+# at are returned.
+MAX_CANDIDATES = 3000
+
+# Character classes
+NON_WORD, LOWER, UPPER, DIGIT = range(4)
+# Marks the characters that get BONUS_CAMEL in the text searched by
+# top_matches()
+CAMEL_MARK = "\x02"
+# Where BONUS_CAMEL goes in an ASCII name
+ASCII_CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Za-z])(?=[0-9])")
+
+
+def char_class(c):
+    if c.islower():
+        return LOWER
+    if c.isupper():
+        return UPPER
+    if c.isdigit():
+        return DIGIT
+    if c.isalpha():
+        # Letters without case, say in Chinese or Japanese
+        return LOWER
+    return NON_WORD
+
+def position_bonus(prev_class, cur_class):
+    """
+    Return the bonus for matching a character of <cur_class> that
+    follows one of <prev_class>.
+    """
+
+    if cur_class == NON_WORD:
+        return BONUS_NON_WORD
+    if prev_class == NON_WORD:
+        return BONUS_BOUNDARY
+    if (prev_class == LOWER and cur_class == UPPER
+            or prev_class != DIGIT and cur_class == DIGIT):
+        return BONUS_CAMEL
+    return 0
+
+# For ASCII names: byte -> character class, and (previous character's
+# class * 4 + character's class) -> bonus
+ASCII_CLASSES = bytes(char_class(chr(b)) if b < 128 else NON_WORD
+                      for b in range(256))
+ASCII_PAIR_BONUSES = bytes(position_bonus(b // 4, b % 4) if b < 16 else 0
+                           for b in range(256))
+
+def perfect_score(query_length, at_start=True):
+    """
+    Return the highest score a note name can get for a query of
+    <query_length> characters: a name starting with the query gets
+    it. If <at_start> is False, return the highest score for a match
+    that doesn't start at the start of the name.
+    """
+
+    bonus = MAX_BONUS if at_start else MAX_INNER_BONUS
+    return (query_length * (SCORE_MATCH + bonus)
+            + bonus * (BONUS_FIRST_CHAR_MULTIPLIER - 1))
+
+def gap_penalty(gap_length):
+    """
+    Return the least a match can lose for <gap_length> unmatched
+    characters between its first and last matched ones.
+    """
+
+    if not gap_length:
+        return 0
+    return SCORE_GAP_START + (gap_length - 1) * SCORE_GAP_EXTENSION
+
+def match_window(query, folded):
+    """
+    Find a short stretch of a casefolded name that contains a
+    casefolded query as a subsequence, and return its (start, end)
+    indices, end inclusive; return None if the name doesn't contain
+    the query at all.
+
+    As in fzf, this looks for the first place the query ends, then
+    works back from there to the latest place it could start.
+    """
+
+    find = folded.find
+    pos = -1
+    for c in query:
+        pos = find(c, pos + 1)
+        if pos < 0:
+            return None
+    end = pos
+    rfind = folded.rfind
+    pos += 1
+    for c in reversed(query):
+        pos = rfind(c, 0, pos)
+    return pos, end
+
+def name_bonuses(folded, name):
+    """
+    Return the bonus for matching each character of a casefolded name,
+    as bytes. <name> is the name before casefolding, whose case shows
+    where camelCase words start.
+    """
+
+    if len(name) != len(folded):
+        # Casefolding changed the length (say, "ß" to "ss"), so the
+        # two can't be lined up.
+        name = folded
+    if name.isascii():
+        # Work out every character's class, then every (previous
+        # class, class) pair at once: the classes are all below 4, so
+        # the arithmetic never carries from one byte to the next.
+        classes = name.encode("ascii").translate(ASCII_CLASSES)
+        prev_classes = bytes([NON_WORD]) + classes[:-1]
+        pairs = (int.from_bytes(prev_classes, "big") * 4
+                 + int.from_bytes(classes, "big")).to_bytes(len(classes), "big")
+        return (bytes([BONUS_PREFIX]) + pairs[1:].translate(ASCII_PAIR_BONUSES))[:len(name)]
+    bonuses = bytearray(len(name))
+    prev_class = NON_WORD
+    for i, c in enumerate(name):
+        cur_class = char_class(c)
+        if i == 0:
+            bonuses[i] = BONUS_PREFIX
+        else:
+            bonuses[i] = position_bonus(prev_class, cur_class)
+        prev_class = cur_class
+    return bytes(bonuses)
+
+def score_window(query, folded, bonuses, start):
+    """
+    Score the match of a casefolded query in a casefolded name,
+    within the window starting at <start> that match_window() found.
+    <bonuses> is the name's name_bonuses().
+    """
+
+    find = folded.find
+    score = 0
+    pos = start - 1
+    run_bonus = 0
+    for qi, c in enumerate(query):
+        prev_pos = pos
+        pos = find(c, pos + 1)
+        bonus = bonuses[pos]
+        if qi and pos == prev_pos + 1:
+            if bonus >= BONUS_BOUNDARY and bonus > run_bonus:
+                # A new word starts within the run.
+                run_bonus = bonus
+            bonus = max(bonus, run_bonus, BONUS_CONSECUTIVE)
+        else:
+            if qi:
+                score += gap_penalty(pos - prev_pos - 1)
+            run_bonus = bonus
+        if not qi:
+            bonus *= BONUS_FIRST_CHAR_MULTIPLIER
+        score += SCORE_MATCH + bonus
+    return score
+
+def fuzzy_score(query, folded, name=None):
+    """
+    Return how well a casefolded name matches a casefolded query
+    (higher is better), or None if the name doesn't contain every
+    character of the query, in order.
+    """
+
+    window = match_window(query, folded)
+    if window is None:
+        return None
+    return score_window(query, folded, name_bonuses(folded, name or folded),
+                        window[0])
+
+def widest_gap(best, worst):
+    """
+    Return the most unmatched characters a match that would otherwise
+    score <best> can have and still score at least <worst>.
+    """
+
+    if best + gap_penalty(1) < worst:
+        return 0
+    return (best + SCORE_GAP_START - worst) // -SCORE_GAP_EXTENSION + 1
+
+def marked_name(folded, name):
+    """
+    Return a casefolded name with CAMEL_MARK in front of every
+    character that gets BONUS_CAMEL, which can't be told from the
+    casefolded name alone, so a regex can find them.
+    """
+
+    if len(name) != len(folded):
+        return folded
+    if name.isascii():
+        return ASCII_CAMEL_RE.sub(CAMEL_MARK, name).lower()
+    pieces = []
+    prev_class = NON_WORD
+    for i, c in enumerate(name):
+        cur_class = char_class(c)
+        if i and position_bonus(prev_class, cur_class) == BONUS_CAMEL:
+            pieces.append(CAMEL_MARK)
+        pieces.append(folded[i])
+        prev_class = cur_class
+    return "".join(pieces)
+
+def subsequence_pattern(query, word_start, max_gap=None):
+    """
+    Return a compiled regex matching a line of marked names (see
+    marked_name()) that contains every character of a query, in
+    order, starting at the start of a word (or a camelCase word) if
+    <word_start> is True, or inside a word if it's False. If
+    <max_gap> is given, no more than that many characters may come
+    between any two of them.
+    """
+
+    if max_gap is None:
+        gap = "[^\n]*?"
+    else:
+        # Every character in a gap, and the one after it, may have a
+        # mark in front of it.
+        gap = "[^\n]{{0,{0}}}?".format(2 * max_gap + 1)
+    chars = [re.escape(c) for c in query]
+    # The lookbehind comes after the first character, so the regex
+    # engine can look for that character quickly.
+    if word_start:
+        chars[0] += r"(?<![^\W_]{0})".format(chars[0])
+    else:
+        chars[0] += r"(?<=[^\W_]{0})".format(chars[0])
+    return re.compile(gap.join(chars))
+
+class FuzzyIndex:
+    """
+    Fuzzy search over an alphabetically sorted list of (casefolded
+    name, name) entries, which is shared with whoever keeps it up to
+    date; they have to call insert() and delete() as it changes.
+
+    The entries' marked names (see marked_name()) are kept joined
+    together, one per line, so a regex can search them all at once,
+    and each entry's name_bonuses() are worked out the first time
+    it's scored.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.lines = [marked_name(folded, name) for folded, name in entries]
+        self.bonuses = [None] * len(entries)
+        self.text = None
+        self.line_starts = None
+
+    def insert(self, i, entry):
+        """
+        Note that <entry> has been inserted into the entries at <i>.
+        """
+
+        self.lines.insert(i, marked_name(*entry))
+        self.bonuses.insert(i, None)
+        self.text = None
+
+    def delete(self, i):
+        """
+        Note that the entry at <i> has been deleted from the entries.
+        """
+
+        del self.lines[i]
+        del self.bonuses[i]
+        self.text = None
+
+    def join_lines(self, lines=None):
+        """
+        Return the marked names of the entries, or of only those at a
+        sorted list of indices, joined together one per line, and
+        where each line starts.
+        """
+
+        if lines is None:
+            lines = self.lines
+        else:
+            lines = [self.lines[i] for i in lines]
+        # Each line starts just past the newline ending the one before.
+        line_starts = [0]
+        line_starts.extend(itertools.accumulate(len(line) + 1 for line in lines))
+        return "\n".join(lines), line_starts
+
+    def top_matches(self, query, limit, within=None, max_candidates=MAX_CANDIDATES):
+        """
+        Return the indices of the <limit> entries that match a
+        casefolded query best, best first, and whether they are every
+        entry that matches it at all. Ties go to the match that starts
+        at the start of a word, and then to the entry that sorts
+        first.
+
+        If <within> is given, it's a sorted list of the indices of
+        the entries to search, which has to include every entry that
+        matches; say, every entry that matched a shorter query that
+        this one contains.
+
+        Names starting with the query get a perfect score, and sort
+        together, so they're taken straight from the entries; if there
+        are <limit> of them, nothing else is looked at. The rest are
+        found by regexes, which skip over the names that don't match
+        without any Python code running for them: first the matches
+        starting at the start of a word, then the ones inside words,
+        which can't score as well. A heap keeps the best <limit>
+        matches so far. Once it's full, the regex is narrowed to the
+        matches with gaps short enough to beat the worst of them, and
+        the search stops once no other match could, or once it has
+        looked at <max_candidates> matches.
+        """
+
+        if within is not None:
+            text, line_starts = self.join_lines(within)
+        else:
+            if self.text is None:
+                self.text, self.line_starts = self.join_lines()
+            text = self.text
+            line_starts = self.line_starts
+        entries = self.entries
+        bonuses = self.bonuses
+
+        query_length = len(query)
+        perfect = perfect_score(query_length)
+        inner_perfect = perfect_score(query_length, False)
+        # The best a match inside a word can do: only a space or
+        # punctuation character gets a bonus there.
+        if char_class(query[0]) == NON_WORD:
+            first_bonus = BONUS_NON_WORD
+        else:
+            first_bonus = 0
+        inside_perfect = (query_length * SCORE_MATCH
+                          + first_bonus * BONUS_FIRST_CHAR_MULTIPLIER
+                          + (query_length - 1) * MAX_INNER_BONUS)
+
+        lo = bisect.bisect_left(entries, (query,))
+        hi = lo
+        while hi < len(entries) and hi - lo < limit and entries[hi][0].startswith(query):
+            hi += 1
+        if hi - lo == limit:
+            return list(range(lo, hi)), False
+        # Min-heap of (score, 1 if the match was found at the start of
+        # a word, -index), so the worst match is on top.
+        heap = [(perfect, 1, -i) for i in range(lo, hi)]
+        heapq.heapify(heap)
+        # Entries already found at the start of a word
+        found = set()
+
+        bisect_right = bisect.bisect_right
+        candidates = 0
+        complete = True
+        for word_start in (1, 0):
+            if not complete:
+                # It has looked at max_candidates matches already.
+                break
+            if word_start:
+                # A match at the start of a name, with a gap, or
+                # anywhere else
+                best_found = max(perfect + gap_penalty(1), inner_perfect)
+            else:
+                best_found = inside_perfect
+            if len(heap) == limit and heap[0][0] >= best_found:
+                # Nothing from here on can beat (or tie) the worst match.
+                break
+            max_gap = None
+            if len(heap) == limit:
+                max_gap = widest_gap(best_found, heap[0][0])
+            search = subsequence_pattern(query, word_start, max_gap).search
+            pos = 0
+            while True:
+                match = search(text, pos)
+                if match is None:
+                    break
+                candidates += 1
+                if candidates > max_candidates:
+                    complete = False
+                    break
+                i = bisect_right(line_starts, match.start()) - 1
+                pos = line_starts[i + 1]
+                if within is not None:
+                    i = within[i]
+                if lo <= i < hi or i in found:
+                    continue
+                if word_start:
+                    found.add(i)
+                folded, name = entries[i]
+                window = match_window(query, folded)
+                if window is None:
+                    # The match ran across lines, so the query has a
+                    # newline.
+                    continue
+                start, end = window
+                if len(heap) == limit:
+                    # Later entries lose ties, so the best they can do
+                    # has to be strictly better.
+                    if start == 0:
+                        best = perfect
+                    else:
+                        best = min(best_found, inner_perfect)
+                    if best + gap_penalty(end - start + 1 - query_length) <= heap[0][0]:
+                        continue
+                entry_bonuses = bonuses[i]
+                if entry_bonuses is None:
+                    entry_bonuses = bonuses[i] = name_bonuses(folded, name)
+                score = score_window(query, folded, entry_bonuses, start)
+                if len(heap) < limit:
+                    heapq.heappush(heap, (score, word_start, -i))
+                elif (score, word_start, -i) > heap[0]:
+                    heapq.heapreplace(heap, (score, word_start, -i))
+                else:
+                    continue
+
+                if len(heap) == limit:
+                    worst = heap[0][0]
+                    if worst >= best_found:
+                        break
+                    gap = widest_gap(best_found, worst)
+                    if max_gap is None or gap < max_gap:
+                        max_gap = gap
+                        search = subsequence_pattern(query, word_start, max_gap).search
+        heap.sort(reverse=True)
+        # Once the heap is full, matches that can't beat the worst of
+        # it are passed over, so only a heap with room to spare holds
+        # every match.
+        complete = complete and len(heap) < limit
+        return [-neg_index for _, _, neg_index in heap], complete
@@ -1,48 +1,147 @@
 ## Miscellaneous Helpful Functions
 # Written by Daniel Ralston
 
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
-import inspect
+import configparser
+import os
 import os.path
 from os.path import abspath, dirname, expanduser, realpath
+import sys
+
+# If set, this environment variable overrides the directory NoteBag
+# looks for its config files (and note template) in.
+SCRIPT_DIR_ENV_VAR = "NOTEBAG_HOME"
+
+# Resolved once per process, by get_called_script_dir(),
+# get_config_path() and read_config(); set_called_script_dir() resets
+# them.
+_called_script_dir = None
+_config_paths = {}
+_configs = {}
+
+def fold_case(s):
+    """
+    Return a caseless version of a string, for case-insensitive
+    comparisons and lookups.
+    """
+    return s.casefold()
+
+def set_called_script_dir(script_dir):
+    """
+    Use <script_dir> in place of the top-level running script's
+    directory from now on, say when embedding NoteBag or testing it.
+    Pass None to go back to working it out automatically.
+    """
+    global _called_script_dir
+    if script_dir is not None:
+        script_dir = realpath(abspath(expanduser(script_dir)))
+    _called_script_dir = script_dir
+    _config_paths.clear()
+    _configs.clear()
+
+def find_called_script_dir():
+    """
+    Work out the directory that the top-level running script is in,
+    or the one named by the NOTEBAG_HOME environment variable.
+    """
+    script_dir = os.environ.get(SCRIPT_DIR_ENV_VAR)
+    if not script_dir:
+        main_module = sys.modules.get("__main__")
+        called_script_path = getattr(main_module, "__file__", None)
+        if not called_script_path:
+            # An interactive session, or an embedding program; fall
+            # back to the bottom stack frame's file. Unlike
+            # inspect.stack(), this doesn't read any source code.
+            import inspect
+            frame = inspect.currentframe()
+            while frame.f_back is not None:
+                frame = frame.f_back
+            called_script_path = inspect.getfile(frame)
+        script_dir = dirname(called_script_path)
+    return realpath(abspath(expanduser(script_dir)))
 
 def get_called_script_dir():
     """
     Return the directory that the top-level running script is in.
+    It's only worked out once per process.
     """
-    bottom_stack_frame = inspect.stack()[-1][0]
-    called_script_path = inspect.getfile(bottom_stack_frame)
-    return realpath(abspath(dirname(called_script_path)))
+    global _called_script_dir
+    if _called_script_dir is None:
+        _called_script_dir = find_called_script_dir()
+    return _called_script_dir
 
 def get_config_path(filename):
     """
     Return the full path to a config file named <filename> in the same
     directory as the top-level running script.
     """
-    config_dir = get_called_script_dir()
-    config_path = os.path.join(config_dir, filename)
-    config_path = realpath(abspath(expanduser(config_path)))
+    config_path = _config_paths.get(filename)
+    if config_path is None:
+        config_dir = get_called_script_dir()
+        config_path = os.path.join(config_dir, filename)
+        config_path = realpath(abspath(expanduser(config_path)))
+        _config_paths[filename] = config_path
     return config_path
 
 def read_config(filename):
     """
     Read a config file named <filename>, from the same directory as
     the top-level running script, using configparser.
+
+    The file is only read once; later calls return the same
+    ConfigParser, until save_config() saves over the file.
     """
     config_path = get_config_path(filename)
-    config = configparser.ConfigParser()
-    config.read(config_path)
+    config = _configs.get(config_path)
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        _configs[config_path] = config
     return config
 
+def config_get(config, section, option, default=None):
+    """
+    Return an option from a configparser configuration, or <default>
+    if the option (or its whole section) isn't set, so config files
+    written by older versions of NoteBag keep working.
+    """
+    try:
+        return config.get(section, option)
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        return default
+
+def config_getint(config, section, option, default=0):
+    """
+    Like config_get(), but convert the option to an integer; blank or
+    missing options give <default>.
+    """
+    value = config_get(config, section, option)
+    if value is None or not value.strip():
+        return default
+    return int(value)
+
+def config_getboolean(config, section, option, default=False):
+    """
+    Like config_get(), but convert the option to a boolean the way
+    configparser does ("yes"/"no", "on"/"off", "true"/"false",
+    "1"/"0"); blank or missing options give <default>.
+    """
+    value = config_get(config, section, option)
+    if value is None or not value.strip():
+        return default
+    value = value.strip().lower()
+    if value in ("1", "yes", "true", "on"):
+        return True
+    if value in ("0", "no", "false", "off"):
+        return False
+    raise ValueError("Not a boolean: {0}".format(value))
+
 def save_config(config, filename):
     """
     Save a configparser configuration to <filename>, in the same
     directory as the top-level running script.
     """
-    config_dir = get_called_script_dir()
-    config_path = os.path.join(config_dir, filename)
+    config_path = get_config_path(filename)
     with open(config_path, 'w') as f:
         config.write(f)
+    # The next read_config() will read what was just written.
+    _configs.pop(config_path, None)
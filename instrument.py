@@ -0,0 +1,217 @@
+## Timing Instrumentation and Profiling
+
+import functools
+import json
+import os
+import threading
+import time
+
+from notes_writer import replace_file
+
+# Set to "yes" to turn instrumentation on, whatever NoteBag.ini says.
+INSTRUMENT_ENV_VAR = "NOTEBAG_INSTRUMENT"
+# Set to a number of seconds to profile NoteBag for, from when it
+# starts (which also turns instrumentation on).
+PROFILE_ENV_VAR = "NOTEBAG_PROFILE"
+# Latencies are counted in buckets of up to 1, 2, 4, ... microseconds;
+# the last bucket holds everything slower.
+HISTOGRAM_BUCKETS = 32
+REPORTED_PERCENTILES = (50, 90, 99)
+
+
+def env_instrumentation():
+    """
+    Return whether instrumentation was asked for in the environment,
+    and how many seconds of profiling were (0 for none).
+    """
+
+    enabled = os.environ.get(INSTRUMENT_ENV_VAR, "").strip().lower()
+    try:
+        profile_seconds = int(os.environ.get(PROFILE_ENV_VAR) or 0)
+    except ValueError:
+        profile_seconds = 0
+    return (enabled in ("1", "yes", "true", "on") or profile_seconds > 0,
+            profile_seconds)
+
+def timed(stats, name, function):
+    """
+    Return a wrapper around a function that records how long every
+    call to it takes in <stats>, under <name>.
+    """
+
+    @functools.wraps(function)
+    def timed_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats.record(name, time.perf_counter() - start)
+    return timed_function
+
+def instrument_methods(obj, method_names, stats):
+    """
+    Time every call to some of an object's methods, by shadowing them
+    with timed() wrappers on the object itself. Nothing else is
+    slowed down, and objects that aren't instrumented pay nothing.
+    """
+
+    for method_name in method_names:
+        setattr(obj, method_name,
+                timed(stats, method_name, getattr(obj, method_name)))
+
+
+class Histogram:
+    """
+    The latencies of one operation: how many there were, their total,
+    the fastest and slowest, and how many fell into each power-of-two
+    bucket of microseconds, which is enough for rough percentiles
+    without keeping every one.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1000000).bit_length()
+        self.buckets[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, percentile):
+        """
+        Return an estimate, in seconds, of the given percentile of the
+        latencies, assuming they're spread evenly through their
+        bucket.
+        """
+
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                low = (1 << bucket) >> 1
+                estimate = low + (low or 1) * (rank - seen) / count
+                return min(max(estimate / 1000000.0, self.min), self.max)
+            seen += count
+        return self.max
+
+    def as_dict(self):
+        """
+        Return the histogram's statistics, in milliseconds, for JSON.
+        """
+
+        stats = {"count": self.count,
+                 "total_ms": self.total * 1000,
+                 "mean_ms": self.total / self.count * 1000 if self.count else 0,
+                 "min_ms": (self.min or 0) * 1000,
+                 "max_ms": self.max * 1000}
+        for percentile in REPORTED_PERCENTILES:
+            stats["p{0}_ms".format(percentile)] = self.percentile(percentile) * 1000
+        stats["buckets_us"] = dict(("<={0}".format(1 << bucket), count)
+                                   for bucket, count in enumerate(self.buckets)
+                                   if count)
+        return stats
+
+
+class Stats:
+    """
+    Counters and latency histograms for NoteBag's hot paths, safe to
+    update from any thread, and to dump as JSON.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.dumping = None
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name, seconds):
+        """
+        Add one latency, in seconds, to a histogram.
+        """
+
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    def snapshot(self):
+        """
+        Return all of the counters and histograms, for JSON.
+        """
+
+        with self.lock:
+            return {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "uptime_seconds": time.time() - self.started,
+                    "counters": dict(self.counters),
+                    "timings": dict((name, histogram.as_dict())
+                                    for name, histogram in self.histograms.items())}
+
+    def report(self):
+        """
+        Return the counters and histograms as a table, for people.
+        """
+
+        snapshot = self.snapshot()
+        lines = ["Up for {0:.0f} seconds".format(snapshot["uptime_seconds"]), ""]
+        for name, count in sorted(snapshot["counters"].items()):
+            lines.append("{0:<32} {1:>9}".format(name, count))
+        if snapshot["counters"]:
+            lines.append("")
+        lines.append("{0:<32} {1:>9} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+                "Timing (ms)", "count", "mean", "p50", "p90", "p99", "max"))
+        for name, stats in sorted(snapshot["timings"].items()):
+            lines.append("{0:<32} {1:>9} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>10.3f} {6:>10.3f}".format(
+                    name, stats["count"], stats["mean_ms"], stats["p50_ms"],
+                    stats["p90_ms"], stats["p99_ms"], stats["max_ms"]))
+        return "\n".join(lines)
+
+    def dump(self, file_path):
+        """
+        Atomically save a snapshot() to a JSON file.
+        """
+
+        snapshot = self.snapshot()
+        def write(temp_path):
+            with open(temp_path, "w") as f:
+                json.dump(snapshot, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+        replace_file(file_path, write)
+
+    def start_dumping(self, file_path, interval):
+        """
+        dump() to a file every <interval> seconds, in a background
+        thread, until stop_dumping() is called.
+        """
+
+        stopping = self.dumping = threading.Event()
+        def dump_periodically():
+            while not stopping.wait(interval):
+                try:
+                    self.dump(file_path)
+                except EnvironmentError:
+                    pass
+
+        thread = threading.Thread(target=dump_periodically,
+                                  name="NoteBag stats dumping")
+        thread.daemon = True
+        thread.start()
+
+    def stop_dumping(self):
+        if self.dumping is not None:
+            self.dumping.set()
+            self.dumping = None
@@ -0,0 +1,54 @@
+## Checksums for Saved Data
+
+import hashlib
+import zlib
+
+# The checksum algorithm used unless the config file says otherwise
+DEFAULT_CHECKSUM = "blake2b"
+
+
+def blake2b_checksum(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+def crc32_checksum(data):
+    return "{0:08x}".format(zlib.crc32(data) & 0xffffffff)
+
+def sha1_checksum(data):
+    return hashlib.sha1(data).hexdigest()
+
+# Checksum algorithm name -> function returning the hex checksum of a
+# byte string
+CHECKSUMS = {
+    "crc32": crc32_checksum,
+    "sha1": sha1_checksum,
+    "blake2b": blake2b_checksum,
+    }
+
+
+def tagged_checksum(algorithm, data):
+    """
+    Return the checksum of a byte string, tagged with the name of the
+    algorithm used, like "crc32:1c291ca3".
+    """
+
+    try:
+        checksum = CHECKSUMS[algorithm]
+    except KeyError:
+        raise ValueError("Unknown checksum algorithm '{0}'".format(algorithm))
+    return "{0}:{1}".format(algorithm, checksum(data))
+
+def is_tagged_checksum(s):
+    """
+    Return True if a saved checksum was made by tagged_checksum().
+    """
+
+    return ":" in s
+
+def verify_tagged_checksum(saved_checksum, data):
+    """
+    Return True if a checksum made by tagged_checksum() matches a
+    byte string.
+    """
+
+    algorithm = saved_checksum.split(":", 1)[0]
+    return tagged_checksum(algorithm, data) == saved_checksum
@@ -0,0 +1,232 @@
+## Append-Only Notes List Journal
+
+import hashlib
+import os
+import pickle
+import threading
+
+PICKLE_PROTOCOL = 2
+# How many times compaction tries to swap in its snapshot before
+# giving up until the next append
+COMPACTION_ATTEMPTS = 3
+
+# Journal record operations, and how many arguments each one takes.
+OPERATIONS = {
+    "add": 2,       # note name, note filename
+    "delete": 1,    # note name
+    "rename": 2,    # old note name, new note name
+    "move": 2,      # note name, new note filename
+    }
+
+
+def record_checksum(payload):
+    """
+    Return the hash digest of a serialized journal record, as a
+    string.
+    """
+
+    return hashlib.sha1(payload).hexdigest()
+
+def apply_record(notes, op, args):
+    """
+    Apply one journal record to a dict of notes.
+
+    Records are applied leniently (deleting or renaming a note that
+    isn't there does nothing), so replaying records that a snapshot
+    already contains is harmless.
+    """
+
+    if op == "add":
+        note_name, note_filename = args
+        notes[note_name] = note_filename
+    elif op == "delete":
+        notes.pop(args[0], None)
+    elif op == "rename":
+        old_name, new_name = args
+        if old_name in notes:
+            notes[new_name] = notes.pop(old_name)
+    elif op == "move":
+        note_name, note_filename = args
+        if note_name in notes:
+            notes[note_name] = note_filename
+    else:
+        raise ValueError("Unknown journal operation '{0}'".format(op))
+
+
+class NotesJournal:
+    """
+    An append-only log of the changes made to a notes list since it
+    was last written out in full.
+
+    Every record carries its own checksum, so one corrupted record is
+    caught without re-hashing the whole notes list. A record that was
+    only partly written (say, because NoteBag crashed mid-append) can
+    only ever be the last one, and is quietly dropped.
+
+    <file_lock>, if given, is a lock shared with other processes using
+    the journal (see locking.py), which is held while the journal is
+    read or written.
+    """
+
+    def __init__(self, path, file_lock=None):
+        self.path = path
+        self.file_lock = file_lock or threading.RLock()
+        # Held while the journal file is appended to or rewritten.
+        self.lock = threading.Lock()
+        self.compaction_thread = None
+
+    def size(self):
+        """
+        Return the size of the journal file in bytes.
+        """
+
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def append(self, op, *args):
+        """
+        Append a record to the journal, and make sure it's on disk
+        before returning.
+        """
+
+        self.append_many([(op, args)])
+
+    def append_many(self, records):
+        """
+        Append a sequence of (op, args) records to the journal with a
+        single write.
+        """
+
+        chunks = []
+        for op, args in records:
+            if OPERATIONS.get(op) != len(args):
+                raise ValueError("Bad journal record: {0} {1!r}".format(op, args))
+            payload = pickle.dumps((op, tuple(args)), PICKLE_PROTOCOL)
+            chunks.append(pickle.dumps((record_checksum(payload), payload),
+                                       PICKLE_PROTOCOL))
+        with self.file_lock, self.lock:
+            with open(self.path, "ab") as f:
+                f.write(b"".join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def replay(self, notes, repair=True, length=None):
+        """
+        Apply every record in the journal (or only those in its first
+        <length> bytes) to a dict of notes, and return the number of
+        records applied.
+
+        If a record's checksum doesn't match, raise a ValueError,
+        unless it's the last record in the journal, in which case it
+        was torn by a crash and is truncated away. Pass False for
+        <repair> to leave the journal alone instead (say, because
+        another NoteBag may still be appending that record).
+        """
+
+        if not os.path.isfile(self.path):
+            return 0
+
+        records = []
+        good_length = 0
+        with self.file_lock, self.lock:
+            with open(self.path, "rb") as f:
+                while length is None or f.tell() < length:
+                    try:
+                        saved_checksum, payload = pickle.load(f)
+                    except EOFError:
+                        break
+                    except Exception:
+                        # A torn record; nothing after it is readable.
+                        break
+                    if record_checksum(payload) != saved_checksum:
+                        if f.read(1):
+                            raise ValueError("The notes journal has been corrupted")
+                        break
+                    records.append(pickle.loads(payload))
+                    good_length = f.tell()
+            if repair and good_length < os.path.getsize(self.path):
+                with open(self.path, "r+b") as f:
+                    f.truncate(good_length)
+
+        for op, args in records:
+            apply_record(notes, op, args)
+        return len(records)
+
+    def discard(self, length):
+        """
+        Throw away the first <length> bytes of the journal, keeping
+        any records that were appended after that point.
+        """
+
+        with self.file_lock, self.lock:
+            with open(self.path, "rb") as f:
+                f.seek(length)
+                remainder = f.read()
+            if not remainder:
+                os.remove(self.path)
+                return
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(remainder)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+
+    def remove(self):
+        """
+        Delete the journal file entirely.
+        """
+
+        with self.file_lock, self.lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+    def compacting(self):
+        """
+        Return True if a background compaction is still running.
+        """
+
+        thread = self.compaction_thread
+        return thread is not None and thread.is_alive()
+
+    def compact(self, read_notes, replace_notes):
+        """
+        Fold the journal into a fresh snapshot of the notes list, in
+        a background thread.
+
+        read_notes() is called with the file lock held, and must
+        return a copy of the notes list as last saved in full, along
+        with its stamp and signature (see SharedNotesList.try_replace).
+        The journal as it stood then is replayed onto it, and
+        replace_notes(notes, stamp, signature, replaced) must write
+        the result out without holding the file lock, then move it
+        into place and call replaced() with the lock held, unless the
+        notes list was saved again in the meantime; it returns True if
+        it was moved into place. replaced() throws away the records
+        the snapshot now contains.
+
+        So the file lock is only held briefly, and records appended
+        while the snapshot is being written are kept.
+        """
+
+        if self.compacting():
+            return
+
+        def compact_journal():
+            for _ in range(COMPACTION_ATTEMPTS):
+                with self.file_lock:
+                    length = self.size()
+                    if not length:
+                        # Someone else compacted it first.
+                        return
+                    notes, stamp, signature = read_notes()
+                self.replay(notes, repair=False, length=length)
+                if replace_notes(notes, stamp, signature,
+                                 lambda: self.discard(length)):
+                    return
+
+        thread = self.compaction_thread = threading.Thread(
+            target=compact_journal, name="NoteBag journal compaction")
+        thread.start()
@@ -0,0 +1,164 @@
+## Launching Document Editors
+
+import os
+import sys # for platform
+import threading
+import time
+
+# The placeholder in the "Document Editor" command that's replaced by
+# the note document's path
+NOTE_PATH_PLACEHOLDER = "%s"
+# How often the reaper thread checks for editors that have exited
+REAP_INTERVAL_SECONDS = 0.5
+# The editor output log is moved to <log>.1 once it grows past this
+EDITOR_LOG_MAX_BYTES = 1048576
+
+
+def split_command(command):
+    """
+    Split a command line into its arguments, the way the operating
+    system's shell would.
+    """
+
+    import shlex
+    if os.name.lower() == "nt":
+        # shlex doesn't understand backslashes in Windows paths, but
+        # leaves the quotes around arguments when told not to.
+        return [arg[1:-1] if len(arg) > 1 and arg[0] == arg[-1] == '"' else arg
+                for arg in shlex.split(command, posix=False)]
+    return shlex.split(command)
+
+def editor_command(note_path, document_editor=None):
+    """
+    Return the command line (a list of arguments) that opens a note
+    document for editing, and the Popen() creation flags to run it
+    with.
+
+    If <document_editor> contains NOTE_PATH_PLACEHOLDER, it's split
+    into arguments and the placeholder is replaced by <note_path>, so
+    it can pass options, like "gvim --remote-silent %s" to open every
+    note in one running editor. Otherwise, it's the path of the
+    editor program, which is given <note_path> as its one argument.
+    Without <document_editor>, the operating system's default program
+    for the file type is used.
+    """
+
+    creationflags = 0
+    if document_editor and NOTE_PATH_PLACEHOLDER in document_editor:
+        return ([os.path.expandvars(arg).replace(NOTE_PATH_PLACEHOLDER, note_path)
+                 for arg in split_command(document_editor)],
+                creationflags)
+    if document_editor:
+        program = [os.path.expandvars(document_editor)]
+    elif os.name.lower() == "nt":
+        # I'm not using the win32process library, so I can't just
+        # import DETACHED_PROCESS from there.
+        DETACHED_PROCESS = 0x8
+        creationflags |= DETACHED_PROCESS
+        program = ["cmd", "/c", "start"]
+    elif sys.platform.lower() == "darwin":
+        # Mac OSX
+        program = ["open"]
+    elif os.name.lower() == "posix":
+        program = ["xdg-open"]
+    else:
+        raise EnvironmentError("Your operating system is not supported")
+    return program + [note_path], creationflags
+
+
+class EditorLauncher:
+    """
+    Starts document editors without tying them to NoteBag: they get
+    no input, and their output is thrown away, or appended to a log
+    file if <log_path> is given, so they can never block writing to a
+    pipe nobody reads.
+
+    Editors that have exited are waited for by a background thread,
+    so they don't linger as zombie processes; it only runs while any
+    editor does. If <max_running> is more than 0, no more than that
+    many editors started by the launcher run at once.
+    """
+
+    def __init__(self, max_running=0, log_path=None):
+        self.max_running = max_running
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.running = []
+        self.reaper_thread = None
+
+    def launch(self, cmd, creationflags=0):
+        """
+        Start a command line in the background. Raise an
+        EnvironmentError if it can't be started, or if too many
+        editors are already running.
+        """
+
+        # Only imported when needed, so the command line starts quickly.
+        import subprocess
+        with self.lock:
+            self.reap()
+            if self.max_running > 0 and len(self.running) >= self.max_running:
+                raise EnvironmentError(
+                    "{0} documents are already open; close some of them "
+                    "first".format(len(self.running)))
+
+            log = self.open_log(cmd)
+            try:
+                output = subprocess.DEVNULL if log is None else log
+                process = subprocess.Popen(cmd, creationflags=creationflags,
+                                           stdin=subprocess.DEVNULL,
+                                           stdout=output, stderr=output)
+            finally:
+                # The editor has its own copy, if it started.
+                if log is not None:
+                    log.close()
+            self.running.append(process)
+            if self.reaper_thread is None:
+                thread = self.reaper_thread = threading.Thread(
+                    target=self.reap_until_done, name="NoteBag editor reaper")
+                thread.daemon = True
+                thread.start()
+        return process
+
+    def open_log(self, cmd):
+        """
+        Open the log file for an editor's output, starting a new one
+        if it's grown too big, and note the command being run in it.
+        Return None if output isn't logged, or the log can't be
+        written.
+        """
+
+        if not self.log_path:
+            return None
+        try:
+            if os.path.getsize(self.log_path) > EDITOR_LOG_MAX_BYTES:
+                os.replace(self.log_path, self.log_path + ".1")
+        except OSError:
+            pass
+        try:
+            log = open(self.log_path, "ab")
+        except EnvironmentError:
+            return None
+        header = "== {0} {1}\n".format(time.strftime("%Y-%m-%d %H:%M:%S"),
+                                       " ".join(cmd))
+        log.write(header.encode("utf-8", "replace"))
+        log.flush()
+        return log
+
+    def reap(self):
+        """
+        Forget the editors that have exited (collecting their exit
+        status). Call with the lock held.
+        """
+
+        self.running = [process for process in self.running
+                        if process.poll() is None]
+
+    def reap_until_done(self):
+        while True:
+            time.sleep(REAP_INTERVAL_SECONDS)
+            with self.lock:
+                self.reap()
+                if not self.running:
+                    self.reaper_thread = None
+                    return
@@ -0,0 +1,89 @@
+## Notes Folder Layouts
+
+import os
+import zlib
+
+# Every note document directly in the notes folder
+FLAT = "flat"
+# Note documents in subfolders named after the first two characters
+# of their filenames, like "me/meetingnotes.rtf"
+PREFIX = "prefix"
+# Note documents spread evenly over 256 subfolders, "00" to "ff",
+# by a hash of their filenames
+HASHED = "hashed"
+LAYOUTS = (FLAT, PREFIX, HASHED)
+# How long the names of the subfolders (shards) are
+SHARD_NAME_LENGTH = 2
+SHARD_NAME_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789_")
+# Note filenames in the list of notes always use this separator, so
+# one list works on every operating system.
+NOTE_PATH_SEPARATOR = "/"
+
+
+def shard_name(note_filename, layout):
+    """
+    Return the name of the subfolder a note document with a given
+    filename belongs in, or None for the flat layout.
+    """
+
+    if layout == PREFIX:
+        prefix = note_filename.lower()[:SHARD_NAME_LENGTH]
+        return "".join(c if c in SHARD_NAME_CHARS else "_"
+                       for c in prefix).ljust(SHARD_NAME_LENGTH, "_")
+    elif layout == HASHED:
+        checksum = zlib.crc32(note_filename.lower().encode("utf-8"))
+        return "{0:02x}".format(checksum & 0xff)
+    return None
+
+def is_shard_name(dir_name):
+    """
+    Return True if a subfolder of the notes folder could be a shard
+    of one of the layouts (and so may hold note documents).
+    """
+
+    return (len(dir_name) == SHARD_NAME_LENGTH
+            and all(c in SHARD_NAME_CHARS for c in dir_name))
+
+def note_basename(note_filename):
+    """
+    Return just the filename of a note filename that may include a
+    shard, like "me/meetingnotes.rtf".
+    """
+
+    return note_filename.rpartition(NOTE_PATH_SEPARATOR)[2]
+
+def layout_note_filename(note_filename, layout):
+    """
+    Return the note filename, including its shard, where a note
+    document belongs in a layout.
+    """
+
+    note_filename = note_basename(note_filename)
+    shard = shard_name(note_filename, layout)
+    if shard is None:
+        return note_filename
+    return shard + NOTE_PATH_SEPARATOR + note_filename
+
+def note_filename_variants(note_filename):
+    """
+    Return the other note filenames a note document could have in the
+    notes folder, if it's been moved from one layout to another.
+    """
+
+    variants = []
+    for layout in LAYOUTS:
+        variant = layout_note_filename(note_filename, layout)
+        if variant != note_filename and variant not in variants:
+            variants.append(variant)
+    return variants
+
+def make_shard_dir(note_path):
+    """
+    Create the shard folder a note document is about to be written
+    into, if it doesn't exist yet.
+    """
+
+    try:
+        os.mkdir(os.path.dirname(note_path))
+    except FileExistsError:
+        pass
@@ -0,0 +1,111 @@
+## Advisory File Locking
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# How long to wait for another process to let go of a lock, in seconds
+LOCK_TIMEOUT = 30
+# How long to sleep between tries at taking a lock, at most
+MAX_LOCK_WAIT = 0.1
+
+
+class LockTimeout(EnvironmentError):
+    """
+    Raised when a lock is still held by someone else after waiting
+    for it as long as we're willing to.
+    """
+
+
+def try_lock_file(fd):
+    """
+    Try to take an exclusive advisory lock on an open file, without
+    waiting. Return True if it was taken.
+    """
+
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except (IOError, OSError):
+        return False
+    return True
+
+def unlock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """
+    An exclusive lock shared between processes (including copies of
+    NoteBag on other computers sharing the folder, where the network
+    file system supports locking) through an advisory lock on a lock
+    file.
+
+    It's a re-entrant lock within a process, so a thread holding it
+    can take it again. The operating system drops the lock if the
+    process dies, so a crash can't leave it stuck.
+    """
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+    def acquire(self):
+        """
+        Take the lock, waiting up to <timeout> seconds for other
+        processes to let go of it. Raise LockTimeout if they don't.
+        """
+
+        self.thread_lock.acquire()
+        if self.depth:
+            self.depth += 1
+            return
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            deadline = time.time() + self.timeout
+            wait = 0.001
+            while not try_lock_file(fd):
+                if time.time() >= deadline:
+                    os.close(fd)
+                    raise LockTimeout("Timed out waiting for lock {0}".format(self.path))
+                time.sleep(wait)
+                wait = min(wait * 2, MAX_LOCK_WAIT)
+        except:
+            self.thread_lock.release()
+            raise
+        self.fd = fd
+        self.depth = 1
+
+    def release(self):
+        self.depth -= 1
+        if not self.depth:
+            fd = self.fd
+            self.fd = None
+            try:
+                unlock_file(fd)
+            finally:
+                os.close(fd)
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_args):
+        self.release()
@@ -0,0 +1,319 @@
+#!/usr/bin/python -B
+"""
+NoteBag's command line: add, open, find, list, rename, delete and
+import notes, migrate the notes folder to another layout, and back up and
+restore the whole bag, without starting the GUI (or needing a
+display).
+
+Usage: python notebag_cli.py [COMMAND [ARGS...]]
+
+With no command, the NoteBag GUI is started. Run with "--help" for
+the list of commands, or "COMMAND --help" for a command's arguments.
+NoteBag must have been set up (by running it once) first.
+"""
+
+import argparse
+import os
+import sys
+
+from catalog import CONFIG_FILENAME, NoteCatalog
+from helpers import get_config_path, read_config
+from layout import LAYOUTS
+
+
+def load_catalog(search_contents=False):
+    """
+    Return a NoteCatalog with the list of notes loaded, or print an
+    error and exit if NoteBag hasn't been set up yet.
+
+    The note contents index is only loaded if <search_contents> is
+    True, and it's never updated; that's left to the GUI.
+    """
+
+    config = read_config(CONFIG_FILENAME)
+    if (not os.path.isfile(get_config_path(CONFIG_FILENAME))
+            or not config.has_option("NoteBag", "Notes Directory")
+            or not config.get("NoteBag", "Notes Directory")):
+        sys.stderr.write("NoteBag isn't set up yet; run NoteBag.py once to "
+                         "choose your notes folder.\n")
+        sys.exit(1)
+
+    catalog = NoteCatalog()
+    if not search_contents:
+        catalog.search_note_contents = False
+    try:
+        catalog.load_notes_list()
+    except (EnvironmentError, ValueError) as e:
+        sys.stderr.write("Can't load the list of notes: {0}\n".format(e))
+        sys.exit(1)
+    if catalog.content_index is not None:
+        catalog.content_index.load()
+    return catalog
+
+def find_note(catalog, note_name):
+    """
+    Return the proper name of an existing note, or print an error and
+    return None if there's no such note.
+    """
+
+    key = catalog.note_name_exists(note_name.strip("\t "))
+    if key is None:
+        sys.stderr.write("No note named '{0}'\n".format(note_name))
+    return key
+
+def confirm(question):
+    """
+    Ask a yes/no question on the terminal; anything but "y" or "yes"
+    is no.
+    """
+
+    try:
+        answer = input(question + " [y/N] ")
+    except EOFError:
+        return False
+    return answer.strip().lower() in ("y", "yes")
+
+def report_skipped(skipped):
+    """
+    Print why each of a list of (note name, reason) pairs wasn't
+    added.
+    """
+
+    for note_name, reason in skipped:
+        sys.stderr.write("Skipped '{0}': {1}\n".format(note_name, reason))
+
+
+## Commands
+def add_command(catalog, args):
+    added, skipped = catalog.add_notes(args.names)
+    for note_name in added:
+        print("Added '{0}'".format(note_name))
+    report_skipped(skipped)
+    return 0
+
+def open_command(catalog, args):
+    note_name = find_note(catalog, args.name)
+    if note_name is None:
+        return 1
+    try:
+        catalog.open_note(note_name)
+    except EnvironmentError as e:
+        sys.stderr.write("Can't open '{0}': {1}\n".format(note_name, e))
+        return 1
+    return 0
+
+def find_command(catalog, args):
+    note_names = catalog.search_note_names(args.query.strip("\t "),
+                                           all_matches=True)
+    for note_name in note_names:
+        print(note_name)
+    return 0 if note_names else 1
+
+def list_command(catalog, args):
+    for note_name in catalog.search_note_names(""):
+        print(note_name)
+    return 0
+
+def rename_command(catalog, args):
+    note_name = find_note(catalog, args.name)
+    if note_name is None:
+        return 1
+    new_note_name = args.new_name.strip("\t ")
+    if not new_note_name:
+        sys.stderr.write("The new name can't be blank\n")
+        return 1
+    existing = catalog.note_name_exists(new_note_name)
+    if existing is not None and existing != note_name:
+        sys.stderr.write("'{0}' already exists\n".format(existing))
+        return 1
+    catalog.rename_note(note_name, new_note_name)
+    print("Renamed '{0}' to '{1}'".format(note_name, new_note_name))
+    return 0
+
+def delete_command(catalog, args):
+    note_name = find_note(catalog, args.name)
+    if note_name is None:
+        return 1
+    if not args.yes and not confirm(
+            "This will remove the note document file; you cannot undo this!\n"
+            "Really delete '{0}'?".format(note_name)):
+        return 1
+    catalog.delete_note(note_name)
+    print("Deleted '{0}'".format(note_name))
+    return 0
+
+def import_command(catalog, args):
+    status = 0
+    for file_path in args.files:
+        try:
+            added, skipped = catalog.add_notes_from_file(file_path)
+        except EnvironmentError as e:
+            sys.stderr.write("Can't read {0}: {1}\n".format(file_path, e))
+            status = 1
+            continue
+        report_skipped(skipped)
+        print("Added {0} of {1} notes from {2}".format(
+                len(added), len(added) + len(skipped), file_path))
+    return status
+
+def migrate_command(catalog, args):
+    def progress(checked, moved):
+        sys.stderr.write("Checked {0} note documents, moved {1}\n".format(
+                checked, moved))
+    moved, conflicts = catalog.migrate_notes_dir(args.layout, progress)
+    for note_filename in conflicts:
+        sys.stderr.write("Couldn't move {0}: a document is already in its "
+                         "place\n".format(note_filename))
+    print("Moved {0} note documents to the {1} layout".format(moved, args.layout))
+    return 1 if conflicts else 0
+
+def show_progress(verb):
+    """
+    Return a progress(done, total) function that reports how far
+    exporting or restoring has got.
+    """
+
+    def progress(done, total):
+        sys.stderr.write("{0} {1} of {2} notes\n".format(verb, done, total))
+    return progress
+
+def export_command(catalog, args):
+    try:
+        counts = catalog.export_archive(args.archive, args.since,
+                                        show_progress("Exported"))
+    except (EnvironmentError, ValueError) as e:
+        sys.stderr.write("Can't export to {0}: {1}\n".format(args.archive, e))
+        return 1
+    print("Exported {0} notes to {1}: {2} documents written, {3} unchanged".format(
+            counts["notes"], args.archive, counts["written"], counts["unchanged"]))
+    if counts["missing"]:
+        sys.stderr.write("{0} note documents were missing from the notes "
+                         "folder\n".format(counts["missing"]))
+    return 0
+
+def restore_command(catalog, args):
+    from archive import read_manifest
+    try:
+        note_count = read_manifest(args.archive)["note_count"]
+    except (EnvironmentError, ValueError) as e:
+        sys.stderr.write("Can't restore {0}: {1}\n".format(args.archive, e))
+        return 1
+    if not (args.check or args.yes or confirm(
+            "This will replace your list of notes with the {0} notes in {1}, "
+            "and overwrite their documents!\nReally restore?".format(
+                note_count, args.archive))):
+        return 1
+
+    try:
+        problems = catalog.restore_archive(
+            args.archive, args.check,
+            show_progress("Checked" if args.check else "Restored"))
+    except (EnvironmentError, ValueError) as e:
+        sys.stderr.write("Can't restore {0}: {1}\n".format(args.archive, e))
+        return 1
+    for note_filename, problem in problems:
+        sys.stderr.write("{0}: {1}\n".format(note_filename, problem))
+    if problems:
+        sys.stderr.write("{0} note documents are damaged or missing; no "
+                         "documents were changed and the list of notes was "
+                         "left alone\n".format(len(problems)))
+        return 1
+    if args.check:
+        print("All {0} notes in {1} are intact".format(note_count, args.archive))
+    else:
+        print("Restored {0} notes from {1}".format(note_count, args.archive))
+    return 0
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="notebag",
+        description="Manage NoteBag's notes from the command line. "
+                    "With no command, start the NoteBag GUI.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    add_parser = commands.add_parser("add", help="add notes")
+    add_parser.add_argument("names", nargs="+", metavar="NAME")
+    add_parser.set_defaults(run=add_command)
+
+    open_parser = commands.add_parser("open", help="open a note in your document editor")
+    open_parser.add_argument("name", metavar="NAME")
+    open_parser.set_defaults(run=open_command)
+
+    find_parser = commands.add_parser(
+        "find", help="list the notes whose names (or, if searching note "
+                     "contents, documents) contain some text")
+    find_parser.add_argument("query", metavar="TEXT")
+    find_parser.set_defaults(run=find_command, search_contents=True)
+
+    list_parser = commands.add_parser("list", help="list all notes")
+    list_parser.set_defaults(run=list_command)
+
+    rename_parser = commands.add_parser(
+        "rename", help="give a note a new name, keeping its document")
+    rename_parser.add_argument("name", metavar="NAME")
+    rename_parser.add_argument("new_name", metavar="NEW-NAME")
+    rename_parser.set_defaults(run=rename_command)
+
+    delete_parser = commands.add_parser("delete", help="delete a note and its document")
+    delete_parser.add_argument("name", metavar="NAME")
+    delete_parser.add_argument("-y", "--yes", action="store_true",
+                               help="don't ask for confirmation")
+    delete_parser.set_defaults(run=delete_command)
+
+    import_parser = commands.add_parser(
+        "import", help="add a note for every name in text files (one per "
+                       "line) or .csv files (the first column)")
+    import_parser.add_argument("files", nargs="+", metavar="FILE")
+    import_parser.set_defaults(run=import_command)
+
+    migrate_parser = commands.add_parser(
+        "migrate", help="move the note documents into another notes folder "
+                        "layout, and switch to it")
+    migrate_parser.add_argument("layout", choices=LAYOUTS, metavar="LAYOUT",
+                                help=", ".join(LAYOUTS))
+    migrate_parser.set_defaults(run=migrate_command)
+
+    export_parser = commands.add_parser(
+        "export", help="back up the list of notes and every note document "
+                       "to a zip archive")
+    export_parser.add_argument("archive", metavar="ARCHIVE")
+    export_parser.add_argument(
+        "--since", metavar="OLD-ARCHIVE",
+        help="only copy the documents changed since an earlier archive in "
+             "the same folder, which must be kept")
+    export_parser.set_defaults(run=export_command)
+
+    restore_parser = commands.add_parser(
+        "restore", help="restore the list of notes and the note documents "
+                        "from an archive")
+    restore_parser.add_argument("archive", metavar="ARCHIVE")
+    restore_parser.add_argument("-y", "--yes", action="store_true",
+                                help="don't ask for confirmation")
+    restore_parser.add_argument("--check", action="store_true",
+                                help="only check the archive's checksums; "
+                                     "change nothing")
+    restore_parser.set_defaults(run=restore_command)
+    return parser
+
+def main(argv):
+    args = make_parser().parse_args(argv)
+    if args.command is None:
+        # The GUI, and tkinter with it, is only imported now.
+        import NoteBag
+        NoteBag.main()
+        return 0
+
+    catalog = load_catalog(getattr(args, "search_contents", False))
+    try:
+        status = args.run(catalog, args)
+    finally:
+        catalog.close()
+    if catalog.notes_writer.error is not None:
+        sys.stderr.write("Couldn't save the list of notes: {0}\n".format(
+            catalog.notes_writer.error))
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
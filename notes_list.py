@@ -0,0 +1,278 @@
+## Notes List Files
+
+import hashlib
+import io
+import os
+import pickle
+
+from integrity import (DEFAULT_CHECKSUM, is_tagged_checksum, tagged_checksum,
+                       verify_tagged_checksum)
+from journal import apply_record
+from locking import FileLock
+from notes_writer import (file_signature, move_into_place, replace_file,
+                          temp_file_path)
+
+PICKLE_PROTOCOL = 2
+# The "Notes List Checksum" setting for notes_checksum(), which older
+# versions of NoteBag used.
+LEGACY_CHECKSUM = "legacy"
+# How many times SharedNotesList.save() tries to save without holding
+# the lock while it writes
+SAVE_ATTEMPTS = 3
+
+
+def notes_checksum(notes):
+    """
+    Return the hash digest of a list of notes as a string.
+
+    This is the checksum older versions of NoteBag saved notes lists
+    with; it depends on the order of the notes in the dict.
+    """
+
+    digest = hashlib.sha1()
+    for note_name in notes:
+        note_name_bytes = note_name.encode('utf-8')
+        filename_bytes = notes[note_name].encode('utf-8')
+        digest.update(note_name_bytes)
+        digest.update(filename_bytes)
+    return digest.hexdigest()
+
+def save_notes_list(notes, file_path, checksum=DEFAULT_CHECKSUM, stamp=0):
+    """
+    Write a list of notes out to a file. Also write a checksum of the
+    notes list, so read_notes_list() can validate what it reads.
+
+    <checksum> names the checksum algorithm to use (see
+    integrity.CHECKSUMS), which checks the serialized notes list in a
+    single pass; LEGACY_CHECKSUM uses notes_checksum() instead.
+
+    <stamp> is saved along with the notes, to tell this save of the
+    notes list from others (see SharedNotesList). In the pickle
+    format it follows the pickled notes, where older versions of
+    NoteBag don't look for it.
+    """
+
+    notes_data = (pickle.dumps(notes, PICKLE_PROTOCOL)
+                  + pickle.dumps(stamp, PICKLE_PROTOCOL))
+    if checksum == LEGACY_CHECKSUM:
+        saved_checksum = notes_checksum(notes)
+    else:
+        saved_checksum = tagged_checksum(checksum, notes_data)
+    with open(file_path, "wb") as f:
+        pickle.dump(saved_checksum, f, PICKLE_PROTOCOL)
+        f.write(notes_data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def replace_notes_list(notes, file_path, backups=0, checksum=DEFAULT_CHECKSUM):
+    """
+    Like save_notes_list(), but write to a temporary file first and
+    then move it into place, so a crash mid-write can never leave a
+    truncated notes list behind. Keep <backups> older versions of the
+    notes list.
+    """
+
+    replace_file(file_path,
+                 lambda temp_path: save_notes_list(notes, temp_path, checksum),
+                 backups)
+
+def read_stamped_notes_list(file_path):
+    """
+    Read a list of notes back from a file, and return it along with
+    the stamp it was saved with (0 if it doesn't have one).
+
+    If the checksum from the file doesn't match the checksum of all of
+    the notes that were read from it, raise a ValueError.
+    """
+
+    with open(file_path, "rb") as f:
+        data = f.read()
+    stream = io.BytesIO(data)
+    try:
+        saved_checksum = pickle.load(stream)
+    except Exception:
+        # Say, a file that was only partly written
+        raise ValueError("The list of notes has been corrupted")
+    notes_data = data[stream.tell():]
+
+    if is_tagged_checksum(saved_checksum):
+        # Check the serialized notes before unpickling anything.
+        if not verify_tagged_checksum(saved_checksum, notes_data):
+            raise ValueError("The list of notes has been corrupted")
+        notes = pickle.load(stream)
+    else:
+        try:
+            notes = pickle.load(stream)
+        except Exception:
+            raise ValueError("The list of notes has been corrupted")
+        loaded_checksum = notes_checksum(notes)
+        if loaded_checksum != saved_checksum:
+            raise ValueError("The list of notes has been corrupted")
+
+    try:
+        stamp = pickle.load(stream)
+    except EOFError:
+        # Saved by an older version of NoteBag
+        stamp = 0
+    except Exception:
+        # The legacy checksum doesn't cover the stamp.
+        raise ValueError("The list of notes has been corrupted")
+    return notes, stamp
+
+def read_notes_list(file_path):
+    """
+    Read a list of notes back from a file.
+
+    If the checksum from the file doesn't match the checksum of all of
+    the notes that were read from it, raise a ValueError.
+    """
+
+    return read_stamped_notes_list(file_path)[0]
+
+
+class SharedNotesList:
+    """
+    A notes list file that several copies of NoteBag (say, on
+    computers sharing the notes folder) can save to at the same time
+    without losing each other's changes.
+
+    Rather than saving whole notes lists, save() saves changes, as
+    (op, args) pairs like journal.py's: they're applied to the newest
+    notes list in the file, and the result is stamped one higher than
+    the save it was based on. The new notes list is written to a
+    temporary file while no lock is held; it's then moved into place
+    under the notes list's lock, but only if nobody else has saved in
+    the meantime. If someone has, the changes are merged into their
+    notes list instead and the save is tried again.
+
+    The notes list as last read or saved is kept, so it's only read
+    again when someone else has saved.
+    """
+
+    def __init__(self, path, checksum=DEFAULT_CHECKSUM, backups=0):
+        self.path = path
+        self.checksum = checksum
+        self.backups = backups
+        self.lock = FileLock(path + ".lock")
+        self.notes = None
+        self.stamp = 0
+        self.signature = None
+        # Stamp of the notes list this copy of NoteBag last loaded or
+        # saved
+        self.own_stamp = None
+        # Set when a save merged in changes someone else saved, which
+        # whoever loaded the notes list hasn't seen yet
+        self.others_saved = False
+
+    def read(self):
+        """
+        Return the newest notes list, which must not be changed. The
+        lock must be held.
+
+        If the file turns out to be corrupted, fall back to its
+        newest good backup, if it has one.
+        """
+
+        signature = file_signature(self.path)
+        if self.notes is None or signature != self.signature:
+            if signature is None:
+                notes, stamp = {}, 0
+            else:
+                notes, stamp = self.read_file()
+            self.notes, self.stamp, self.signature = notes, stamp, signature
+            if self.own_stamp is not None and stamp != self.own_stamp:
+                self.others_saved = True
+        return self.notes
+
+    def read_file(self):
+        try:
+            return read_stamped_notes_list(self.path)
+        except ValueError:
+            backup = 1
+            while os.path.isfile("{0}.{1}".format(self.path, backup)):
+                backup_path = "{0}.{1}".format(self.path, backup)
+                try:
+                    notes, stamp = read_stamped_notes_list(backup_path)
+                except ValueError:
+                    backup += 1
+                    continue
+                print("The list of notes is corrupted; using {0}".format(backup_path))
+                return notes, stamp
+            raise
+
+    def load(self):
+        """
+        Return a copy of the newest notes list.
+        """
+
+        with self.lock:
+            notes = dict(self.read())
+            self.own_stamp = self.stamp
+            self.others_saved = False
+        return notes
+
+    def save(self, changes):
+        """
+        Apply a sequence of (op, args) changes to the notes list file.
+        """
+
+        for _ in range(SAVE_ATTEMPTS):
+            if self.try_save(changes):
+                return
+        # Busy with other savers; hold the lock throughout, so this
+        # try can't lose.
+        with self.lock:
+            self.try_save(changes)
+
+    def try_save(self, changes):
+        """
+        Try to save changes once, and return True if it worked.
+        """
+
+        with self.lock:
+            notes, stamp, signature = self.read_copy()
+        for op, args in changes:
+            apply_record(notes, op, args)
+        return self.try_replace(notes, stamp, signature)
+
+    def read_copy(self):
+        """
+        Return a copy of the newest notes list, with its stamp and
+        signature, for try_replace(). The lock must be held.
+        """
+
+        return dict(self.read()), self.stamp, self.signature
+
+    def save_snapshot(self, notes):
+        """
+        Replace the notes list with a copy of a whole dict of notes,
+        which must already include everything others have saved (so
+        the lock should be held while it's worked out).
+        """
+
+        with self.lock:
+            self.read()
+            self.try_replace(dict(notes), self.stamp, self.signature)
+
+    def try_replace(self, notes, stamp, signature, replaced=None):
+        """
+        Save <notes>, based on the save with <stamp>, unless the file
+        no longer has <signature>. Return True if it was saved.
+
+        If given, replaced() is called once the new notes list is in
+        place, before the lock is let go.
+        """
+
+        temp_path = temp_file_path(self.path)
+        save_notes_list(notes, temp_path, self.checksum, stamp + 1)
+        with self.lock:
+            if file_signature(self.path) != signature:
+                os.remove(temp_path)
+                return False
+            move_into_place(temp_path, self.path, self.backups)
+            self.notes = notes
+            self.stamp = self.own_stamp = stamp + 1
+            self.signature = file_signature(self.path)
+            if replaced is not None:
+                replaced()
+        return True
@@ -0,0 +1,181 @@
+## Crash-Safe, Write-Behind Saving
+
+import os
+import shutil
+import threading
+
+
+def fsync_dir(dir_path):
+    """
+    Make sure a directory's entries (say, a file that was just
+    renamed into it) are on disk, where the OS allows it.
+    """
+
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        # Windows can't open directories.
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def rotate_backups(file_path, backups):
+    """
+    Keep copies of a file as <file_path>.1 (the newest) through
+    <file_path>.<backups> (the oldest), shifting the older copies
+    along by one.
+    """
+
+    if backups < 1 or not os.path.isfile(file_path):
+        return
+    for i in range(backups - 1, 0, -1):
+        older = "{0}.{1}".format(file_path, i)
+        if os.path.isfile(older):
+            os.replace(older, "{0}.{1}".format(file_path, i + 1))
+    newest = file_path + ".1"
+    try:
+        # A hard link is free, and the original is only ever
+        # replaced, never changed in place.
+        os.link(file_path, newest)
+    except (AttributeError, OSError):
+        shutil.copy2(file_path, newest)
+
+def file_signature(file_path):
+    """
+    Return a value that changes whenever a file is replaced or
+    changed, or None if it doesn't exist.
+    """
+
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def temp_file_path(file_path):
+    """
+    Return a path for a temporary file next to a file, that no other
+    process or thread will use at the same time.
+    """
+
+    return "{0}.{1}-{2}.tmp".format(file_path, os.getpid(),
+                                    threading.current_thread().ident)
+
+def move_into_place(temp_path, file_path, backups=0):
+    """
+    Atomically replace a file with a temporary file that has already
+    been written and fsynced, keeping <backups> older versions of it.
+    """
+
+    rotate_backups(file_path, backups)
+    os.replace(temp_path, file_path)
+    fsync_dir(os.path.dirname(os.path.abspath(file_path)))
+
+def replace_file(file_path, write, backups=0):
+    """
+    Atomically replace a file with whatever write(temp_path) writes
+    out to a temporary file, which write() must fsync.
+
+    The file is only ever renamed into place, so a crash leaves
+    either the old file or the new one, never a truncated one. If
+    <backups> is more than 0, keep that many older versions of it.
+    """
+
+    temp_path = temp_file_path(file_path)
+    write(temp_path)
+    move_into_place(temp_path, file_path, backups)
+
+
+class NotesListWriter:
+    """
+    Save changes to a notes list in a background thread, so saving
+    never holds up the GUI.
+
+    Changes are (op, args) pairs, as in journal.py. Saves requested
+    while an earlier one is still being written are coalesced: all of
+    their changes are written together once the thread is free. If a
+    save fails, its changes are tried again with the next one.
+    """
+
+    def __init__(self, save):
+        # save(changes) does the actual (atomic) writing.
+        self.save = save
+        self.condition = threading.Condition()
+        self.pending = None
+        # Changes from a save that failed, to try again
+        self.unsaved = []
+        self.saving = False
+        # The exception the last save raised, if it failed
+        self.error = None
+
+        thread = threading.Thread(target=self.run, name="NoteBag notes writer")
+        thread.daemon = True
+        thread.start()
+
+    def schedule(self, changes):
+        """
+        Ask for a sequence of changes to be saved soon.
+        """
+
+        with self.condition:
+            if self.pending is None:
+                self.pending = self.unsaved
+                self.unsaved = []
+            self.pending.extend(changes)
+            self.condition.notify_all()
+
+    def retry(self):
+        """
+        Ask for the changes from a failed save to be saved again,
+        without waiting for another change.
+        """
+
+        with self.condition:
+            if self.unsaved:
+                self.schedule([])
+
+    def busy(self):
+        """
+        Return True if a save has been requested but not yet written.
+        """
+
+        with self.condition:
+            return self.pending is not None or self.saving
+
+    def flush(self):
+        """
+        Wait until every requested save has been written.
+        """
+
+        with self.condition:
+            while self.pending is not None or self.saving:
+                self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                changes = self.pending
+                self.pending = None
+                self.saving = True
+            try:
+                self.save(changes)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                self.error = e
+            else:
+                changes = []
+                self.error = None
+            with self.condition:
+                if self.pending is not None:
+                    self.pending[:0] = changes
+                else:
+                    self.unsaved = changes + self.unsaved
+                self.saving = False
+                self.condition.notify_all()
@@ -0,0 +1,200 @@
+## Notes Folder Reconciliation
+
+import os
+import pickle
+
+from content_index import strip_rtf
+from helpers import fold_case
+from layout import NOTE_PATH_SEPARATOR, is_shard_name, note_filename_variants
+from notes_writer import temp_file_path
+
+PICKLE_PROTOCOL = 2
+NOTE_EXTENSION = ".rtf"
+# Editors' lock files that can end in NOTE_EXTENSION: Word's owner
+# files ("~$note.rtf"), LibreOffice's lock files (".~lock.note.rtf#")
+# and Emacs's (".#note.rtf")
+LOCK_FILE_PREFIXES = ("~$", ".~lock.", ".#")
+# How much of a note document to read when looking for its title
+TITLE_READ_SIZE = 4096
+
+
+def is_note_file(filename):
+    """
+    Return True if a filename (without its folder) names a note
+    document, rather than an editor's lock or temporary file. Other
+    names starting with "." are notes: a note name with no ASCII
+    letters in it gets a document named just ".rtf".
+    """
+
+    return (filename.lower().endswith(NOTE_EXTENSION)
+            and not filename.startswith(LOCK_FILE_PREFIXES))
+
+def scan_note_dir(dir_path):
+    """
+    Return a sorted list of the names of the note documents (.rtf
+    files) directly in a directory, and a sorted list of the names of
+    its subfolders that could be shards (see layout.py).
+    """
+
+    note_filenames = []
+    shard_names = []
+    for entry in os.scandir(dir_path):
+        if is_note_file(entry.name):
+            if entry.is_file():
+                note_filenames.append(entry.name)
+        elif is_shard_name(entry.name) and entry.is_dir():
+            shard_names.append(entry.name)
+    note_filenames.sort()
+    shard_names.sort()
+    return note_filenames, shard_names
+
+def iter_note_files(dir_path):
+    """
+    Yield the path of every note document in a directory and its
+    shards, relative to it (like "me/meetingnotes.rtf"), reading the
+    directories as it goes rather than listing them up front.
+    """
+
+    for entry in os.scandir(dir_path):
+        if is_note_file(entry.name) and entry.is_file():
+            yield entry.name
+    # Listed afresh, in case the caller has added shards since
+    shard_names = sorted(entry.name for entry in os.scandir(dir_path)
+                         if is_shard_name(entry.name) and entry.is_dir())
+    for shard in shard_names:
+        try:
+            entries = os.scandir(os.path.join(dir_path, shard))
+        except OSError:
+            continue
+        for entry in entries:
+            if is_note_file(entry.name) and entry.is_file():
+                yield shard + NOTE_PATH_SEPARATOR + entry.name
+
+def remove_empty_shards(dir_path):
+    """
+    Remove the shards of a directory that have nothing left in them.
+    """
+
+    for entry in os.scandir(dir_path):
+        if is_shard_name(entry.name) and entry.is_dir():
+            try:
+                os.rmdir(entry.path)
+            except OSError:
+                # Not empty
+                pass
+
+def rtf_note_title(note_path):
+    """
+    Return the first line of text in an RTF note document, which
+    NoteBag's note template fills in with the note's name, or None if
+    there isn't any.
+    """
+
+    with open(note_path, "rb") as f:
+        rtf = f.read(TITLE_READ_SIZE).decode("utf-8", "replace")
+    for line in strip_rtf(rtf, line_breaks=True).split("\n"):
+        line = line.strip()
+        if line:
+            return line
+    return None
+
+
+class NotesDirScanner:
+    """
+    Lists the note documents in the notes folder, remembering each
+    directory's listing and modification time between runs, so
+    directories that haven't changed don't have to be listed again.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        # Directory path -> (mtime, sorted note filenames)
+        self.listings = {}
+
+    def load(self):
+        """
+        Load the listings saved by save(). A missing or unreadable
+        state file just means everything is listed again.
+        """
+
+        try:
+            with open(self.state_path, "rb") as f:
+                self.listings = pickle.load(f)
+        except Exception:
+            self.listings = {}
+
+    def save(self):
+        temp_path = temp_file_path(self.state_path)
+        with open(temp_path, "wb") as f:
+            pickle.dump(self.listings, f, PICKLE_PROTOCOL)
+        os.replace(temp_path, self.state_path)
+
+    def list_dir(self, dir_path):
+        """
+        Return the sorted note filenames and shard names in a
+        directory (see scan_note_dir()), listing it only if its
+        modification time has changed. Return True as well if it did
+        change.
+        """
+
+        mtime = os.stat(dir_path).st_mtime_ns
+        cached = self.listings.get(dir_path)
+        # Older versions didn't list shards.
+        if cached is not None and len(cached) == 3 and cached[0] == mtime:
+            return cached[1], cached[2], False
+        note_filenames, shard_names = scan_note_dir(dir_path)
+        self.listings[dir_path] = (mtime, note_filenames, shard_names)
+        return note_filenames, shard_names, True
+
+    def note_files(self, notes_dir):
+        """
+        Return the set of note document paths in <notes_dir> and its
+        shards, relative to it (like "me/meetingnotes.rtf"), and
+        whether any directory had changed since it was last listed.
+        """
+
+        note_filenames, shard_names, changed = self.list_dir(notes_dir)
+        note_files = set(note_filenames)
+        for shard in shard_names:
+            try:
+                note_filenames, _, shard_changed = self.list_dir(
+                    os.path.join(notes_dir, shard))
+            except OSError:
+                # Removed since the notes folder was listed
+                continue
+            changed = changed or shard_changed
+            note_files.update(shard + NOTE_PATH_SEPARATOR + note_filename
+                              for note_filename in note_filenames)
+        # Forget the listings of shards that are gone.
+        shard_paths = set(os.path.join(notes_dir, shard) for shard in shard_names)
+        for dir_path in list(self.listings):
+            if dir_path != notes_dir and dir_path not in shard_paths:
+                del self.listings[dir_path]
+                changed = True
+        return note_files, changed
+
+
+def reconcile(notes, note_files):
+    """
+    Compare a dict of notes with the set of note documents actually
+    in the notes folder, case-insensitively. Return a sorted list of
+    the note names whose documents are missing, and a sorted list of
+    the documents that aren't in the notes list.
+
+    A document that was moved to another layout's place (see
+    layout.py), without the notes list catching up yet, isn't
+    missing.
+    """
+
+    folded_files = dict((fold_case(note_file), note_file)
+                        for note_file in note_files)
+    missing = []
+    for note_name, note_filename in notes.items():
+        if folded_files.pop(fold_case(note_filename), None) is not None:
+            continue
+        for variant in note_filename_variants(note_filename):
+            if folded_files.pop(fold_case(variant), None) is not None:
+                break
+        else:
+            missing.append(note_name)
+    return sorted(missing), sorted(folded_files.values())
@@ -0,0 +1,334 @@
+## Incremental Note Name Search
+
+import bisect
+import threading
+
+from fuzzy import FuzzyIndex
+from helpers import fold_case
+
+# How many recent queries' results to keep around.
+MAX_CACHED_QUERIES = 64
+# Queries shorter than this are answered by scanning every name.
+TRIGRAM_LENGTH = 3
+# Intersecting and sorting trigram candidates costs more than a scan
+# (whose results are already sorted) once there could be more than
+# 1/TRIGRAM_MAX_FRACTION of the names to sort.
+TRIGRAM_MAX_FRACTION = 16
+
+
+def is_subsequence(short, long):
+    """
+    Return True if every character of <short> is in <long>, in order.
+    """
+
+    chars = iter(long)
+    return all(c in chars for c in short)
+
+def trigrams(s):
+    """
+    Return the set of every 3-character substring of a string.
+    """
+
+    return set(s[i:i + TRIGRAM_LENGTH]
+               for i in range(len(s) - TRIGRAM_LENGTH + 1))
+
+
+class TrigramIndex:
+    """
+    An inverted index from every trigram of a casefolded note name to
+    the (casefolded name, name) entries containing it.
+
+    Any name containing a query contains all of the query's trigrams,
+    so intersecting their posting sets gives a short list of
+    candidates to check, instead of every name.
+    """
+
+    def __init__(self, entries=()):
+        self.postings = {}
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        """
+        Add a (casefolded name, name) entry to the index.
+        """
+
+        postings = self.postings
+        for trigram in trigrams(entry[0]):
+            posting = postings.get(trigram)
+            if posting is None:
+                posting = postings[trigram] = set()
+            posting.add(entry)
+
+    def remove(self, entry):
+        """
+        Remove a (casefolded name, name) entry from the index.
+        """
+
+        postings = self.postings
+        for trigram in trigrams(entry[0]):
+            posting = postings.get(trigram)
+            if posting is not None:
+                posting.discard(entry)
+                if not posting:
+                    del postings[trigram]
+
+    def estimate(self, query):
+        """
+        Return an upper bound on the number of candidates for a
+        casefolded query, without intersecting anything.
+        """
+
+        return min(len(self.postings.get(trigram, ()))
+                   for trigram in trigrams(query))
+
+    def candidates(self, query):
+        """
+        Return the set of entries containing every trigram of a
+        casefolded query (at least TRIGRAM_LENGTH long). They still
+        have to be checked for the whole query.
+        """
+
+        postings = []
+        for trigram in trigrams(query):
+            posting = self.postings.get(trigram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+
+
+class NoteNameSearch:
+    """
+    Case-insensitive substring search over a set of note names, built
+    for search-as-you-type.
+
+    The names are casefolded and sorted once, up front, so a search
+    only has to filter. Results are remembered by query: when a query
+    grows, only the results of a shorter query it contains are
+    searched again, and when a query shrinks back to something that
+    was searched recently, its results are reused as they are.
+    Queries of TRIGRAM_LENGTH or more characters that can't be
+    narrowed that way are answered from a trigram index.
+
+    fuzzy_search() ranks the names containing the query's characters
+    in order, not necessarily together, using a fuzzy.FuzzyIndex. When
+    a recent fuzzy search found every name matching a query that the
+    new query's characters contain, in order, only those names are
+    searched again.
+
+    The trigram index is only built if <use_trigrams> is True, and the
+    fuzzy index is built up front, rather than by the first fuzzy
+    search, if <build_fuzzy_index> is True.
+
+    Searches may run on another thread than the one adding and
+    removing names.
+    """
+
+    def __init__(self, note_names=(), use_trigrams=True, build_fuzzy_index=False):
+        self.use_trigrams = use_trigrams
+        self.build_fuzzy_index = build_fuzzy_index
+        self.lock = threading.RLock()
+        self.reset(note_names)
+
+    def reset(self, note_names):
+        """
+        Replace every note name being searched.
+        """
+
+        # (casefolded name, name) pairs, in alphabetical order.
+        entries = sorted((fold_case(note_name), note_name)
+                         for note_name in note_names)
+        trigram_index = None
+        if self.use_trigrams:
+            trigram_index = TrigramIndex(entries)
+        # Otherwise, built by the first fuzzy search
+        fuzzy_index = None
+        if self.build_fuzzy_index:
+            fuzzy_index = FuzzyIndex(entries)
+        with self.lock:
+            self.entries = entries
+            self.trigram_index = trigram_index
+            self.fuzzy_index = fuzzy_index
+            self.clear_cache()
+
+    def clear_cache(self):
+        """
+        Forget the results of previous searches.
+        """
+
+        # Casefolded query -> sorted list of matching entries.
+        self.cached_results = {}
+        self.cached_queries = []
+        # (casefolded query, limit) -> best fuzzily matching names
+        self.cached_fuzzy_results = {}
+        self.cached_fuzzy_queries = []
+        # Casefolded query -> sorted indices of every entry matching
+        # it fuzzily, for the fuzzy searches that found them all
+        self.cached_fuzzy_matches = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, note_name):
+        """
+        Add a note name to the names being searched.
+        """
+
+        entry = (fold_case(note_name), note_name)
+        with self.lock:
+            i = bisect.bisect_left(self.entries, entry)
+            self.entries.insert(i, entry)
+            if self.trigram_index is not None:
+                self.trigram_index.add(entry)
+            if self.fuzzy_index is not None:
+                self.fuzzy_index.insert(i, entry)
+            self.clear_cache()
+
+    def remove(self, note_name):
+        """
+        Remove a note name from the names being searched.
+        """
+
+        entry = (fold_case(note_name), note_name)
+        with self.lock:
+            i = bisect.bisect_left(self.entries, entry)
+            if i < len(self.entries) and self.entries[i] == entry:
+                del self.entries[i]
+                if self.fuzzy_index is not None:
+                    self.fuzzy_index.delete(i)
+            if self.trigram_index is not None:
+                self.trigram_index.remove(entry)
+            self.clear_cache()
+
+    def all_names(self):
+        """
+        Return every note name, in alphabetical order.
+        """
+
+        with self.lock:
+            return [note_name for _, note_name in self.entries]
+
+    def search(self, query):
+        """
+        Return the note names containing <query> case-insensitively,
+        in alphabetical order.
+        """
+
+        query = fold_case(query)
+        if not query:
+            return self.all_names()
+
+        with self.lock:
+            matches = self.find_matches(query)
+        return [note_name for _, note_name in matches]
+
+    def find_matches(self, query):
+        """
+        Return the sorted list of entries whose casefolded names
+        contain a casefolded query.
+        """
+
+        matches = self.cached_results.get(query)
+        if matches is None:
+            candidates = self.narrowest_cached_results(query)
+            trigram_index = self.trigram_index
+            if candidates is None:
+                most_candidates = len(self.entries) // TRIGRAM_MAX_FRACTION
+            else:
+                most_candidates = len(candidates)
+            if (trigram_index is not None and len(query) >= TRIGRAM_LENGTH
+                    and trigram_index.estimate(query) < most_candidates):
+                candidates = trigram_index.candidates(query)
+                matches = sorted(entry for entry in candidates
+                                 if query in entry[0])
+            elif candidates is not None:
+                matches = [entry for entry in candidates if query in entry[0]]
+            else:
+                matches = [entry for entry in self.entries
+                           if query in entry[0]]
+            self.cache_results(query, matches)
+        return matches
+
+    def narrowest_cached_results(self, query):
+        """
+        Return the smallest cached result list for a query contained
+        in <query>, or None if there isn't one. Anything matching
+        <query> is guaranteed to be in it.
+        """
+
+        narrowest = None
+        for cached_query in self.cached_queries:
+            if cached_query in query:
+                results = self.cached_results[cached_query]
+                if narrowest is None or len(results) < len(narrowest):
+                    narrowest = results
+        return narrowest
+
+    def cache_results(self, query, matches):
+        """
+        Remember the results of a search, forgetting the oldest
+        cached search if there are too many.
+        """
+
+        self.cached_results[query] = matches
+        self.cached_queries.append(query)
+        if len(self.cached_queries) > MAX_CACHED_QUERIES:
+            oldest = self.cached_queries.pop(0)
+            del self.cached_results[oldest]
+
+    def fuzzy_search(self, query, limit=None):
+        """
+        Return the <limit> note names that best match <query>
+        fuzzily, best first (or, if <limit> is None, every note name
+        that matches it, however long that takes). If <query> is
+        empty, return every note name, in alphabetical order.
+        """
+
+        query = fold_case(query)
+        if not query:
+            return self.all_names()
+
+        with self.lock:
+            key = (query, limit)
+            note_names = self.cached_fuzzy_results.get(key)
+            if note_names is None:
+                if self.fuzzy_index is None:
+                    self.fuzzy_index = FuzzyIndex(self.entries)
+                if limit is None:
+                    # More than could ever match, with no cap on how
+                    # many matches are looked at
+                    indices, complete = self.fuzzy_index.top_matches(
+                        query, len(self.entries) + 1,
+                        self.narrowest_fuzzy_matches(query), float("inf"))
+                else:
+                    indices, complete = self.fuzzy_index.top_matches(
+                        query, limit, self.narrowest_fuzzy_matches(query))
+                note_names = [self.entries[i][1] for i in indices]
+                self.cached_fuzzy_results[key] = note_names
+                self.cached_fuzzy_queries.append(key)
+                if complete:
+                    self.cached_fuzzy_matches[query] = sorted(indices)
+                if len(self.cached_fuzzy_queries) > MAX_CACHED_QUERIES:
+                    oldest = self.cached_fuzzy_queries.pop(0)
+                    del self.cached_fuzzy_results[oldest]
+                    if oldest[0] not in (cached_query for cached_query, _
+                                         in self.cached_fuzzy_queries):
+                        self.cached_fuzzy_matches.pop(oldest[0], None)
+        return list(note_names)
+
+    def narrowest_fuzzy_matches(self, query):
+        """
+        Return the smallest cached list of every entry matching a
+        query whose characters <query> contains in order, or None if
+        there isn't one. Anything matching <query> fuzzily is
+        guaranteed to be in it.
+        """
+
+        narrowest = None
+        for cached_query, matches in self.cached_fuzzy_matches.items():
+            if ((narrowest is None or len(matches) < len(narrowest))
+                    and is_subsequence(cached_query, query)):
+                narrowest = matches
+        return narrowest
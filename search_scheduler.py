@@ -0,0 +1,124 @@
+## Background Search-As-You-Type
+
+import threading
+import traceback
+
+# How often to check for finished searches, in milliseconds
+POLL_MS = 15
+
+
+class SearchScheduler:
+    """
+    Run searches for the text in an entry box on a worker thread,
+    without running a search for every keystroke.
+
+    A search only starts once no new query has been requested for
+    <delay_ms> milliseconds, so a burst of typing costs one search.
+    Only the newest query is ever searched next; a query that was
+    waiting for the worker is dropped when a newer one arrives, and
+    results for anything but the newest query are thrown away. The
+    newest results are handed to show_results(query, results) on the
+    Tk main loop, via <widget>'s after().
+    """
+
+    def __init__(self, widget, search, show_results, delay_ms=100):
+        self.widget = widget
+        self.search = search
+        self.show_results = show_results
+        self.delay_ms = delay_ms
+
+        # Number of the newest query; a search's results are only
+        # shown if they are for the newest query.
+        self.generation = 0
+        self.delay_id = None
+        self.polling = False
+
+        self.condition = threading.Condition()
+        # (generation, query) waiting for the worker, if any
+        self.next_query = None
+        self.searching = False
+        # (generation, query, results) waiting to be shown, if any
+        self.finished = None
+
+        worker = threading.Thread(target=self.run_worker,
+                                  name="NoteBag search")
+        worker.daemon = True
+        worker.start()
+
+    def request(self, query):
+        """
+        Ask for <query> to be searched, once typing pauses. Any
+        earlier query that hasn't been shown yet is cancelled.
+        """
+
+        self.cancel()
+        self.delay_id = self.widget.after(self.delay_ms, self.start_search,
+                                          self.generation, query)
+
+    def cancel(self):
+        """
+        Cancel every query that hasn't been shown yet.
+        """
+
+        with self.condition:
+            self.generation += 1
+            self.next_query = None
+        if self.delay_id is not None:
+            self.widget.after_cancel(self.delay_id)
+            self.delay_id = None
+
+    def busy(self):
+        """
+        Return True if a requested search hasn't been shown yet.
+        """
+
+        return self.delay_id is not None or self.polling
+
+    def start_search(self, generation, query):
+        """
+        Hand a query to the worker thread.
+        """
+
+        self.delay_id = None
+        with self.condition:
+            self.next_query = (generation, query)
+            self.condition.notify()
+        if not self.polling:
+            self.polling = True
+            self.widget.after(POLL_MS, self.poll)
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                while self.next_query is None:
+                    self.condition.wait()
+                generation, query = self.next_query
+                self.next_query = None
+                self.searching = True
+            try:
+                results = self.search(query)
+            except Exception:
+                # Keep the worker alive for the next query.
+                traceback.print_exc()
+                generation = None
+            with self.condition:
+                self.searching = False
+                if generation == self.generation:
+                    self.finished = (generation, query, results)
+
+    def poll(self):
+        """
+        Show the newest query's results if they're ready, and keep
+        checking while a search is still on its way.
+        """
+
+        with self.condition:
+            finished = self.finished
+            self.finished = None
+            busy = self.next_query is not None or self.searching
+        if finished is not None and finished[0] == self.generation:
+            self.show_results(finished[1], finished[2])
+        if busy:
+            self.widget.after(POLL_MS, self.poll)
+        else:
+            self.polling = False
@@ -0,0 +1,187 @@
+## SQLite Notes Catalog
+
+from contextlib import contextmanager
+
+SQLITE_CATALOG_EXTENSION = ".sqlite"
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS notes (name TEXT NOT NULL, filename TEXT NOT NULL)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS notes_by_name ON notes (name COLLATE NOCASE)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS notes_by_filename ON notes (filename COLLATE NOCASE)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    ]
+# The meta key recording that a notes list file has been imported
+IMPORTED_KEY = "imported"
+# Matches a note name exactly, using the case-insensitive index to
+# find it.
+EXACT_NAME = "name = ? COLLATE NOCASE AND name = ?"
+
+
+def is_sqlite_catalog_path(file_path):
+    """
+    Return True if a notes list file is an SQLite catalog, going by
+    its extension.
+    """
+
+    return file_path.lower().endswith(SQLITE_CATALOG_EXTENSION)
+
+
+class SqliteNotesCatalog:
+    """
+    A list of notes kept in an SQLite database, so adding or deleting
+    a note only writes that note, in its own transaction.
+
+    This is only a different way of storing the list of notes: it's
+    still loaded into memory whole, as with the other storage modes,
+    and looking a note up by name or filename, or listing the notes in
+    order, is done there, not with SQL queries. (With the whole list in
+    memory anyway, a query per lookup only made them slower.)
+    Case-insensitive unique indexes keep two notes from sharing a name
+    or filename. (SQLite's NOCASE only folds ASCII letters.)
+    """
+
+    def __init__(self, path, timeout=30):
+        # Imported here, so NoteBag starts quicker when it doesn't
+        # use SQLite.
+        import sqlite3
+        self.path = path
+        # Transactions are started explicitly by transaction(). The
+        # GUI opens the catalog on a loading thread, then only uses it
+        # from the main one.
+        self.connection = sqlite3.connect(path, timeout=timeout,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.transaction() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block of statements as one transaction, committing it if
+        the block finishes and rolling it back if it raises.
+        """
+
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+
+    def load(self):
+        """
+        Return every note, as a dict of note names to note filenames.
+        """
+
+        return dict(self.connection.execute("SELECT name, filename FROM notes"))
+
+    def add_many(self, notes, skip_existing=False):
+        """
+        Add a sequence of (note name, note filename) pairs in a single
+        transaction. If <skip_existing> is True, quietly skip notes
+        whose name or filename is already taken, rather than rolling
+        the whole transaction back. Return the number of notes added.
+        """
+
+        verb = "INSERT OR IGNORE" if skip_existing else "INSERT"
+        with self.transaction() as cursor:
+            before = self.count(cursor)
+            cursor.executemany(verb + " INTO notes (name, filename) VALUES (?, ?)",
+                               notes)
+            return self.count(cursor) - before
+
+    def record_many(self, changes):
+        """
+        Apply a sequence of (op, args) changes, in the form the notes
+        journal records them (see journal.py), in a single transaction.
+
+        The changes have already been made to the list of notes in
+        memory, so a note another instance of NoteBag added under the
+        same name (or renamed to it) in the meantime is replaced,
+        rather than failing the whole transaction.
+        """
+
+        with self.transaction() as cursor:
+            for op, args in changes:
+                if op == "add":
+                    cursor.execute("INSERT OR REPLACE INTO notes (name, filename) "
+                                   "VALUES (?, ?)", args)
+                elif op == "delete":
+                    cursor.execute("DELETE FROM notes WHERE " + EXACT_NAME,
+                                   (args[0], args[0]))
+                elif op == "rename":
+                    cursor.execute("UPDATE OR REPLACE notes SET name = ? WHERE " + EXACT_NAME,
+                                   (args[1], args[0], args[0]))
+                elif op == "move":
+                    cursor.execute("UPDATE OR REPLACE notes SET filename = ? WHERE " + EXACT_NAME,
+                                   (args[1], args[0], args[0]))
+                else:
+                    raise ValueError("Unknown notes catalog operation '{0}'".format(op))
+
+    def replace_all(self, notes):
+        """
+        Replace every note with those in a dict of notes, in a single
+        transaction.
+        """
+
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM notes")
+            cursor.executemany("INSERT INTO notes (name, filename) VALUES (?, ?)",
+                               notes.items())
+
+    def imported_from(self):
+        """
+        Return the path of the notes list file that was imported into
+        the catalog, or None if none has been.
+        """
+
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?",
+                                      (IMPORTED_KEY,)).fetchone()
+        return row[0] if row else None
+
+    def import_notes(self, notes, source_path):
+        """
+        Add a dict of notes read from a notes list file, skipping any
+        already in the catalog, and record that the file has been
+        imported, in a single transaction.
+        """
+
+        with self.transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO notes (name, filename) VALUES (?, ?)",
+                               notes.items())
+            cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           (IMPORTED_KEY, source_path))
+
+    def data_version(self):
+        """
+        Return a number that changes whenever another connection
+        commits a change to the catalog.
+        """
+
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def count(self, cursor=None):
+        cursor = cursor or self.connection
+        return cursor.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+
+def import_notes_list(notes, db_path):
+    """
+    Copy a dict of notes into an SQLite catalog at <db_path>, in one
+    transaction, skipping notes that are already there. Return the
+    number of notes imported.
+    """
+
+    catalog = SqliteNotesCatalog(db_path)
+    try:
+        return catalog.add_many(notes.items(), skip_existing=True)
+    finally:
+        catalog.close()
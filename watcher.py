@@ -0,0 +1,326 @@
+## Notes Folder Watching
+
+import os
+import select
+import struct
+import threading
+
+from layout import NOTE_PATH_SEPARATOR, is_shard_name, note_basename
+from reconcile import is_note_file
+
+# Kinds of change reported by the watchers
+CREATED = "created"
+DELETED = "deleted"
+MODIFIED = "modified"
+# Too much changed at once to report it all; everything should be
+# checked again.
+OVERFLOWED = "overflowed"
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+INOTIFY_EVENT = struct.Struct("iIII")
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+
+
+class Watcher:
+    """
+    The common parts of the notes folder watchers.
+
+    A watcher reports changes to the note documents (.rtf files) in a
+    directory and its shards (see layout.py), and to a few other files
+    in it named in <filenames>, as (kind, filename) pairs collected by
+    changes(). Filenames in shards include the shard, like
+    "me/meetingnotes.rtf".
+    """
+
+    def __init__(self, dir_path, filenames):
+        self.dir_path = dir_path
+        self.filenames = frozenset(filenames)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        thread = self.thread = threading.Thread(target=self.run,
+                                                name="NoteBag watcher")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def watches(self, filename):
+        """
+        Return True if changes to a file in the directory should be
+        reported.
+        """
+
+        if filename in self.filenames:
+            return True
+        return is_note_file(note_basename(filename))
+
+    def report(self, kind, filename):
+        with self.lock:
+            self.pending.append((kind, filename))
+
+    def changes(self):
+        """
+        Return and forget the changes seen since the last call.
+        """
+
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        return pending
+
+
+class PollingWatcher(Watcher):
+    """
+    Watch a directory and its shards by checking them every
+    <interval> seconds. Each directory is only listed when its
+    modification time changes; the other watched files are checked
+    with a stat() each.
+    """
+
+    def __init__(self, dir_path, filenames, interval=2.0):
+        Watcher.__init__(self, dir_path, filenames)
+        self.interval = interval
+        # Shard name ("" for the directory itself) -> (mtime,
+        # {filename: (mtime, size)} of every watched file in it,
+        # shard names in it)
+        self.listings = {}
+        # Filename -> (mtime, size) of every watched file
+        self.snapshot = {}
+
+    def list_dir(self, shard):
+        """
+        Return the (mtime, size) of every watched file directly in the
+        directory (if <shard> is "") or one of its shards, by
+        filename, and the names of the shards in it.
+        """
+
+        dir_path = self.dir_path
+        prefix = ""
+        if shard:
+            dir_path = os.path.join(dir_path, shard)
+            prefix = shard + NOTE_PATH_SEPARATOR
+        files = {}
+        shard_names = []
+        for entry in os.scandir(dir_path):
+            filename = prefix + entry.name
+            if self.watches(filename):
+                if entry.is_file():
+                    stat = entry.stat()
+                    files[filename] = (stat.st_mtime_ns, stat.st_size)
+            elif not shard and is_shard_name(entry.name) and entry.is_dir():
+                shard_names.append(entry.name)
+        return files, shard_names
+
+    def take_snapshot(self):
+        """
+        Return the (mtime, size) of every watched file, by filename,
+        listing only the directories whose modification times have
+        changed since the last snapshot.
+        """
+
+        listings = {}
+        mtime = os.stat(self.dir_path).st_mtime_ns
+        cached = self.listings.get("")
+        if cached is not None and cached[0] == mtime:
+            # Nothing was created, deleted or renamed; only the other
+            # watched files can have been changed in place.
+            files = dict(cached[1])
+            for filename in self.filenames:
+                try:
+                    stat = os.stat(os.path.join(self.dir_path, filename))
+                except OSError:
+                    files.pop(filename, None)
+                else:
+                    files[filename] = (stat.st_mtime_ns, stat.st_size)
+            listings[""] = (mtime, files, cached[2])
+        else:
+            listings[""] = (mtime,) + self.list_dir("")
+
+        for shard in listings[""][2]:
+            try:
+                mtime = os.stat(os.path.join(self.dir_path, shard)).st_mtime_ns
+                cached = self.listings.get(shard)
+                if cached is not None and cached[0] == mtime:
+                    listings[shard] = cached
+                else:
+                    listings[shard] = (mtime,) + self.list_dir(shard)
+            except OSError:
+                # Removed since the directory was listed
+                pass
+        self.listings = listings
+
+        snapshot = {}
+        for _, files, _ in listings.values():
+            snapshot.update(files)
+        return snapshot
+
+    def check(self):
+        """
+        Compare the directory with its last snapshot, and report the
+        differences.
+        """
+
+        old_snapshot = self.snapshot
+        snapshot = self.snapshot = self.take_snapshot()
+        for filename, signature in snapshot.items():
+            old_signature = old_snapshot.get(filename)
+            if old_signature is None:
+                self.report(CREATED, filename)
+            elif old_signature != signature:
+                self.report(MODIFIED, filename)
+        for filename in old_snapshot:
+            if filename not in snapshot:
+                self.report(DELETED, filename)
+
+    def run(self):
+        self.snapshot = self.take_snapshot()
+        while not self.stopping.wait(self.interval):
+            try:
+                self.check()
+            except OSError:
+                # The directory may be briefly unavailable (say, on a
+                # network drive); try again next time.
+                pass
+
+
+class InotifyWatcher(Watcher):
+    """
+    Watch a directory and its shards with Linux's inotify, so changes
+    are reported as they happen, at no cost while nothing changes.
+    """
+
+    def __init__(self, dir_path, filenames):
+        Watcher.__init__(self, dir_path, filenames)
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        libc = self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+        # Watch descriptor -> shard name ("" for the directory itself)
+        self.watch_shards = {}
+        try:
+            self.add_watch("")
+            for entry in os.scandir(dir_path):
+                if is_shard_name(entry.name) and entry.is_dir():
+                    self.add_watch(entry.name)
+        except OSError:
+            os.close(fd)
+            raise
+
+    def add_watch(self, shard):
+        """
+        Start watching the directory, or one of its shards.
+        """
+
+        dir_path = self.dir_path
+        if shard:
+            dir_path = os.path.join(dir_path, shard)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(self.ctypes.get_errno(), "inotify_add_watch failed")
+        self.watch_shards[wd] = shard
+
+    def watch_new_shard(self, shard):
+        """
+        Start watching a shard that was just created, reporting the
+        note documents that got into it before the watch did.
+        """
+
+        try:
+            self.add_watch(shard)
+            for entry in os.scandir(os.path.join(self.dir_path, shard)):
+                filename = shard + NOTE_PATH_SEPARATOR + entry.name
+                if self.watches(filename):
+                    self.report(CREATED, filename)
+        except OSError:
+            # Out of inotify watches, or already gone; have
+            # everything checked.
+            self.report(OVERFLOWED, None)
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                readable, _, _ = select.select([self.fd], [], [], 1.0)
+                if readable:
+                    self.read_events()
+        finally:
+            os.close(self.fd)
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            filename = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.report(OVERFLOWED, None)
+                continue
+            shard = self.watch_shards.get(wd)
+            if mask & IN_IGNORED:
+                # The shard was removed.
+                self.watch_shards.pop(wd, None)
+                continue
+            elif shard is None or not filename:
+                continue
+            elif mask & IN_ISDIR:
+                if shard or not is_shard_name(filename):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_new_shard(filename)
+                elif mask & IN_MOVED_FROM:
+                    # Its note documents went with it, unreported.
+                    self.report(OVERFLOWED, None)
+                continue
+
+            if shard:
+                filename = shard + NOTE_PATH_SEPARATOR + filename
+            if not self.watches(filename):
+                continue
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self.report(CREATED, filename)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.report(DELETED, filename)
+            elif mask & (IN_MODIFY | IN_CLOSE_WRITE):
+                self.report(MODIFIED, filename)
+
+
+def make_watcher(dir_path, filenames, interval=2.0):
+    """
+    Return the best watcher available for a directory: an
+    InotifyWatcher on Linux, or else a PollingWatcher checking every
+    <interval> seconds.
+    """
+
+    if os.name == "posix":
+        try:
+            return InotifyWatcher(dir_path, filenames)
+        except (AttributeError, OSError, TypeError):
+            # Not Linux, or out of inotify watches
+            pass
+    return PollingWatcher(dir_path, filenames, interval)
@@ -0,0 +1,229 @@
+## Custom Tk Widgets
+
+# Widgets
+from tkinter import Frame, Listbox, Scrollbar
+from tkinter import font
+# Constants
+from tkinter import BOTH, END, LEFT, Y
+
+
+class VirtualListbox(Frame):
+    """
+    A scrolling list of strings that only puts the rows that fit in
+    the window into its Tk Listbox, so showing a list of any length
+    costs the same.
+
+    It stands in for a Listbox with a Scrollbar: curselection() and
+    get() work with positions in the whole list, and bind() binds
+    events on the rows.
+    """
+
+    def __init__(self, master, **listbox_options):
+        Frame.__init__(self, master)
+        self.items = []
+        # Position in self.items of the top visible row
+        self.top = 0
+        # Number of rows that fit in the listbox
+        self.rows = 1
+        # Position in self.items of the selected row, if any
+        self.selected = None
+
+        listbox = self.listbox = Listbox(self, exportselection=False,
+                                         **listbox_options)
+        listbox.pack(side=LEFT, fill=BOTH, expand=True)
+        scrollbar = self.scrollbar = Scrollbar(self, command=self.yview)
+        scrollbar.pack(side=LEFT, fill=Y)
+
+        listbox.bind("<Configure>", self.listbox_resized)
+        listbox.bind("<<ListboxSelect>>", self.listbox_selected)
+        # Scroll the list ourselves, rather than letting the listbox
+        # scroll through the few rows it has.
+        listbox.bind("<MouseWheel>", self.mouse_wheel)
+        listbox.bind("<Button-4>", self.mouse_wheel)
+        listbox.bind("<Button-5>", self.mouse_wheel)
+        listbox.bind("<B1-Leave>", lambda event: "break")
+        listbox.bind("<Up>", lambda event: self.move_selection(-1))
+        listbox.bind("<Down>", lambda event: self.move_selection(1))
+        listbox.bind("<Prior>", lambda event: self.move_selection(-self.rows))
+        listbox.bind("<Next>", lambda event: self.move_selection(self.rows))
+        listbox.bind("<Home>", lambda event: self.move_selection(-len(self.items)))
+        listbox.bind("<End>", lambda event: self.move_selection(len(self.items)))
+
+    ## Listbox Stand-ins
+    def bind(self, sequence=None, func=None, add=None):
+        """
+        Bind an event on the list's rows.
+        """
+
+        return self.listbox.bind(sequence, func, add)
+
+    def focus_set(self):
+        self.listbox.focus_set()
+
+    def curselection(self):
+        """
+        Return a tuple of the position of the selected item, or an
+        empty tuple if nothing is selected.
+        """
+
+        if self.selected is None:
+            return ()
+        return (self.selected,)
+
+    def get(self, index):
+        """
+        Return the item at a position in the list.
+        """
+
+        return self.items[index]
+
+    def size(self):
+        return len(self.items)
+
+    ## List Contents
+    def set_items(self, items):
+        """
+        Replace the items in the list, and scroll back to the top.
+        """
+
+        self.items = items
+        self.top = 0
+        self.selected = None
+        self.refresh()
+
+    def update_items(self, items):
+        """
+        Replace the items in the list, keeping the scroll position, and
+        keeping the selected item selected if it's still in the list.
+        """
+
+        selected_item = None
+        if self.selected is not None:
+            selected_item = self.items[self.selected]
+        self.items = items
+        self.top = max(0, min(self.top, len(items) - self.rows))
+        self.selected = None
+        if selected_item is not None:
+            try:
+                self.selected = items.index(selected_item)
+            except ValueError:
+                pass
+        self.refresh()
+
+    def extend_items(self, items):
+        """
+        Add items to the end of the list, in place, keeping the scroll
+        position and the selection.
+        """
+
+        self.items.extend(items)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Put the visible items into the listbox, and update the
+        selection and the scrollbar to match.
+        """
+
+        listbox = self.listbox
+        top = self.top
+        visible = self.items[top:top + self.rows]
+        listbox.delete(0, END)
+        if visible:
+            listbox.insert(END, *visible)
+
+        selected = self.selected
+        if selected is not None and top <= selected < top + len(visible):
+            listbox.selection_set(selected - top)
+            listbox.activate(selected - top)
+
+        count = len(self.items)
+        if count:
+            self.scrollbar.set(float(top) / count,
+                               float(top + len(visible)) / count)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    ## Scrolling
+    def scroll_to(self, top):
+        """
+        Make the item at position <top> the top visible row, as near
+        as possible.
+        """
+
+        top = max(0, min(int(top), len(self.items) - self.rows))
+        if top != self.top:
+            self.top = top
+            self.refresh()
+
+    def see(self, index):
+        """
+        Scroll the list just enough to show the item at <index>.
+        """
+
+        if index < self.top:
+            self.scroll_to(index)
+        elif index >= self.top + self.rows:
+            self.scroll_to(index - self.rows + 1)
+
+    def yview(self, *args):
+        """
+        Scroll the list the way a Scrollbar's command asks to.
+        """
+
+        if not args:
+            return
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * len(self.items))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.rows
+            self.scroll_to(self.top + amount)
+
+    def mouse_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.top - 3)
+        else:
+            self.scroll_to(self.top + 3)
+        return "break"
+
+    ## Selection
+    def move_selection(self, amount):
+        """
+        Move the selection up or down the list by <amount> items,
+        scrolling to keep it visible.
+        """
+
+        if not self.items:
+            return "break"
+        if self.selected is None:
+            selected = self.top
+        else:
+            selected = self.selected + amount
+        self.selected = max(0, min(selected, len(self.items) - 1))
+        self.see(self.selected)
+        self.refresh()
+        return "break"
+
+    def listbox_selected(self, event):
+        selections = self.listbox.curselection()
+        if selections:
+            self.selected = self.top + int(selections[0])
+
+    def listbox_resized(self, event):
+        """
+        Work out how many rows fit in the listbox now that its size
+        has changed.
+        """
+
+        listbox = self.listbox
+        line_height = (font.Font(font=listbox.cget("font")).metrics("linespace")
+                       + 1 + 2 * int(listbox.cget("selectborderwidth")))
+        border = 2 * (int(listbox.cget("borderwidth"))
+                      + int(listbox.cget("highlightthickness")))
+        rows = max(1, (event.height - border) // line_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.top = max(0, min(self.top, len(self.items) - rows))
+            self.refresh()